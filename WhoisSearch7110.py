@@ -1,24 +1,36 @@
 import streamlit as st
 from streamlit_option_menu import option_menu
 import pandas as pd
-import requests
+import numpy as np
 import time
-from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
-import socket
-import struct
-import ipaddress
-from urllib.parse import quote
 import math
 import altair as alt 
 import json 
 import io 
-import re 
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict, Counter
+
+# --- ルックアップエンジン (Streamlit非依存・CLIと共通) ---
+from whois_engine import (
+    MODE_SETTINGS, RATE_LIMIT_WAIT_SECONDS, COUNTRY_CODE_TO_NUMERIC_ISO, COUNTRY_JP_NAME,
+    get_tor_exit_node_store, get_cidr_cache, rate_limiters, provider_stats,
+    concurrency_controllers, concurrency_decision_log, resolve_mode_name,
+    get_rdap_bootstrap_registry, rdap_range_cache, OFFLINE_DB_PATH, get_offline_database, dns_resolver, ptr_resolver,
+    is_valid_ip, is_ipv4, ingest_targets, get_copy_target,
+    get_authoritative_rir_link, create_secondary_links,
+    group_results_by_isp, IncrementalResultAggregator,
+    EXPORT_DIR, RESULT_COLUMNS, StreamedUploadTable, build_results_table,
+    SearchJobCheckpoint, list_search_jobs, search_job_manager,
+)
 
 # --- Excelグラフ生成用ライブラリ ---
 from openpyxl import Workbook
 from openpyxl.utils.dataframe import dataframe_to_rows
 from openpyxl.chart import BarChart, Reference, Series
 from openpyxl.styles import Font, PatternFill, Alignment, Border, Side
+from openpyxl.cell import WriteOnlyCell
 
 # ページ設定
 st.set_page_config(layout="wide", page_title="検索大臣", page_icon="🌐")
@@ -37,313 +49,27 @@ except FileNotFoundError:
     IS_PUBLIC_MODE = False
 # ==========================================
 
-# --- 設定 ---
-MODE_SETTINGS = {
-    "安定性重視 (2.5秒待機/単一スレッド)": {
-        "MAX_WORKERS": 1, 
-        "DELAY_BETWEEN_REQUESTS": 2.5 
-    },
-    "速度優先 (1.4秒待機/2スレッド)": {
-        "MAX_WORKERS": 2, 
-        "DELAY_BETWEEN_REQUESTS": 1.4 
-    }
-}
-IP_API_URL = "http://ip-api.com/json/{ip}?fields=status,country,countryCode,isp,org,query,message" # orgを追加
-IPINFO_API_URL = "https://ipinfo.io/{ip}?token={token}" # Proモード用
-RDAP_BOOTSTRAP_URL = "https://rdap.apnic.net/ip/{ip}" # RDAP用
-
-RATE_LIMIT_WAIT_SECONDS = 120 
-  
-RIR_LINKS = {
-    'RIPE': 'https://apps.db.ripe.net/db-web-ui/#/query?searchtext={ip}',
-    'ARIN': 'https://search.arin.net/rdap/?query={ip}',
-    'APNIC': 'https://wq.apnic.net/static/search.html',
-    'JPNIC': 'https://www.nic.ad.jp/ja/whois/ja-gateway.html',
-    'AFRINIC': 'https://www.afrinic.net/whois',
-    'ICANN Whois': 'https://lookup.icann.org/',
-}
-
-SECONDARY_TOOL_BASE_LINKS = {
-    'VirusTotal': 'https://www.virustotal.com/',
-    'Whois.com': 'https://www.whois.com/',
-    'Who.is': 'https://who.is/',
-    'DomainSearch.jp': 'https://www.domainsearch.jp/',
-    'Aguse': 'https://www.aguse.jp/',
-    'IP2Proxy': 'https://www.ip2proxy.com/',
-    'DNS Checker': 'https://dnschecker.org/',
-    'DNSlytics': 'https://dnslytics.com/',
-    'IP Location': 'https://iplocation.io/',
-    'CP-WHOIS': 'https://doco.cph.jp/whoisweb.php',
-    }
+# 🆕 検索結果テーブルの1ページあたり表示件数
+RESULTS_PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
 
-COUNTRY_CODE_TO_RIR = {
-    'JP': 'JPNIC', 'CN': 'APNIC', 'AU': 'APNIC', 'KR': 'APNIC', 'IN': 'APNIC',
-    'ID': 'APNIC', 'MY': 'APNIC', 'NZ': 'APNIC', 'SG': 'APNIC',
-    'TH': 'APNIC', 'VN': 'APNIC', 'PH': 'APNIC', 'PK': 'APNIC', 
-    'BD': 'APNIC', 'HK': 'APNIC', 'TW': 'APNIC', 'NP': 'APNIC', 'LK': 'APNIC',
-    'MO': 'APNIC', 
-    'US': 'ARIN', 'CA': 'ARIN',
-    'ZA': 'AFRINIC', 'EG': 'AFRINIC', 'NG': 'AFRINIC',
-    'KE': 'AFRINIC', 'DZ': 'AFRINIC', 'MA': 'AFRINIC', 'GH': 'AFRINIC', 
-    'CM': 'AFRINIC', 'TN': 'AFRINIC', 'ET': 'AFRINIC', 'TZ': 'AFRINIC',
-    'DE': 'RIPE', 'FR': 'RIPE', 'GB': 'RIPE', 'RU': 'RIPE',
-    'NL': 'RIPE', 'IT': 'RIPE', 'ES': 'RIPE', 'PL': 'RIPE', 
-    'TR': 'RIPE', 'UA': 'RIPE', 'SA': 'RIPE', 'IR': 'RIPE', 
-    'CH': 'RIPE', 'SE': 'RIPE', 'NO': 'RIPE', 'DK': 'RIPE', 
-    'BE': 'RIPE', 'AT': 'RIPE', 'GR': 'RIPE', 'PT': 'RIPE',
-    'IE': 'RIPE', 'FI': 'RIPE', 'CZ': 'RIPE', 'RO': 'RIPE',
-    'HU': 'RIPE', 'IL': 'RIPE', 'KZ': 'RIPE', 'BG': 'RIPE',
-    'HR': 'RIPE', 'RS': 'RIPE', 'AE': 'RIPE', 'QA': 'RIPE',
-}
-
-COUNTRY_CODE_TO_NUMERIC_ISO = {
-    'AF': 4, 'AL': 8, 'DZ': 12, 'AS': 16, 'AD': 20, 'AO': 24, 'AI': 660, 'AQ': 10, 'AG': 28, 'AR': 32,
-    'AM': 51, 'AW': 533, 'AU': 36, 'AT': 40, 'AZ': 31, 'BS': 44, 'BH': 48, 'BD': 50, 'BB': 52, 'BY': 112,
-    'BE': 56, 'BZ': 84, 'BJ': 204, 'BM': 60, 'BT': 64, 'BO': 68, 'BA': 70, 'BW': 72, 'BV': 74, 'BR': 76,
-    'VG': 92, 'IO': 86, 'BN': 96, 'BG': 100, 'BF': 854, 'BI': 108, 'KH': 116, 'CM': 120, 'CA': 124, 'CV': 132,
-    'KY': 136, 'CF': 140, 'TD': 148, 'CL': 152, 'CN': 156, 'CX': 162, 'CC': 166, 'CO': 170, 'KM': 174, 'CG': 178,
-    'CD': 180, 'CK': 184, 'CO': 170, 'CR': 188, 'HR': 191, 'CU': 192, 'CY': 196, 'CZ': 203, 'DK': 208, 'DJ': 262, 'DM': 212,
-    'DO': 214, 'EC': 218, 'EG': 818, 'SV': 222, 'GQ': 226, 'ER': 232, 'EE': 233, 'ET': 231, 'FK': 238, 'FO': 234,
-    'FJ': 242, 'FI': 246, 'FR': 250, 'GF': 254, 'PF': 258, 'TF': 260, 'GA': 266, 'GM': 270, 'GE': 268, 'DE': 276,
-    'GH': 288, 'GI': 292, 'GR': 300, 'GL': 304, 'GD': 308, 'GP': 312, 'GU': 316, 'GT': 320, 'GN': 324, 'GW': 624,
-    'GY': 328, 'HT': 332, 'HM': 334, 'VA': 336, 'HN': 340, 'HK': 344, 'HU': 348, 'IS': 352, 'IN': 356, 'ID': 360,
-    'IR': 364, 'IQ': 368, 'IE': 372, 'IL': 376, 'IT': 380, 'CI': 384, 'JM': 388, 'JP': 392, 'JO': 400, 'KZ': 398,
-    'KE': 404, 'KI': 296, 'KP': 408, 'KR': 410, 'KW': 414, 'KG': 417, 'LA': 418, 'LV': 428, 'LB': 422, 'LS': 426,
-    'LR': 430, 'LY': 434, 'LI': 438, 'LT': 440, 'LU': 442, 'MO': 446, 'MK': 807, 'MG': 450, 'MW': 454, 'MY': 458,
-    'MV': 462, 'ML': 466, 'MT': 470, 'MH': 584, 'MQ': 474, 'MR': 478, 'MU': 480, 'YT': 175, 'MX': 484, 'FM': 583,
-    'MD': 498, 'MC': 492, 'MN': 496, 'MS': 500, 'MA': 504, 'MZ': 508, 'MM': 104, 'NA': 516, 'NR': 520, 'NP': 524,
-    'NL': 528, 'AN': 530, 'NC': 540, 'NZ': 554, 'NI': 558, 'NE': 562, 'NG': 566, 'NU': 570, 'NF': 574, 'MP': 580,
-    'NO': 578, 'OM': 512, 'PK': 586, 'PW': 585, 'PS': 275, 'PA': 591, 'PG': 598, 'PY': 600, 'PE': 604, 'PH': 608,
-    'PN': 612, 'PL': 616, 'PT': 620, 'PR': 630, 'QA': 634, 'RE': 638, 'RO': 642, 'RU': 643, 'RW': 646, 'SH': 654,
-    'KN': 659, 'LC': 662, 'PM': 666, 'VC': 670, 'WS': 882, 'SM': 674, 'ST': 678, 'SA': 682, 'SN': 686, 'RS': 688,
-    'SC': 690, 'SL': 694, 'SG': 702, 'SK': 703, 'SI': 705, 'SB': 90, 'SO': 706, 'ZA': 710, 'GS': 239, 'ES': 724,
-    'LK': 144, 'SD': 736, 'SR': 740, 'SJ': 744, 'SZ': 748, 'SE': 752, 'CH': 756, 'SY': 760, 'TW': 158, 'TJ': 762,
-    'TZ': 834, 'TH': 764, 'TL': 626, 'TG': 768, 'TK': 772, 'TO': 776, 'TT': 780, 'TN': 788, 'TR': 792, 'TM': 795,
-    'TC': 796, 'TV': 798, 'UG': 800, 'UA': 804, 'AE': 784, 'GB': 826, 'US': 840, 'UM': 581, 'UY': 858, 'UZ': 860,
-    'VU': 548, 'VE': 862, 'VN': 704, 'VI': 850, 'WF': 876, 'EH': 732, 'YE': 887, 'ZM': 894, 'ZW': 716
-}
-
-# --- ISP名称の日本語マッピング (企業名統一版) ---
-# ここは「完全一致」で見つかるもの
-ISP_JP_NAME = {
-    # --- NTT Group ---
-    'NTT Communications Corporation': 'NTTドコモビジネス', 
-    'NTT COMMUNICATIONS CORPORATION': 'NTTドコモビジネス',
-    'NTT DOCOMO BUSINESS,Inc.': 'NTTドコモビジネス',
-    'NTT DOCOMO, INC.': 'NTTドコモ',
-    'NTT PC Communications, Inc.': 'NTTPCコミュニケーションズ',
-    
-    # --- KDDI Group ---
-    'Kddi Corporation': 'KDDI',
-    'KDDI CORPORATION': 'KDDI',
-    'DION': 'KDDI',
-    'Dion': 'KDDI',
-    'dion': 'KDDI',
-    'Chubu Telecommunications Co., Inc.': '中部テレコミュニケーション',
-    'Chubu Telecommunications Company, Inc.': '中部テレコミュニケーション',
-    'Hokkaido Telecommunication Network Co., Inc.': 'HOTnet',
-    'Energia Communications, Inc.': 'エネコム',
-    'STNet, Inc.': 'STNet',
-    'QTNet, Inc.': 'QTNet',
-    'BIGLOBE Inc.': 'ビッグローブ',
-    
-    # --- SoftBank Group ---
-    'SoftBank Corp.': 'ソフトバンク',
-    'Yahoo Japan Corporation': 'LINEヤフー',
-    'LY Corporation': 'LINEヤフー',
-    'LINE Corporation': 'LINEヤフー',
-    
-    # --- Rakuten Group ---
-    'Rakuten Group, Inc.': '楽天グループ',
-    'Rakuten Mobile, Inc.': '楽天モバイル',
-    'Rakuten Communications Corp.': '楽天コミュニケーションズ',
-    
-    # --- Sony Group ---
-    'Sony Network Communications Inc.': 'ソニーネットワークコミュニケーションズ',
-    'So-net Entertainment Corporation': 'ソニーネットワークコミュニケーションズ', 
-    'So-net Corporation': 'ソニーネットワークコミュニケーションズ',
-    
-    # --- Major ISPs / VNEs ---
-    'Internet Initiative Japan Inc.': 'IIJ',
-    'NIFTY Corporation': 'ニフティ',
-    'FreeBit Co., Ltd.': 'フリービット',
-    'TOKAI Communications Corporation': 'TOKAIコミュニケーションズ',
-    'DREAM TRAIN INTERNET INC.': 'ドリーム・トレイン・インターネット (DTI)',
-    'ASAHI Net, Inc.': '朝日ネット',
-    'Asahi Net': '朝日ネット',
-    'Optage Inc.': 'オプテージ',
-    'Jupiter Telecommunications Co., Ltd.': 'J:COM', 
-    'JCOM Co., Ltd.': 'J:COM',
-    'JCN': 'J:COM', 
-    'SAKURA Internet Inc.': 'さくらインターネット',
-    'GMO Internet, Inc.': 'GMOインターネット',
-    'INTERNET MULTIFEED CO.': 'インターネットマルチフィード',
-    'IDC Frontier Inc.': 'IDCフロンティア',
-    
-    # --- Others ---
-    'ARTERIA Networks Corporation': 'アルテリア・ネットワークス',
-    'UCOM Corporation': 'アルテリア・ネットワークス',
-    'VECTANT Ltd.': 'アルテリア・ネットワークス',
-    'KIBI Cable Television Co., Ltd.': '吉備ケーブルテレビ',
-}
-
-# --- 🆕 強力な名寄せルール (ハードコーディング辞書) ---
-# 小文字・正規化されたISP名に対して、部分一致で検索し、強制変換する
-ISP_REMAP_RULES = [
-    # J:COM系 (古いJCN表記などを全てJ:COMへ統合)
-    ('jcn', 'J:COM'),
-    ('jupiter', 'J:COM'),
-    ('cablenet', 'J:COM'),
-    ('tsuchiura cable', 'J:COM'),
-    ('kawayu', 'J:COM'), 
-    
-    # KDDI系
-    ('dion', 'KDDI'),
-    ('au one', 'KDDI (au one net)'),
-    ('kddi', 'KDDI'),
-
-    # 電力系・その他
-    ('k-opti', 'オプテージ'),
-    ('ctc', '中部テレコミュニケーション'),
-    ('commufa', '中部テレコミュニケーション'),
-    ('vectant', 'アルテリア・ネットワークス'),
-    ('ucom', 'アルテリア・ネットワークス'),
-    ('arteria', 'アルテリア・ネットワークス'),
-    ('softbank', 'ソフトバンク'),
-    ('bbtec', 'ソフトバンク'),
-    ('ocn', 'OCN'),
-    ('ntt', 'NTTグループ'), 
-    ('infosphere', 'NTTPC (InfoSphere)'),
-    ('wakwak', 'NTT-ME (WAKWAK)'),
-    ('plala', 'NTTドコモ (ぷらら)'),
-    ('so-net', 'ソニーネットワークコミュニケーションズ'),
-    ('nuro', 'ソニーネットワークコミュニケーションズ (NURO)'),
-    ('biglobe', 'ビッグローブ'),
-    ('dti', 'DTI'),
-    ('iij', 'IIJ'),
-    ('transix', 'インターネットマルチフィード (transix)'),
-    ('mfeed', 'インターネットマルチフィード'),
-    ('v6plus', 'JPNE (v6プラス)'),
-    ('jpne', 'JPNE'),
-    ('en ne', '楽天モバイル'), 
-    ('rakuten', '楽天グループ'),
-]
-
-# 正規化関数: 小文字化し、カンマ(,)とピリオド(.)を除去する
-def normalize_isp_key(text):
-    if not text:
-        return ""
-    return text.lower().replace(',', '').replace('.', '').strip()
-
-# 検索用にキーを正規化した辞書を作成
-ISP_JP_NAME_NORMALIZED = {normalize_isp_key(k): v for k, v in ISP_JP_NAME.items()}
-
-# --- 匿名化・プロキシ判定用データ ---
-
-@st.cache_data(ttl=86400, show_spinner=False)
-def fetch_tor_exit_nodes():
-    terminal = st.empty()
-    log_lines = []
-    
-    def update_log(new_line, color="#00FF41"):
-        log_lines.append(f"<span style='color:{color};'>[SYS] {new_line}</span>")
-        display_text = "<br>".join(log_lines[-5:])
-        terminal.markdown(f"""
-            <div style="background-color: rgba(13, 2, 8, 0.9); border: 1px solid #FF0055; padding: 15px; border-radius: 8px; font-family: 'Courier New', Courier, monospace; font-size: 14px; line-height: 1.3; box-shadow: 0 0 20px rgba(255, 0, 85, 0.4); margin-bottom: 20px;">
-                <div style="color: #FF0055; font-weight: bold; margin-bottom: 5px; font-size: 10px; border-bottom: 1px solid #FF0055;">ENCRYPTED DATA STREAMING...</div>
-                {display_text}
-            </div>
-        """, unsafe_allow_html=True)
-        time.sleep(0.3)
-
-    update_log("BOOTING NEURAL LINK...")
-    update_log("DECRYPTING EXIT NODE MANIFEST...")
-    
-    try:
-        url = "https://check.torproject.org/exit-addresses"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        
-        update_log("HANDSHAKE SUCCESSFUL.", "#00FFFF")
-        
-        exit_ips = set()
-        for line in response.text.splitlines():
-            if line.startswith("ExitAddress"):
-                parts = line.split()
-                if len(parts) >= 2:
-                    exit_ips.add(parts[1])
-        
-        update_log(f"NODES LOADED: {len(exit_ips)} UNITS", "#00FFFF")
-        update_log("SESSION SECURED. SYSTEM ONLINE.", "#00FF41")
-        time.sleep(1.0)
-        terminal.empty()
-        return exit_ips
-        
-    except Exception as e:
-        update_log(f"CRITICAL ERROR: {e}", "#FF0000")
-        time.sleep(2.0)
-        terminal.empty()
-        return set()
-
-HOSTING_VPN_KEYWORDS = [
-    "hosting", "datacenter", "vps", "cloud", "server", "vpn", "proxy", "dedi",
-    "amazon technologies", "amazon.com", "google llc", "google cloud", "microsoft corporation", "azure",
-    "oracle cloud", "alibaba", "tencent", "huawei", "digitalocean", "linode", "vultr", "ovh", "hetzner",
-    "m247", "proweb", "choopa", "leaseweb", "datacamp", "ip-volume", "flyservers", 
-    "performive", "hostroyale", "packet exchange", "xtom", "tzulo", "psychz", 
-    "franantech", "buyvm", "melbicom", "pfcloud", "epyc", "layerhost",
-    "akamai", "cloudflare", "fastly", "cdn77", "imperva", "incapsula", "cloudfront",
-    "expressvpn", "nordvpn", "proton", "mullvad", "private internet access", "windscribe",
-    "cyberghost", "torguard", "vyprvpn", "purevpn"
-]
-
-def detect_proxy_vpn_tor(ip, isp_name, tor_nodes):
-    isp_lower = isp_name.lower()
-    if ip in tor_nodes: return "Tor Node"
-    if "icloud" in isp_lower or "private relay" in isp_lower: return "iCloud Private Relay"
-    privacy_keywords = ["vpn", "proxy", "applied privacy", "privacy foundation", "calyx institute", "foundation for applied privacy"]
-    if any(kw in isp_lower for kw in privacy_keywords): return "VPN/Proxy (Named)"
-    if any(kw in isp_lower for kw in HOSTING_VPN_KEYWORDS):
-        if any(cdn in isp_lower for cdn in ["cloudflare", "akamai", "fastly", "cloudfront"]): return "CDN/Proxy"
-        return "Hosting/DataCenter"
-    # 修正: Residential/Business -> Standard Connection
-    return "Standard Connection"
-
-# 🆕 強化されたISP名寄せロジック
-def get_jp_names(english_isp, country_code):
-    if not english_isp:
-        return "N/A", COUNTRY_JP_NAME.get(country_code, country_code)
-
-    normalized_input = normalize_isp_key(english_isp)
-    jp_isp = english_isp # デフォルトは英語のまま
-
-    # 1. 完全一致 (高速)
-    if english_isp in ISP_JP_NAME:
-        jp_isp = ISP_JP_NAME[english_isp]
-    elif normalized_input in ISP_JP_NAME_NORMALIZED:
-        jp_isp = ISP_JP_NAME_NORMALIZED[normalized_input]
-    else:
-        # 2. 部分一致 (名寄せルール適用)
-        # ルールリストの上から順にチェックし、ヒットしたら即採用
-        found = False
-        for keyword, mapped_name in ISP_REMAP_RULES:
-            if keyword in normalized_input:
-                jp_isp = mapped_name
-                found = True
-                break
-        
-        # 3. どのルールにも合致しなければ、元の英語名を返す
+# 🆕 検索中のリアルタイム集計の再描画間隔 (秒)。データが変化していなければ再描画しない
+LIVE_DASHBOARD_REFRESH_SECONDS = 1.0
+LIVE_DASHBOARD_REFRESH_OPTIONS = [0.5, 1.0, 2.0, 5.0, 10.0]
 
-    jp_country = COUNTRY_JP_NAME.get(country_code, country_code)
-    return jp_isp, jp_country
+# 🆕 この行数を超えるExcel出力は write-only (ストリーミング) モードで生成する (メモリ使用量を一定に保つ)
+EXCEL_STREAMING_ROW_THRESHOLD = 50000
+EXCEL_STREAMING_CHUNK_ROWS = 10000
 
-@st.cache_resource
-def get_session():
-    session = requests.Session()
-    session.headers.update({"User-Agent": "WhoisBatchTool/2.1 (+PythonStreamlitApp)"})
-    return session
+# 🆕 元データ結合をDataFrameとして画面に展開する上限行数。
+# 超える場合は結合データを常駐させず、CSV保存・分析付きExcelともアップロードファイルからチャンク単位で生成する
+MERGED_VIEW_MAX_ROWS = EXCEL_STREAMING_ROW_THRESHOLD
 
-session = get_session()
+# 🆕 ダウンロード用ファイル (CSV/Excel/HTML) をセッション内に保持する合計サイズの上限 (古いものから破棄)
+# 一時ファイルに書き出した成果物もサイズに含める。上限を超える1件だけは直近の成果物として保持する
+ARTIFACT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 🆕 集約モードで1行に表示するCIDRの最大数 (全件はダウンロードから取得)
+CIDR_DISPLAY_LIMIT = 5
 
 @st.cache_data
 def get_world_map_data():
@@ -357,431 +83,11 @@ def get_world_map_data():
 WORLD_MAP_GEOJSON = get_world_map_data()
 
 
-# --- ヘルパー関数群 ---
-def clean_ocr_error_chars(target):
-    cleaned_target = target
-    cleaned_target = cleaned_target.replace('Ⅱ', '11')
-    cleaned_target = cleaned_target.replace('I', '1')
-    cleaned_target = cleaned_target.replace('l', '1')
-    cleaned_target = cleaned_target.replace('|', '1')
-    cleaned_target = cleaned_target.replace('O', '0')
-    cleaned_target = cleaned_target.replace('o', '0')
-    cleaned_target = cleaned_target.replace('S', '5')
-    cleaned_target = cleaned_target.replace('s', '5')
-    if ':' not in cleaned_target:
-        cleaned_target = cleaned_target.replace('A', '4')
-        cleaned_target = cleaned_target.replace('a', '4')
-        cleaned_target = cleaned_target.replace('B', '8')
-    return cleaned_target
-
-def is_valid_ip(target):
-    try:
-        ipaddress.ip_address(target)
-        return True
-    except ValueError:
-        return False
-
-def is_ipv4(target):
-    try:
-        ipaddress.IPv4Address(target)
-        return True
-    except ValueError:
-        return False
-
-def ip_to_int(ip):
-    try:
-        if is_ipv4(ip):
-            return struct.unpack("!I", socket.inet_aton(ip))[0]
-        return 0
-    except OSError:
-        return 0
-
-def get_cidr_block(ip, netmask_range=(8, 24)):
-    try:
-        ip_obj = ipaddress.ip_address(ip)
-        if ip_obj.version == 4:
-            netmask = netmask_range[1] 
-            network = ipaddress.ip_network(f'{ip}/{netmask}', strict=False)
-            return str(network)
-        elif ip_obj.version == 6:
-            netmask = 48
-            network = ipaddress.ip_network(f'{ip}/{netmask}', strict=False)
-            return str(network)
-        return None
-    except ValueError:
-        return None
-
-def get_authoritative_rir_link(ip, country_code):
-    rir_name = COUNTRY_CODE_TO_RIR.get(country_code)
-    if rir_name and rir_name in RIR_LINKS:
-        encoded_ip = quote(ip, safe='')
-        if rir_name in ['RIPE', 'ARIN']:
-            link_url = RIR_LINKS[rir_name].format(ip=encoded_ip)
-            return f"[{rir_name}]({link_url})"
-        elif rir_name in ['JPNIC', 'APNIC', 'LACNIC', 'AFRINIC']:
-            link_url = RIR_LINKS[rir_name]  
-            return f"[{rir_name} (手動検索)]({link_url})"
-    return f"[Whois (汎用検索 - APNIC窓口)]({RIR_LINKS.get('APNIC', 'https://wq.apnic.net/static/search.html')})"
-
-def get_copy_target(ip_display):
-    if not ip_display: return ""
-    return str(ip_display).split(' - ')[0].split(' ')[0]
-
-def create_secondary_links(target):
-    encoded_target = quote(target, safe='')
-    is_ip = is_valid_ip(target)
-    is_ipv6 = is_ip and not is_ipv4(target)
-
-    who_is_url = f'https://who.is/whois-ip/ip-address/{encoded_target}' if is_ip else f'https://who.is/whois/{encoded_target}'
-    dns_checker_url = ''
-    dns_checker_key = ''
-
-    if is_ip:
-        dns_checker_path = 'ipv6-whois-lookup.php' if is_ipv6 else 'ip-whois-lookup.php'
-        dns_checker_url = f'https://dnschecker.org/{dns_checker_path}?query={encoded_target}'
-        dns_checker_key = 'DNS Checker (手動 - IPv6)' if is_ipv6 else 'DNS Checker'
-    else:
-        dns_checker_url = f'https://dnschecker.org/whois-lookup.php?query={encoded_target}'
-        dns_checker_key = 'DNS Checker (ドメイン)'
-
-    all_links = {
-        'VirusTotal': f'https://www.virustotal.com/gui/search/{encoded_target}',
-        'Aguse': f'https://www.aguse.jp/?url={encoded_target}',
-        'Whois.com': f'https://www.whois.com/whois/{encoded_target}',
-        'DomainSearch.jp': f'https://www.domainsearch.jp/whois/?q={encoded_target}',
-        'Who.is': who_is_url,
-        'IP2Proxy': f'https://www.ip2proxy.com/{encoded_target}',
-        'DNSlytics (手動)': 'https://dnslytics.com/whois-lookup/',
-        'IP Location': f'https://iplocation.io/ip/{encoded_target}',
-        'CP-WHOIS (手動)': 'https://doco.cph.jp/whoisweb.php',
-    }
-
-    if dns_checker_url:
-        all_links[dns_checker_key] = dns_checker_url
-
-    if is_ipv6:
-        links = {
-            'VirusTotal': all_links['VirusTotal'],
-            'DomainSearch.jp': all_links['DomainSearch.jp'],
-            dns_checker_key: all_links[dns_checker_key],
-            'IP2Proxy': all_links['IP2Proxy'],
-            'DNSlytics (手動)': all_links['DNSlytics (手動)'],
-            'IP Location': all_links['IP Location'],
-            'CP-WHOIS (手動)': all_links['CP-WHOIS (手動)'],
-        }
-    else:
-        links = all_links
-
-    link_html = ""
-    for name, url in links.items():
-        link_html += f"[{name}]({url}) | "
-    return link_html.rstrip(' | ')
-
-# 🆕 RDAPデータ取得関数 (公式台帳への照会)
-def fetch_rdap_data(ip):
-    try:
-        url = RDAP_BOOTSTRAP_URL.format(ip=ip)
-        # RDAPはリダイレクトされることが多いため allow_redirects=True
-        response = session.get(url, timeout=5, allow_redirects=True)
-        if response.status_code == 200:
-            data = response.json()
-            # RDAPのレスポンス形式から組織名を探す (nameやremarks)
-            network_name = data.get('name', '')
-            
-            # 詳細な記述がある場合もあるのでremarksも見るが、まずはnameを採用
-            return network_name
-    except:
-        pass
-    return None
-
-# 🆕 Proモード用 API取得関数 (ipinfo.io) - 改良版
-def get_ip_details_pro(ip, token, tor_nodes):
-    result = {
-        'Target_IP': ip, 'ISP': 'N/A', 'ISP_JP': 'N/A', 'Country': 'N/A', 'Country_JP': 'N/A', 
-        'CountryCode': 'N/A', 'RIR_Link': 'N/A', 'Secondary_Security_Links': 'N/A', 'Status': 'N/A'
-    }
-    try:
-        url = IPINFO_API_URL.format(ip=ip, token=token)
-        response = session.get(url, timeout=10)
-        
-        if response.status_code == 429:
-             result['Status'] = 'Error: Rate Limit (Pro)'
-             return result
-
-        response.raise_for_status()
-        data = response.json()
-        
-        # --- 基本情報の取得 ---
-        org_raw = data.get('org', '')
-        isp_name = re.sub(r'^AS\d+\s+', '', org_raw) if org_raw else 'N/A'
-        
-        result['ISP'] = isp_name
-        result['CountryCode'] = data.get('country', 'N/A')
-        result['Country'] = result['CountryCode']
-        result['RIR_Link'] = get_authoritative_rir_link(ip, result['CountryCode'])
-        result['Status'] = 'Success (Pro API)'
-        
-        # 名寄せ処理
-        jp_isp, jp_country = get_jp_names(result['ISP'], result['CountryCode'])
-        result['ISP_JP'] = jp_isp
-        result['Country_JP'] = jp_country
-
-        # --- 🛡️ 判定ロジックの分岐 (ipinfoのprivacy情報を活用) ---
-        privacy_data = data.get('privacy', {})
-        
-        if privacy_data:
-            # --- パターンA: ipinfoの公式判定を採用 ---
-            detected_types = []
-            if privacy_data.get('vpn', False):
-                detected_types.append("VPN")
-            if privacy_data.get('proxy', False):
-                detected_types.append("Proxy")
-            if privacy_data.get('tor', False):
-                detected_types.append("Tor Node")
-            if privacy_data.get('hosting', False):
-                detected_types.append("Hosting")
-            if privacy_data.get('relay', False): # iCloud Private Relayなど
-                detected_types.append("Relay")
-            
-            if detected_types:
-                # 複数の性質を持つ場合もあるので結合 (例: "VPN, Hosting")
-                result['Proxy_Type'] = ", ".join(detected_types)
-            else:
-                result['Proxy_Type'] = "" # 何も検知されなければ一般回線扱い
-                
-        else:
-            # --- パターンB: privacyデータがない場合 (無料プラン等) ---
-            # 従来通り、ツール独自のISP名判定ロジックを使用
-            proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
-            is_anonymous = (proxy_type != "Standard Connection")
-            result['Proxy_Type'] = f"{proxy_type}" if is_anonymous else ""
-        
-    except Exception as e:
-        result['Status'] = f'Error: Pro API ({type(e).__name__})'
-    
-    result['Secondary_Security_Links'] = create_secondary_links(ip)
-    return result
-
-# --- API通信関数 (Main) ---
-def get_ip_details_from_api(ip, cidr_cache_snapshot, delay_between_requests, rate_limit_wait_seconds, tor_nodes, use_rdap, api_key=None):
-    
-    # 1. Proモード (APIキーあり) の場合
-    if api_key:
-        result = get_ip_details_pro(ip, api_key, tor_nodes)
-        
-        # RDAPオプションが有効なら、Proモードでも追記する
-        if use_rdap:
-            rdap_result = fetch_rdap_data(ip)
-            if rdap_result:
-                result['ISP'] = f"{result['ISP']} [RDAP: {rdap_result}]"
-        
-        return result, None
-
-    # 2. 通常モード (ip-api.com)
-    result = {
-        'Target_IP': ip, 'ISP': 'N/A', 'ISP_JP': 'N/A', 'Country': 'N/A', 'Country_JP': 'N/A', 
-        'CountryCode': 'N/A', 'RIR_Link': 'N/A', 'Secondary_Security_Links': 'N/A', 'Status': 'N/A'
-    }
-    new_cache_entry = None
-
-    cidr_block = get_cidr_block(ip)
-    
-    if cidr_block and cidr_block in cidr_cache_snapshot:
-        cached_data = cidr_cache_snapshot[cidr_block]
-        if time.time() - cached_data['Timestamp'] < 86400:
-            result['ISP'] = cached_data['ISP']
-            result['Country'] = cached_data['Country']
-            result['CountryCode'] = cached_data['CountryCode']
-            result['Status'] = "Success (Cache)" 
-            jp_isp, jp_country = get_jp_names(result['ISP'], result['CountryCode'])
-            proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
-            is_anonymous = (proxy_type != "Standard Connection")
-            result['ISP_JP'] = jp_isp
-            result['Proxy_Type'] = f"{proxy_type}" if is_anonymous else ""
-            result['Country_JP'] = jp_country
-            return result, None 
-
-    try:
-        time.sleep(delay_between_requests) 
-
-        url = IP_API_URL.format(ip=ip)
-        response = session.get(url, timeout=45)
-        
-        if response.status_code == 429:
-            defer_until = time.time() + rate_limit_wait_seconds
-            result['Status'] = 'Error: Rate Limit (429)'
-            result['Defer_Until'] = defer_until
-            result['Secondary_Security_Links'] = create_secondary_links(ip)
-            return result, new_cache_entry 
-        
-        response.raise_for_status()
-        data = response.json()
-        
-        if data.get('status') == 'success':
-            country_code = data.get('countryCode', 'N/A') 
-
-            # ISP名またはOrg名を採用
-            raw_isp = data.get('isp', 'N/A')
-            raw_org = data.get('org', '')
-            
-            # Org情報がある場合は、ISP情報と併記または優先度判定
-            combined_name = raw_isp
-            if raw_org and raw_org != raw_isp:
-                combined_name = f"{raw_isp} / {raw_org}"
-            
-            result['ISP'] = combined_name
-            result['Country'] = data.get('country', 'N/A')
-            result['CountryCode'] = data.get('countryCode', 'N/A')
-            result['RIR_Link'] = get_authoritative_rir_link(ip, country_code)
-            status_type = "IPv6 API" if not is_ipv4(ip) else "IPv4 API"
-            
-            # --- 🆕 RDAP併用ロジック ---
-            rdap_name = ""
-            if use_rdap:
-                rdap_result = fetch_rdap_data(ip)
-                if rdap_result:
-                    rdap_name = rdap_result
-                    result['ISP'] = f"{result['ISP']} [RDAP: {rdap_name}]"
-
-            result['Status'] = f'Success ({status_type})'
-            
-            # 名寄せ処理
-            jp_isp, jp_country = get_jp_names(result['ISP'], country_code)
-            
-            proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
-            is_anonymous = (proxy_type != "Standard Connection")
-            result['ISP_JP'] = jp_isp
-            result['Proxy_Type'] = f"{proxy_type}" if is_anonymous else ""
-            result['Country_JP'] = jp_country
-            
-            if cidr_block:
-                new_cache_entry = {
-                    cidr_block: {
-                    'ISP': result['ISP'], # RDAP情報込みでキャッシュする
-                    'Country': result['Country'],
-                    'CountryCode': result['CountryCode'],
-                    'Timestamp': time.time()
-                    }
-                }
-            
-        elif data.get('status') == 'fail':
-            result['Status'] = f"API Fail: {data.get('message', 'Unknown Fail')}"
-            result['RIR_Link'] = get_authoritative_rir_link(ip, 'N/A')
-            
-        else:
-            result['Status'] = f"API Error: Unknown Response"
-            result['RIR_Link'] = get_authoritative_rir_link(ip, 'N/A')
-            
-    except requests.exceptions.RequestException as e:
-        result['Status'] = f'Error: Network/Timeout ({type(e).__name__})'
-        
-    result['Secondary_Security_Links'] = create_secondary_links(ip)
-    return result, new_cache_entry
-
-def get_domain_details(domain):
-    icann_link = f"[ICANN Whois (手動検索)]({RIR_LINKS['ICANN Whois']})"
-    return {
-        'Target_IP': domain, 'ISP': 'Domain/Host', 'Country': 'N/A', 'CountryCode': 'N/A',
-        'RIR_Link': icann_link,
-        'Secondary_Security_Links': create_secondary_links(domain),
-        'Status': 'Success (Domain)'
-    }
-
-def get_simple_mode_details(target):
-    if is_valid_ip(target):
-        rir_link_content = f"[Whois (汎用検索 - APNIC窓口)]({RIR_LINKS['APNIC']})"
-    else:
-        rir_link_content = f"[ICANN Whois (手動検索)]({RIR_LINKS['ICANN Whois']})"
-        
-    return {
-        'Target_IP': target, 
-        'ISP': 'N/A (簡易モード)', 
-        'Country': 'N/A (簡易モード)',
-        'CountryCode': 'N/A',
-        'RIR_Link': rir_link_content,
-        'Secondary_Security_Links': create_secondary_links(target),
-        'Status': 'Success (簡易モード)' 
-    }
-
-# --- ヘルパー関数群 ---
-
-def group_results_by_isp(results):
-    grouped = {}
-    final_grouped_results = []
-    non_aggregated_results = []
-    successful_results = [res for res in results if res['Status'].startswith('Success')]
-
-    for res in successful_results:
-        is_ip = is_valid_ip(res['Target_IP'])
-        if not is_ip or not is_ipv4(res['Target_IP']) or res['ISP'] == 'N/A' or res['Country'] == 'N/A' or res['ISP'] == 'N/A (簡易モード)':
-            if res['Status'].startswith('Success (IPv4 CIDR Cache)'):
-                non_aggregated_results.append(res)
-            else:
-                non_aggregated_results.append(res)
-            continue
-        
-        key = (res['ISP'], res['CountryCode']) 
-        
-        if key not in grouped:
-            grouped[key] = {
-                'IP_Ints': [], 'IPs_List': [], 'RIR_Link': res['RIR_Link'],
-                'Secondary_Security_Links': res['Secondary_Security_Links'],
-                'ISP': res['ISP'], 
-                'Country': res['Country'], 
-                'Status': res['Status'],
-                'ISP_JP': res.get('ISP_JP', 'N/A'),
-                'Country_JP': res.get('Country_JP', 'N/A')
-            }
-        ip_int = ip_to_int(res['Target_IP'])
-        if ip_int != 0:
-            grouped[key]['IP_Ints'].append(ip_int)
-            grouped[key]['IPs_List'].append(res['Target_IP'])
-        else:
-            res['Status'] = 'Error: IPv4 Int Conversion Failed'
-            non_aggregated_results.append(res)
-
-    non_aggregated_results.extend([res for res in results if not res['Status'].startswith('Success')])
-    
-    for key, data in grouped.items():
-        if not data['IP_Ints']: 
-            continue
-            
-        sorted_ip_ints = sorted(data['IP_Ints'])
-        min_int = sorted_ip_ints[0]
-        max_int = sorted_ip_ints[-1]
-        count = len(data['IPs_List'])
-        try:
-            min_ip = str(ipaddress.IPv4Address(min_int))
-            max_ip = str(ipaddress.IPv4Address(max_int))
-        except ValueError:
-            min_ip = data['IPs_List'][0]
-            max_ip = data['IPs_List'][-1]
-        
-        target_ip_display = min_ip if count == 1 else f"{min_ip} - {max_ip} (x{count} IPs)"
-        status_display = data['Status'] if count == 1 else f"Aggregated ({count} IPs)"
-        
-        final_grouped_results.append({
-            'Target_IP': target_ip_display, 
-            'Country': data['Country'], 
-            'Country_JP': data['Country_JP'], 
-            'ISP': data['ISP'],
-            'ISP_JP': data['ISP_JP'], 
-            'RIR_Link': data['RIR_Link'], 
-            'Secondary_Security_Links': data['Secondary_Security_Links'],
-            'Status': status_display
-        })
-    
-    final_grouped_results.extend(non_aggregated_results)
-
-    return final_grouped_results
-
 # --- リアルタイム集計関数 ---
-def summarize_in_realtime(raw_results):
-    isp_counts = {}
-    country_counts = {}
-    country_code_counts = {}
-
-    target_frequency = st.session_state.get('target_freq_map', {})
+def summarize_in_realtime(raw_results, include_full=True):
+    # 🆕 前回以降に届いた結果だけをカウンタへ反映する (毎回の全件再集計をやめる)
+    aggregator = st.session_state.setdefault('result_aggregator', IncrementalResultAggregator())
+    aggregator.sync(raw_results, st.session_state.get('target_freq_map', {}))
 
     st.session_state['debug_summary'] = {} 
 
@@ -791,49 +97,18 @@ def summarize_in_realtime(raw_results):
         'Country': pd.Series(dtype='str')
     })
 
-    success_ipv4 = [
-        r for r in raw_results 
-        if r['Status'].startswith('Success') and is_ipv4(r['Target_IP'])
-    ]
-
-    for r in success_ipv4:
-        ip = r.get('Target_IP')
-        frequency = target_frequency.get(ip, 1) 
-
-        isp_name = r.get('ISP_JP', r.get('ISP', 'N/A'))
-        country_name = r.get('Country_JP', r.get('Country', 'N/A'))
-        cc = r.get('CountryCode', 'N/A')
-        
-        if isp_name and isp_name not in ['N/A', 'N/A (簡易モード)']:
-            isp_counts[isp_name] = isp_counts.get(isp_name, 0) + frequency
-        
-        if country_name and country_name != 'N/A':
-            country_counts[country_name] = country_counts.get(country_name, 0) + frequency
-            
-        if cc and cc != 'N/A':
-            country_code_counts[cc] = country_code_counts.get(cc, 0) + frequency
-
     # --- ISP集計 ---
-    isp_full_df = pd.DataFrame(list(isp_counts.items()), columns=['ISP', 'Count'])
-    isp_full_df = isp_full_df.sort_values('Count', ascending=False)
-    
-    if not isp_full_df.empty:
-        isp_df = isp_full_df.head(10).copy()
+    isp_df = pd.DataFrame(aggregator.top('isp'), columns=['ISP', 'Count'])
+    if not isp_df.empty:
         isp_df['ISP'] = isp_df['ISP'].str.wrap(25)
-    else:
-        isp_df = pd.DataFrame(columns=['ISP', 'Count'])
 
     # --- 国集計 ---
-    country_full_df = pd.DataFrame(list(country_counts.items()), columns=['Country', 'Count'])
-    country_full_df = country_full_df.sort_values('Count', ascending=False)
-
-    if not country_full_df.empty:
-        country_df = country_full_df.head(10).copy()
+    country_df = pd.DataFrame(aggregator.top('country'), columns=['Country', 'Count'])
+    if not country_df.empty:
         country_df['Country'] = country_df['Country'].str.wrap(25)
-    else:
-        country_df = pd.DataFrame(columns=['Country', 'Count'])
 
     # ヒートマップ用
+    country_code_counts = dict(aggregator.country_code_counts)
     if country_code_counts:
         map_data = []
         for cc, cnt in country_code_counts.items():
@@ -846,36 +121,36 @@ def summarize_in_realtime(raw_results):
                     'Country': name_for_map
                 })
 
-        country_all_df_raw = pd.DataFrame(map_data).astype({
-            'NumericCode': 'int64',
-            'Count': 'int64'
-        })
+        if map_data:
+            country_all_df_raw = pd.DataFrame(map_data).astype({
+                'NumericCode': 'int64',
+                'Count': 'int64'
+            })
         
     st.session_state['debug_summary']['country_code_counts'] = country_code_counts
     st.session_state['debug_summary']['country_all_df'] = country_all_df_raw.to_dict('records')
 
     # --- ターゲット頻度集計 ---
-    freq_map = st.session_state.get('target_freq_map', {})
-    finished = st.session_state.get('finished_ips', set())
-    freq_list = [{'Target_IP': t, 'Count': c} for t, c in freq_map.items() if t in finished]
-    
-    if freq_list:
-        freq_full_df = pd.DataFrame(freq_list).sort_values('Count', ascending=False)
-    else:
-        freq_full_df = pd.DataFrame(columns=['Target_IP', 'Count'])
-    
-    if not freq_full_df.empty:
-        freq_df = freq_full_df.head(10).copy()
-    else:
-        freq_df = pd.DataFrame(columns=['Target_IP', 'Count'])
+    freq_df = pd.DataFrame(aggregator.top('frequency'), columns=['Target_IP', 'Count'])
+
+    # 全件テーブル (レポート・ダウンロード用) は必要な時だけ作る
+    isp_full_df = country_full_df = freq_full_df = None
+    if include_full:
+        isp_full_df, country_full_df, freq_full_df = build_full_summary_tables(aggregator)
 
     return isp_df, country_df, freq_df, country_all_df_raw, isp_full_df, country_full_df, freq_full_df
 
-# --- 集計結果描画ヘルパー関数 ---
-def draw_summary_content(isp_summary_df, country_summary_df, target_frequency_df, country_all_df, title):
-    st.subheader(title)
-    
-    st.markdown("#### 🌍 国別 IP カウントヒートマップ")
+def build_full_summary_tables(aggregator=None):
+    aggregator = aggregator or st.session_state['result_aggregator']
+    isp_full_df = pd.DataFrame(aggregator.table('isp'), columns=['ISP', 'Count'])
+    country_full_df = pd.DataFrame(aggregator.table('country'), columns=['Country', 'Count'])
+    freq_full_df = pd.DataFrame(aggregator.table('frequency'), columns=['Target_IP', 'Count'])
+    return isp_full_df, country_full_df, freq_full_df
+
+# 🆕 集計結果のグラフ (Altair) と表示用の表を組み立てる (描画は draw_summary_content)。
+# 検索中のリアルタイム表示では、結果が変わっていない間は組み立て済みのものを使い回す
+def build_summary_charts(isp_summary_df, country_summary_df, target_frequency_df, country_all_df):
+    charts = {'map': None, 'freq': None, 'isp': None, 'country': None}
     if WORLD_MAP_GEOJSON and not country_all_df.empty:
         
         base = alt.Chart(WORLD_MAP_GEOJSON).mark_geoshape(
@@ -928,15 +203,7 @@ def draw_summary_content(isp_summary_df, country_summary_df, target_frequency_df
             orient='right'
         ).interactive()
         
-        st.altair_chart(chart, use_container_width=True)
-        
-    else:
-        st.info("ヒートマップデータまたはGeoJSONがロードされていないか、成功したIPv4データが存在しないため表示できません。")
-    
-    st.markdown("---")
-
-
-    col_freq, col_isp, col_country = st.columns([1, 1, 1]) 
+        charts['map'] = chart
 
     # 共通チャート生成関数
     def create_labeled_bar_chart(df, x_field, y_field, title):
@@ -955,36 +222,56 @@ def draw_summary_content(isp_summary_df, country_summary_df, target_frequency_df
         )
         return (bars + text).properties(title=title).interactive()
 
+    if not target_frequency_df.empty:
+        target_frequency_df_display = target_frequency_df.copy()
+        target_frequency_df_display['Target_IP'] = target_frequency_df_display['Target_IP'].str.wrap(25)
+        charts['freq'] = (create_labeled_bar_chart(target_frequency_df, 'Count', 'Target_IP', 'Target IP Counts'), target_frequency_df_display)
+    if not isp_summary_df.empty:
+        charts['isp'] = (create_labeled_bar_chart(isp_summary_df, 'Count', 'ISP', 'ISP Counts'), isp_summary_df)
+    if not country_summary_df.empty:
+        charts['country'] = (create_labeled_bar_chart(country_summary_df, 'Count', 'Country', 'Country Counts'), country_summary_df)
+    return charts
+
+# --- 集計結果描画ヘルパー関数 ---
+def draw_summary_content(charts, title):
+    st.subheader(title)
+    
+    st.markdown("#### 🌍 国別 IP カウントヒートマップ")
+    if charts['map'] is not None:
+        st.altair_chart(charts['map'], use_container_width=True)
+    else:
+        st.info("ヒートマップデータまたはGeoJSONがロードされていないか、成功したIPv4データが存在しないため表示できません。")
+    
+    st.markdown("---")
+
+
+    col_freq, col_isp, col_country = st.columns([1, 1, 1]) 
+
     with col_freq:
         st.markdown("#### 🎯 対象IP別カウント (トップ10)")
-        if not target_frequency_df.empty:
-            st.caption(f"**集計対象ターゲット数 (重複なし):** {len(target_frequency_df)} 件")
-            chart = create_labeled_bar_chart(target_frequency_df, 'Count', 'Target_IP', 'Target IP Counts')
+        if charts['freq'] is not None:
+            chart, table = charts['freq']
+            st.caption(f"**集計対象ターゲット数 (重複なし):** {len(table)} 件")
             st.altair_chart(chart, use_container_width=True)
-
-            target_frequency_df_display = target_frequency_df.copy()
-            target_frequency_df_display['Target_IP'] = target_frequency_df_display['Target_IP'].str.wrap(25)
-            st.dataframe(target_frequency_df_display, hide_index=True, use_container_width=True)
+            st.dataframe(table, hide_index=True, use_container_width=True)
         else:
             st.info("データがありません")
             
     with col_isp:
         st.markdown("#### 🏢 ISP別カウント (トップ10)")
-        if not isp_summary_df.empty:
-            chart = create_labeled_bar_chart(isp_summary_df, 'Count', 'ISP', 'ISP Counts')
+        if charts['isp'] is not None:
+            chart, table = charts['isp']
             st.altair_chart(chart, use_container_width=True)
-            
-            st.dataframe(isp_summary_df, hide_index=True, use_container_width=True)
+            st.dataframe(table, hide_index=True, use_container_width=True)
         else:
             st.info("データがありません")
             
     with col_country:
         st.markdown("#### 🌍 国別カウント (トップ10)")
-        if not country_summary_df.empty:
-            chart = create_labeled_bar_chart(country_summary_df, 'Count', 'Country', 'Country Counts')
+        if charts['country'] is not None:
+            chart, table = charts['country']
             st.altair_chart(chart, use_container_width=True)
-            
-            st.dataframe(country_summary_df, hide_index=True, use_container_width=True)
+            st.dataframe(table, hide_index=True, use_container_width=True)
         else:
             st.info("データがありません")
 
@@ -1152,12 +439,309 @@ def generate_cross_analysis_html(chart_spec, x_col, group_col):
 
 # --- Excel生成ヘルパー関数 ---
 def convert_df_to_excel(df):
+    if len(df) > EXCEL_STREAMING_ROW_THRESHOLD:
+        return convert_df_to_excel_streaming(df)
     output = io.BytesIO()
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Sheet1')
     return output.getvalue()
 
+# --- 🆕 一時ファイルに書き出したダウンロード成果物 ---
+# 大きなブックはメモリ上に bytes として持たず、ダウンロード時にファイルハンドルを渡す
+class ArtifactFile:
+    __slots__ = ('path', 'size')
+
+    def __init__(self, path):
+        self.path = path
+        self.size = os.path.getsize(path)
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def save_workbook_to_tempfile(wb, suffix='.xlsx'):
+    fd, path = tempfile.mkstemp(prefix='whois_', suffix=suffix)
+    os.close(fd)
+    wb.save(path)
+    return ArtifactFile(path)
+
+# --- 🆕 write-only (ストリーミング) Excel 出力 ---
+# 行はワークシートの一時ファイルへ逐次書き出されるため、ブックを丸ごとメモリ上に組み立てない
+def iter_excel_rows(df):
+    for start in range(0, len(df), EXCEL_STREAMING_CHUNK_ROWS):
+        chunk = df.iloc[start:start + EXCEL_STREAMING_CHUNK_ROWS].astype(object)
+        chunk = chunk.where(chunk.notna(), None)
+        yield from chunk.itertuples(index=False, name=None)
+
+# frames は DataFrame のイテラブル (アップロード表のチャンク等)。ヘッダーは最初のチャンクの列名を使う
+def write_df_to_write_only_sheet(wb, frames, sheet_name):
+    ws = wb.create_sheet(sheet_name)
+    for i, df in enumerate(frames):
+        if i == 0:
+            header = []
+            for col in df.columns:
+                cell = WriteOnlyCell(ws, value=str(col))
+                cell.font = Font(bold=True)
+                header.append(cell)
+            ws.append(header)
+        for row in iter_excel_rows(df):
+            ws.append(row)
+    return ws
+
+def convert_df_to_excel_streaming(df):
+    wb = Workbook(write_only=True)
+    write_df_to_write_only_sheet(wb, [df], 'Sheet1')
+    return save_workbook_to_tempfile(wb)
+
+# レポートシート共通のグラフ (データはヘッダー5行目・データ6行目からの配置を前提)
+def build_report_chart(ws, pivot_df, chart_title, x_title, y_title, chart_type="col", stacked=False):
+    chart = BarChart()
+    chart.type = chart_type
+    chart.style = 10
+    chart.title = chart_title
+    chart.y_axis.title = y_title
+    chart.x_axis.title = x_title
+    if stacked:
+        chart.grouping = "stacked"
+        chart.overlap = 100
+    
+    chart.height = 15 # 印刷用に見やすく大きく
+    chart.width = 25
+
+    # データ範囲設定 (startrow=4 なのでデータは5行目から)
+    # ヘッダーは 5行目
+    # データ開始は 6行目
+    data_start_row = 5 
+    data_end_row = data_start_row + len(pivot_df)
+    
+    data = Reference(ws, min_col=2, min_row=data_start_row, max_row=data_end_row, max_col=len(pivot_df.columns)+1)
+    cats = Reference(ws, min_col=1, min_row=data_start_row+1, max_row=data_end_row)
+    
+    chart.add_data(data, titles_from_data=True)
+    chart.set_categories(cats)
+    
+    # グラフ配置 (データの下ではなく横に配置して見やすく)
+    ws.add_chart(chart, "E5")
+
+def add_chart_sheet_write_only(wb, pivot_df, sheet_name, chart_title, x_title, y_title, description, chart_type="col", stacked=False):
+    if pivot_df.empty: return
+    ws = wb.create_sheet(sheet_name)
+
+    # 印刷設定（横向き）
+    ws.page_setup.orientation = 'landscape'
+    ws.page_setup.fitToWidth = 1
+    ws.print_options.horizontalCentered = True
+
+    # --- 解説文の挿入 (通常モードと同じ A1: タイトル / A2:H3: 説明文) ---
+    title_cell = WriteOnlyCell(ws, value=chart_title)
+    title_cell.font = Font(size=14, bold=True, color="1E3A8A")
+    desc_cell = WriteOnlyCell(ws, value=description)
+    desc_cell.font = Font(size=11, color="555555", italic=True)
+    desc_cell.alignment = Alignment(wrap_text=True, vertical="top")
+    ws.merged_cells.add('A2:H3')
+    ws.append([title_cell])
+    ws.append([desc_cell])
+    ws.append([])
+    ws.append([])
+
+    # ピボット表 (5行目ヘッダー / 6行目からデータ)
+    ws.append([str(pivot_df.index.name)] + [str(c) for c in pivot_df.columns])
+    for row in pivot_df.reset_index().astype(object).values.tolist():
+        ws.append(row)
+
+    build_report_chart(ws, pivot_df, chart_title, x_title, y_title, chart_type, stacked)
+
+# 🆕 元データ x 検索結果の結合 (同じファイル・同じ結果リストなら再計算しない)
+def get_merged_dataframe(table, results):
+    memo = st.session_state.get('merged_df_memo')
+    if memo and memo['table'] is table and memo['results'] is results and memo['result_count'] == len(results):
+        return memo['df']
+
+    results_table = build_results_table(results)
+    merged_chunks = list(table.iter_merged_chunks(results_table))
+    df_merged = pd.concat(merged_chunks) if merged_chunks else pd.DataFrame()
+    st.session_state['merged_df_memo'] = {'table': table, 'results': results, 'result_count': len(results), 'df': df_merged}
+    return df_merged
+
+# --- 🆕 ダウンロード成果物キャッシュ ---
+# 結果セットの内容ハッシュ + 出力オプションをキーにし、ファイル本体はボタンが押された時だけ生成する
+def content_digest(name, items):
+    # 同じリストに追記がない限り (同一オブジェクト・同一件数) ハッシュは再計算しない
+    memo = st.session_state.setdefault('content_digest_memo', {})
+    cached = memo.get(name)
+    if cached and cached[0] is items and cached[1] == len(items):
+        return cached[2]
+
+    h = hashlib.sha1()
+    for item in items:
+        h.update(json.dumps(item, sort_keys=True, default=str, ensure_ascii=False).encode('utf-8'))
+        h.update(b'\n')
+    digest = h.hexdigest()
+    memo[name] = (items, len(items), digest)
+    return digest
+
+def artifact_key(*parts):
+    return hashlib.sha1(json.dumps(parts, default=str, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def get_artifact_cache():
+    return st.session_state.setdefault('artifact_cache', OrderedDict())
+
+def artifact_size(data):
+    if isinstance(data, ArtifactFile):
+        return data.size
+    if isinstance(data, str):
+        return len(data.encode('utf-8'))
+    return len(data)
+
+# 合計サイズが上限に収まるまで古い成果物から破棄する
+def trim_artifact_cache(cache, max_bytes=ARTIFACT_CACHE_MAX_BYTES):
+    total = sum(artifact_size(data) for data in cache.values())
+    while total > max_bytes and len(cache) > 1:
+        _, evicted = cache.popitem(last=False)
+        total -= artifact_size(evicted)
+        if isinstance(evicted, ArtifactFile):
+            evicted.discard()
+
+def lazy_download_button(label, key, builder, file_name, mime, help=None, widget_key=None):
+    cache = get_artifact_cache()
+    widget_key = widget_key or file_name
+    data = cache.get(key)
+    if data is None:
+        if st.button(f"⚙️ {label} を生成", key=f"prepare_{widget_key}", use_container_width=True, help=help):
+            with st.spinner("ファイルを生成しています..."):
+                data = builder()
+            cache[key] = data
+            trim_artifact_cache(cache)
+    else:
+        cache.move_to_end(key)
+
+    if isinstance(data, ArtifactFile):
+        # 一時ファイルに書き出した成果物はファイルハンドルのまま渡す
+        with open(data.path, 'rb') as f:
+            st.download_button(label, f, file_name, mime, use_container_width=True, help=help, key=f"download_{widget_key}")
+    elif data is not None:
+        st.download_button(label, data, file_name, mime, use_container_width=True, help=help, key=f"download_{widget_key}")
+
+def build_result_csv_frame(rows):
+    return pd.DataFrame(rows).drop(columns=['CountryCode', 'Secondary_Security_Links', 'RIR_Link'], errors='ignore').astype(str)
+
+def encode_csv(df):
+    return df.to_csv(index=False).encode('utf-8-sig')
+
 # --- Advanced Excel Generator (Pivot & Chart) v5.0 ---
+# Proxy Type の空欄・旧用語は「Standard Connection」にまとめる (用語変更)
+STANDARD_CONNECTION_LABEL = 'Standard Connection'
+PROXY_TYPE_STANDARD_ALIASES = ('', 'nan', 'Residential/Normal', 'Residential/General', 'Residential/Business')
+
+def normalize_proxy_types(proxy_types):
+    if not isinstance(proxy_types.dtype, pd.CategoricalDtype):
+        return proxy_types.fillna(STANDARD_CONNECTION_LABEL).replace(list(PROXY_TYPE_STANDARD_ALIASES), STANDARD_CONNECTION_LABEL)
+
+    # 🆕 カテゴリ型はカテゴリ (種類数ぶん) だけを置き換え、行ごとの値はコードの付け替えで済ませる
+    renamed = [STANDARD_CONNECTION_LABEL if category in PROXY_TYPE_STANDARD_ALIASES else category for category in proxy_types.cat.categories]
+    categories = sorted(set(renamed) | {STANDARD_CONNECTION_LABEL})
+    # 末尾は欠損 (コード -1) 用
+    code_map = np.array([categories.index(category) for category in renamed] + [categories.index(STANDARD_CONNECTION_LABEL)])
+    codes = code_map[proxy_types.cat.codes.to_numpy()]
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=proxy_types.index, name=proxy_types.name)
+
+# 分析付きExcel用にチャンクを整える (Proxy Type の正規化と時間帯列の追加)。
+# 元のチャンクは書き換えず、列の差し替えは浅いコピーに対して行う (値のコピーなし)
+def prepare_report_frame(df, time_col_name=None):
+    df = df.copy(deep=False)
+    if 'Proxy Type' in df.columns:
+        df['Proxy Type'] = normalize_proxy_types(df['Proxy Type'])
+    else:
+        df['Proxy Type'] = STANDARD_CONNECTION_LABEL
+
+    if time_col_name and time_col_name in df.columns:
+        try:
+            df['Hour'] = pd.to_datetime(df[time_col_name], errors='coerce').dt.hour
+        except Exception:
+            pass
+    return df
+
+# 🆕 レポート用ピボットの件数をチャンクごとに足し合わせる (全行を保持せずに集計する)
+# 件数は pivot_table(aggfunc='count') と同じく、カウント列 (最初の列) が欠損していない行だけを数える
+class ReportPivotCounter:
+    def __init__(self, count_col):
+        self.count_col = count_col
+        self.has_time_analysis = False
+        self.isp_rows = Counter()
+        self.isp = Counter()
+        self.isp_proxy = Counter()
+        self.country = Counter()
+        self.hour = Counter()
+        self.hour_proxy = Counter()
+
+    def add(self, df):
+        counted = df[df[self.count_col].notna()]
+        self.isp_rows.update(df.groupby('ISP_JP', observed=True).size().to_dict())
+        self.isp.update(counted.groupby('ISP_JP', observed=True).size().to_dict())
+        self.isp_proxy.update(counted.groupby(['ISP_JP', 'Proxy Type'], observed=True).size().to_dict())
+        self.country.update(counted.groupby('Country_JP', observed=True).size().to_dict())
+        if 'Hour' in df.columns:
+            self.has_time_analysis = True
+            # 時刻を解釈できなかった行 (NaN) は時間帯の集計に含めない
+            self.hour.update({int(h): n for h, n in counted.groupby('Hour').size().items()})
+            self.hour_proxy.update({(int(h), p): n for (h, p), n in counted.groupby(['Hour', 'Proxy Type'], observed=True).size().items()})
+
+    def _volume(self, counts, index_name, keys=None):
+        keys = sorted(counts if keys is None else keys)
+        table = pd.DataFrame({self.count_col: [counts[k] for k in keys]}, index=pd.Index(keys, name=index_name))
+        return table[table[self.count_col] > 0].sort_values(self.count_col, ascending=False, kind='stable')
+
+    def _cross(self, counts, index_name, keys=None):
+        items = {k: v for k, v in counts.items() if keys is None or k[0] in keys}
+        if not items:
+            return pd.DataFrame(index=pd.Index([], name=index_name))
+        table = pd.Series(items).unstack(fill_value=0).sort_index().sort_index(axis=1)
+        table.index.name, table.columns.name = index_name, 'Proxy Type'
+        return table
+
+    def report_sheets(self):
+        # 件数の多い上位ISP (同数は名前順) に絞って表にする
+        top_isps = [isp for isp, _ in sorted(self.isp_rows.items(), key=lambda kv: (-kv[1], kv[0]))[:20]]
+        sheets = []
+
+        # ---------------------------------------------------------
+        # 2. Report_ISP_Volume: [ISP_JP] x [Count]
+        # ---------------------------------------------------------
+        desc_isp_vol = "どのプロバイダからのアクセスが最も多いかを可視化しています。特定のISPからのアクセス集中は、そのサービスの利用者層または特定のキャンペーンの影響を示唆します。"
+        sheets.append((self._volume(self.isp, 'ISP_JP', top_isps), 'Report_ISP_Volume', 'ISP Access Volume Ranking (Top 20)', 'Internet Service Provider', 'Access Count (件数)', desc_isp_vol, "col", False))
+
+        # ---------------------------------------------------------
+        # 3. Report_ISP_Risk: [ISP_JP] x [Proxy Type]
+        # ---------------------------------------------------------
+        desc_isp_risk = "そのISPが安全な一般回線か、注意が必要なサーバー/VPN経由かを判定しています。「Standard Connection」は一般的な安全な接続です。「Hosting」や「VPN」が多い場合は機械的なアクセスの可能性があります。"
+        sheets.append((self._cross(self.isp_proxy, 'ISP_JP', set(top_isps)), 'Report_ISP_Risk', 'Risk Analysis by ISP (Top 20)', 'Internet Service Provider', 'Access Count (件数)', desc_isp_risk, "col", True))
+
+        # ---------------------------------------------------------
+        # 4. Report_Country: [Country_JP] x [Count] (Bonus)
+        # ---------------------------------------------------------
+        desc_country = "国ごとのアクセス数をランキング化しています。サービス提供エリア外からの予期せぬアクセス検知や、海外からの攻撃予兆の発見に役立ちます。"
+        sheets.append((self._volume(self.country, 'Country_JP').head(15), 'Report_Country', 'Country Access Volume (Top 15)', 'Country Name', 'Access Count (件数)', desc_country, "col", False))
+
+        # ---------------------------------------------------------
+        # 5. Time Analysis (if available)
+        # ---------------------------------------------------------
+        if self.has_time_analysis:
+            # Report_Time_Volume: [Hour] x [Count]
+            pivot_time_vol = pd.DataFrame(
+                {self.count_col: [self.hour.get(h, 0) for h in range(24)]}, index=pd.Index(range(24), name='Hour')
+            )
+            desc_time_vol = "何時にアクセスが集中しているかを可視化しています。一般的なユーザーは活動時間帯に、Botなどは深夜早朝や24時間一定のアクセスを行う傾向があります。"
+            sheets.append((pivot_time_vol, 'Report_Time_Volume', 'Hourly Access Trend', 'Time of Day (0-23h)', 'Access Count (件数)', desc_time_vol, "col", False))
+
+            # Report_Time_Risk: [Hour] x [Proxy Type]
+            pivot_time_risk = self._cross(self.hour_proxy, 'Hour')
+            pivot_time_risk = pivot_time_risk.reindex(range(24), fill_value=0).rename_axis('Hour')
+            desc_time_risk = "深夜帯などに怪しいアクセス（Hosting/VPN等）が増えていないかを確認できます。夜間にHosting判定が増加する場合、Botによる自動巡回の可能性があります。"
+            sheets.append((pivot_time_risk, 'Report_Time_Risk', 'Hourly Risk Trend', 'Time of Day (0-23h)', 'Access Count (件数)', desc_time_risk, "col", True))
+        return sheets
+
 def create_advanced_excel(df, time_col_name=None):
     """
     1. Raw Data
@@ -1167,31 +751,13 @@ def create_advanced_excel(df, time_col_name=None):
     5. Report_Time_Risk: Hour x ProxyType (Stacked Bar) [if time_col available]
     """
     output = io.BytesIO()
-    
+
     # 1. データ前処理
-    # Proxy Typeの空欄を「Standard Connection」で埋める (用語変更)
-    if 'Proxy Type' in df.columns:
-        df['Proxy Type'] = df['Proxy Type'].fillna('Standard Connection')
-        df['Proxy Type'] = df['Proxy Type'].replace('', 'Standard Connection')
-        # 古い用語が残っている場合の念の為の置換
-        df['Proxy Type'] = df['Proxy Type'].replace('Residential/Normal', 'Standard Connection')
-        df['Proxy Type'] = df['Proxy Type'].replace('Residential/General', 'Standard Connection')
-        df['Proxy Type'] = df['Proxy Type'].replace('Residential/Business', 'Standard Connection')
-        df['Proxy Type'] = df['Proxy Type'].replace('nan', 'Standard Connection')
-    else:
-        df['Proxy Type'] = 'Standard Connection'
-    
-    # 時間帯列の作成
-    has_time_analysis = False
-    if time_col_name and time_col_name in df.columns:
-        try:
-            df['Hour'] = pd.to_datetime(df[time_col_name], errors='coerce').dt.hour
-            has_time_analysis = True
-        except Exception:
-            pass
+    df = prepare_report_frame(df, time_col_name)
 
-    # カウント用の列（最初の列を使う）
-    count_col = df.columns[0]
+    # --- レポート用ピボットの作成 (カウント用の列は最初の列を使う) ---
+    counter = ReportPivotCounter(df.columns[0])
+    counter.add(df)
 
     with pd.ExcelWriter(output, engine='openpyxl') as writer:
         # Sheet 1: Raw Data
@@ -1223,99 +789,41 @@ def create_advanced_excel(df, time_col_name=None):
             ws.print_options.horizontalCentered = True
             
             # グラフ作成
-            chart = BarChart()
-            chart.type = chart_type
-            chart.style = 10
-            chart.title = chart_title
-            chart.y_axis.title = y_title
-            chart.x_axis.title = x_title
-            if stacked:
-                chart.grouping = "stacked"
-                chart.overlap = 100
-            
-            chart.height = 15 # 印刷用に見やすく大きく
-            chart.width = 25
-
-            # データ範囲設定 (startrow=4 なのでデータは5行目から)
-            # ヘッダーは 5行目
-            # データ開始は 6行目
-            data_start_row = 5 
-            data_end_row = data_start_row + len(pivot_df)
-            
-            data = Reference(ws, min_col=2, min_row=data_start_row, max_row=data_end_row, max_col=len(pivot_df.columns)+1)
-            cats = Reference(ws, min_col=1, min_row=data_start_row+1, max_row=data_end_row)
-            
-            chart.add_data(data, titles_from_data=True)
-            chart.set_categories(cats)
-            
-            # グラフ配置 (データの下ではなく横に配置して見やすく)
-            ws.add_chart(chart, "E5")
-
-        # ---------------------------------------------------------
-        # 2. Report_ISP_Volume: [ISP_JP] x [Count]
-        # ---------------------------------------------------------
-        top_isps = df['ISP_JP'].value_counts().head(20).index
-        df_isp = df[df['ISP_JP'].isin(top_isps)]
-        pivot_isp_vol = df_isp.pivot_table(
-            index='ISP_JP', 
-            values=count_col, 
-            aggfunc='count'
-        ).sort_values(count_col, ascending=False)
-        
-        desc_isp_vol = "どのプロバイダからのアクセスが最も多いかを可視化しています。特定のISPからのアクセス集中は、そのサービスの利用者層または特定のキャンペーンの影響を示唆します。"
-        add_chart_sheet(pivot_isp_vol, 'Report_ISP_Volume', 'ISP Access Volume Ranking (Top 20)', 'Internet Service Provider', 'Access Count (件数)', desc_isp_vol)
-
-        # ---------------------------------------------------------
-        # 3. Report_ISP_Risk: [ISP_JP] x [Proxy Type]
-        # ---------------------------------------------------------
-        pivot_isp_risk = df_isp.pivot_table(
-            index='ISP_JP', 
-            columns='Proxy Type', 
-            values=count_col, 
-            aggfunc='count', 
-            fill_value=0
-        )
-        desc_isp_risk = "そのISPが安全な一般回線か、注意が必要なサーバー/VPN経由かを判定しています。「Standard Connection」は一般的な安全な接続です。「Hosting」や「VPN」が多い場合は機械的なアクセスの可能性があります。"
-        add_chart_sheet(pivot_isp_risk, 'Report_ISP_Risk', 'Risk Analysis by ISP (Top 20)', 'Internet Service Provider', 'Access Count (件数)', desc_isp_risk, stacked=True)
-        
-        # ---------------------------------------------------------
-        # 4. Report_Country: [Country_JP] x [Count] (Bonus)
-        # ---------------------------------------------------------
-        pivot_country = df.pivot_table(
-            index='Country_JP',
-            values=count_col,
-            aggfunc='count'
-        ).sort_values(count_col, ascending=False).head(15)
-        desc_country = "国ごとのアクセス数をランキング化しています。サービス提供エリア外からの予期せぬアクセス検知や、海外からの攻撃予兆の発見に役立ちます。"
-        add_chart_sheet(pivot_country, 'Report_Country', 'Country Access Volume (Top 15)', 'Country Name', 'Access Count (件数)', desc_country)
-
-        # ---------------------------------------------------------
-        # 5. Time Analysis (if available)
-        # ---------------------------------------------------------
-        if has_time_analysis:
-            # Report_Time_Volume: [Hour] x [Count]
-            pivot_time_vol = df.pivot_table(
-                index='Hour',
-                values=count_col,
-                aggfunc='count',
-                fill_value=0
-            ).reindex(range(24), fill_value=0)
-            desc_time_vol = "何時にアクセスが集中しているかを可視化しています。一般的なユーザーは活動時間帯に、Botなどは深夜早朝や24時間一定のアクセスを行う傾向があります。"
-            add_chart_sheet(pivot_time_vol, 'Report_Time_Volume', 'Hourly Access Trend', 'Time of Day (0-23h)', 'Access Count (件数)', desc_time_vol)
+            build_report_chart(ws, pivot_df, chart_title, x_title, y_title, chart_type, stacked)
 
-            # Report_Time_Risk: [Hour] x [Proxy Type]
-            pivot_time_risk = df.pivot_table(
-                index='Hour',
-                columns='Proxy Type',
-                values=count_col,
-                aggfunc='count',
-                fill_value=0
-            ).reindex(range(24), fill_value=0)
-            desc_time_risk = "深夜帯などに怪しいアクセス（Hosting/VPN等）が増えていないかを確認できます。夜間にHosting判定が増加する場合、Botによる自動巡回の可能性があります。"
-            add_chart_sheet(pivot_time_risk, 'Report_Time_Risk', 'Hourly Risk Trend', 'Time of Day (0-23h)', 'Access Count (件数)', desc_time_risk, stacked=True)
+        for sheet_args in counter.report_sheets():
+            add_chart_sheet(*sheet_args)
             
     return output.getvalue()
 
+# 🆕 大量データ用: アップロード表の結合チャンクを1つずつ Raw Data へ書き出しながらピボット件数を足し合わせる。
+# 結合データ全体もブック全体もメモリ上に持たず、ブックは一時ファイルに保存する
+def create_advanced_excel_streaming(merged_chunks, time_col_name=None):
+    counter = None
+
+    def iter_report_chunks():
+        nonlocal counter
+        has_time_analysis = None
+        for chunk in merged_chunks:
+            chunk = prepare_report_frame(chunk, time_col_name)
+            # 時間帯列の有無 (Raw Data の列構成) は最初のチャンクに合わせる
+            if has_time_analysis is None:
+                has_time_analysis = 'Hour' in chunk.columns
+                counter = ReportPivotCounter(chunk.columns[0])
+            if has_time_analysis and 'Hour' not in chunk.columns:
+                chunk['Hour'] = np.nan
+            elif not has_time_analysis and 'Hour' in chunk.columns:
+                chunk = chunk.drop(columns='Hour')
+            counter.add(chunk)
+            yield chunk
+
+    wb = Workbook(write_only=True)
+    write_df_to_write_only_sheet(wb, iter_report_chunks(), 'Raw Data')
+    if counter is not None:
+        for sheet_args in counter.report_sheets():
+            add_chart_sheet_write_only(wb, *sheet_args)
+    return save_workbook_to_tempfile(wb)
+
 
 def display_results(results, current_mode_full_text, display_mode):
     st.markdown("### 📝 検索結果")
@@ -1333,7 +841,7 @@ def display_results(results, current_mode_full_text, display_mode):
         
         - **⚠️ [Tor Node]**
             - **定義**: Tor（The Onion Router）ネットワークにおける「Exit Node（出口ノード）」を指します。
-            - **背景**: 起動時にTor Project公式サイトより最新のノードリストを取得し、照合を行っています。高い匿名性を維持した通信であるため、セキュリティリスクの検討が必要です。
+            - **背景**: Tor Project公式サイトの最新ノードリスト（ディスクに保存し定期的に更新）と照合を行っています。高い匿名性を維持した通信であるため、セキュリティリスクの検討が必要です。
             
         - **⚠️ [VPN/Proxy]**
             - **定義**: 商用VPNサービス、公開プロキシ、またはプライバシー保護を目的とした中継団体に属するIPです。
@@ -1355,17 +863,35 @@ def display_results(results, current_mode_full_text, display_mode):
         col.markdown(f"**{name}**")
     st.markdown("<hr style='margin: 0px 0px 10px 0px;'>", unsafe_allow_html=True)
 
-    with st.container(height=800):
-        if not results:
+    if not results:
+        with st.container(height=800):
             st.info("検索結果がここに表示されます。")
-            return
+        return
+
+    # 🆕 ページ分割: 表示中のページ分だけウィジェットを生成する (1万件でもブラウザが固まらない)
+    page_size = st.session_state.get('results_page_size', RESULTS_PAGE_SIZE_OPTIONS[1])
+    total_pages = max(1, math.ceil(len(results) / page_size))
+    if st.session_state.get('results_page', 1) > total_pages:
+        st.session_state['results_page'] = total_pages
+    current_page = st.session_state.get('results_page', 1)
+    start_idx = (current_page - 1) * page_size
+    page_results = results[start_idx:start_idx + page_size]
 
-        for idx, res in enumerate(results):
+    with st.container(height=800):
+        for idx, res in enumerate(page_results, start=start_idx):
                 row_cols = st.columns(col_widths)
                 row_cols[0].write(f"**{idx+1}**")
                 
                 target_ip = res.get('Target_IP', 'N/A')
                 row_cols[1].markdown(f"`{target_ip}`")
+                if res.get('Resolved_IPs'):
+                    row_cols[1].caption(f"→ {res['Resolved_IPs']}")
+                if res.get('Resolved_From'):
+                    row_cols[1].caption(f"← {res['Resolved_From']}")
+                # 集約行のCIDR文字列は表示するページの行だけ、ここで整形される (LazyText)
+                cidr_list = str(res['CIDR_Summary']).split("\n") if res.get('CIDR_Summary') else []
+                if cidr_list:
+                    row_cols[1].caption(f"CIDR: {len(cidr_list)}件 / 充填率: {res.get('Density', 0):.1%}")
                 
                 c_jp = res.get('Country_JP', 'N/A')
                 c_en = res.get('Country', 'N/A')
@@ -1373,12 +899,21 @@ def display_results(results, current_mode_full_text, display_mode):
                 
                 isp_display = res.get('ISP_JP', res.get('ISP', 'N/A'))
                 row_cols[3].write(isp_display)
+                if res.get('PTR'):
+                    row_cols[3].caption(f"PTR: {res['PTR']}")
                 
                 rir_link = res.get('RIR_Link', 'N/A')
                 with row_cols[4]:
                     st.write(rir_link)
-                    clean_ip = get_copy_target(target_ip)
-                    st.code(clean_ip, language=None)
+                    if cidr_list:
+                        # 集約行はFWルールに貼れるCIDRをコピー対象にする
+                        cidr_text = "\n".join(cidr_list[:CIDR_DISPLAY_LIMIT])
+                        if len(cidr_list) > CIDR_DISPLAY_LIMIT:
+                            cidr_text += f"\n# ... 他 {len(cidr_list) - CIDR_DISPLAY_LIMIT} 件"
+                        st.code(cidr_text, language=None)
+                    else:
+                        clean_ip = get_copy_target(target_ip)
+                        st.code(clean_ip, language=None)
                 
                 row_cols[5].write(res.get('Secondary_Security_Links', 'N/A'))
                 hosting_val = res.get('Proxy_Type', '')
@@ -1390,19 +925,168 @@ def display_results(results, current_mode_full_text, display_mode):
                 else:
                     row_cols[7].write(status_val)
                     
-                row_cols[8].checkbox("選択", key=f"chk_{get_copy_target(target_ip)}_{idx}", label_visibility="collapsed")
+                # 選択状態は行番号ではなくIP (Target_IP) 単位で保持する
+                widget_key = f"sel_{target_ip}"
+                row_cols[8].checkbox(
+                    "選択", key=widget_key, label_visibility="collapsed",
+                    value=target_ip in st.session_state.selected_ips,
+                    on_change=toggle_selected_ip, args=(target_ip, widget_key)
+                )
+
+    col_page, col_size, col_info = st.columns([1, 1, 2])
+    with col_page:
+        st.number_input("ページ", min_value=1, max_value=total_pages, step=1, key="results_page")
+    with col_size:
+        st.selectbox("1ページの表示件数", RESULTS_PAGE_SIZE_OPTIONS, key="results_page_size")
+    with col_info:
+        st.caption(f"**表示中:** {start_idx + 1} - {start_idx + len(page_results)} / 全 {len(results)} 件 ({current_page}/{total_pages} ページ)")
+
+    selected_ips = [get_copy_target(ip) for ip in st.session_state.selected_ips]
+    if selected_ips:
+        with st.expander(f"✅ 選択中のターゲット ({len(selected_ips)} 件)", expanded=False):
+            st.code("\n".join(sorted(selected_ips)), language=None)
+            if st.button("選択をすべて解除", key="clear_selected_ips"):
+                clear_selected_ips()
+                st.rerun()
+
+# 🆕 集約結果からFWルール用のCIDRリスト (グループごとにコメント行付き) を作成
+def build_firewall_cidr_text(grouped_results):
+    lines = []
+    for res in grouped_results:
+        if not res.get('CIDR_Summary'):
+            continue
+        lines.append(f"# {res.get('ISP', 'N/A')} ({res.get('CountryCode', 'N/A')}) {res['Target_IP']} / 充填率 {res.get('Density', 0):.1%}")
+        lines.append(str(res['CIDR_Summary']))
+    return "\n".join(lines) + "\n"
+
+def toggle_selected_ip(target_ip, widget_key):
+    if st.session_state[widget_key]:
+        st.session_state.selected_ips.add(target_ip)
+    else:
+        st.session_state.selected_ips.discard(target_ip)
+
+def clear_selected_ips():
+    for target_ip in st.session_state.selected_ips:
+        st.session_state.pop(f"sel_{target_ip}", None)
+    st.session_state.selected_ips = set()
+
+
+# --- 🆕 検索ジョブ (バックグラウンド実行 + チェックポイント) ---
+# 照会は search_job_manager のスレッドで進み、スクリプトはジョブの状態を読んで描画するだけにする。
+# 完了した結果はジョブの追記ログにも保存されるため、再起動後もジョブIDから再開できる
+RESUMABLE_JOB_STATUSES = ('running', 'cancelled', 'failed')
+
+def get_current_search_job():
+    return search_job_manager.get(st.session_state.get('search_job_id'))
+
+def submit_search_job(checkpoint, cidr_cache, tor_nodes, api_key):
+    settings = checkpoint.settings
+    return search_job_manager.submit(
+        checkpoint, cidr_cache, tor_nodes, MODE_SETTINGS[resolve_mode_name(settings['api_mode'])],
+        use_rdap=settings.get('use_rdap', False), api_key=api_key,
+        simple_mode="簡易" in settings.get('display_mode', ''),
+        rate_limit_wait_seconds=RATE_LIMIT_WAIT_SECONDS,
+        failover=settings.get('failover', False), hedge=settings.get('hedge', False),
+        offline_db=get_offline_database() if settings.get('offline_db') else None,
+        offline_only=settings.get('offline_only', False),
+        resolve_domains=settings.get('resolve_domains', False),
+        ptr_enrich=settings.get('ptr', False),
+        ptr_time_budget=settings.get('ptr_time_budget') or None,
+        ptr_classify=settings.get('ptr_classify', False),
+    )
+
+# セッションの検索状態をジョブに結び付ける (結果リストはジョブと同じオブジェクトを共有する)
+def attach_search_job(job):
+    input_list = job.checkpoint.read_input_list()
+    st.session_state['search_job_id'] = job.job_id
+    st.session_state.raw_results = job.results
+    st.session_state.finished_ips = job.finished
+    st.session_state.deferred_ips = job.deferred_snapshot()
+    st.session_state.targets_cache = job.targets
+    st.session_state['original_input_list'] = input_list
+    st.session_state['target_freq_map'] = dict(Counter(input_list))
+    clear_selected_ips()
+    st.session_state.results_page = 1
+    st.session_state.search_start_time = job.started_at or time.time()
+    st.session_state.cancel_search = False
+    st.session_state.is_searching = job.is_running()
+
+def sync_search_job_state():
+    job = get_current_search_job()
+    if job is None:
+        return None
+    st.session_state.raw_results = job.results
+    st.session_state.finished_ips = job.finished
+    st.session_state.deferred_ips = job.deferred_snapshot()
+    st.session_state.is_searching = job.is_running()
+    return job
+
+# 実行中のジョブには接続し、停止済みのジョブはチェックポイントから再開する
+def resume_search_job(job_id, cidr_cache, tor_nodes, api_key):
+    job = search_job_manager.get(job_id)
+    if job is None or not job.is_running():
+        checkpoint = SearchJobCheckpoint.load(job_id)
+        job = submit_search_job(checkpoint, cidr_cache, tor_nodes, api_key)
+
+    # 検索時の表示・API設定を復元する (APIキーは保存しない)
+    settings = job.checkpoint.settings
+    if settings.get('display_mode'):
+        st.session_state['display_mode_radio'] = settings['display_mode']
+    api_mode = resolve_mode_name(settings.get('api_mode'))
+    if api_mode in MODE_SETTINGS:
+        st.session_state['api_mode_radio'] = api_mode
+    for setting, widget_key in (('use_rdap', 'use_rdap_checkbox'), ('failover', 'failover_checkbox'), ('hedge', 'hedge_checkbox'),
+                                ('offline_db', 'offline_db_checkbox'), ('offline_only', 'offline_only_checkbox'),
+                                ('resolve_domains', 'resolve_domains_checkbox'), ('ptr', 'ptr_checkbox'),
+                                ('ptr_time_budget', 'ptr_budget_input'), ('ptr_classify', 'ptr_classify_checkbox')):
+        if setting in settings:
+            st.session_state[widget_key] = settings[setting]
+    attach_search_job(job)
+    return job
+
+def format_eta(eta_seconds):
+    if not eta_seconds:
+        return "計算中..."
+    eta_seconds = math.ceil(eta_seconds)
+    return f"{eta_seconds // 60:02d}:{eta_seconds % 60:02d}"
+
+# 進捗とリアルタイム集計だけを一定間隔で再実行する (st.fragment)。ジョブが終われば画面全体を再実行する
+def render_search_progress(job, cidr_cache):
+    if not job.is_running():
+        st.rerun()
+
+    progress = job.progress()
+    if progress['total'] > 0:
+        st.progress(min(100, int(progress['processed'] / progress['total'] * 100)))
+        st.caption(f"**Job:** `{job.job_id}` | **Progress:** {progress['processed']}/{progress['total']} | **Deferred:** {progress['deferred']} | **CIDR Cache:** {cidr_cache.stats_text()} | **Remaining Time:** {format_eta(progress['eta_seconds'])}")
+
+    if progress['deferred'] and progress['next_retry_at']:
+        wait_time = max(1, int(progress['next_retry_at'] - time.time()))
+        st.warning(f"⚠️ **APIレートリミットに達しました。** 隔離中の **{progress['deferred']}** 件のIPアドレスは **{wait_time}** 秒後にバックグラウンドで再試行されます。")
+
+    if progress['total'] > 0:
+        # 🆕 結果・隔離件数が前回の実行から変わっていなければ、集計とグラフ (地図を含む) の組み立てを省いて前回の内容を出し直す。
+        # フラグメント内の要素は毎回出し直さないと消えるが、内容が同一なら画面側では描き直されない
+        version_key = (job.job_id, len(job.results), len(job.deferred_ips))
+        cached = st.session_state.get('live_dashboard_cache')
+        if cached is None or cached[0] != version_key:
+            isp_df, country_df, freq_df, country_all_df, _, _, _ = summarize_in_realtime(job.results, include_full=False)
+            cached = (version_key, build_summary_charts(isp_df, country_df, freq_df, country_all_df))
+            st.session_state['live_dashboard_cache'] = cached
+        st.markdown("---")
+        draw_summary_content(cached[1], "📊 Real-time analysis")
 
 
 # 📊 元データ結合分析機能
-def render_merged_analysis(df_merged):
+def render_merged_analysis(df_merged, data_key):
     st.markdown("### 📈 元データ x 検索結果 クロス分析")
     st.info("アップロードされたファイルの元の列と、検索で得られたWhois情報を組み合わせて可視化します。印刷用にグラフ単体のダウンロードも可能です。")
     
     # グラフ設定用カラム
     # 元データのカラム（Statusなど後付けのカラムを除く）
-    original_cols = [c for c in df_merged.columns if c not in ['ISP', 'ISP_JP', 'Country', 'Country_JP', 'Proxy Type', 'Status']]
+    original_cols = [c for c in df_merged.columns if c not in RESULT_COLUMNS]
     # Whois結果のカラム
-    whois_cols = ['Country_JP', 'ISP_JP', 'Proxy Type', 'Status']
+    whois_cols = ['Country_JP', 'ISP_JP', 'Proxy Type', 'Status'] + (['PTR'] if 'PTR' in df_merged.columns else [])
     
     col_x, col_grp, col_chart_type = st.columns(3)
     
@@ -1450,16 +1134,15 @@ def render_merged_analysis(df_merged):
         if chart:
             st.altair_chart(chart, use_container_width=True)
             
-            # HTMLダウンロード用
-            chart_json = chart.to_dict()
-            html_content = generate_cross_analysis_html(chart_json, x_col, group_col if group_col != '(なし)' else 'Count')
-            
-            st.download_button(
-                label="⬇️ クロス分析レポート(HTML)をダウンロード",
-                data=html_content,
-                file_name=f"cross_analysis_{x_col}_vs_{group_col}.html",
-                mime="text/html",
-                help="グラフをブラウザで全画面表示し、印刷するのに適しています。"
+            # HTMLダウンロード用 (ボタンが押された時だけ生成)
+            lazy_download_button(
+                "⬇️ クロス分析レポート(HTML)をダウンロード",
+                artifact_key('cross_analysis', data_key, x_col, group_col, chart_type),
+                lambda: generate_cross_analysis_html(chart.to_dict(), x_col, group_col if group_col != '(なし)' else 'Count'),
+                f"cross_analysis_{x_col}_vs_{group_col}.html",
+                "text/html",
+                help="グラフをブラウザで全画面表示し、印刷するのに適しています。",
+                widget_key="cross_analysis_html"
             )
 
 
@@ -1473,10 +1156,17 @@ def main():
     if 'finished_ips' not in st.session_state: st.session_state['finished_ips'] = set() 
     if 'search_start_time' not in st.session_state: st.session_state['search_start_time'] = 0.0 
     if 'target_freq_map' not in st.session_state: st.session_state['target_freq_map'] = {} 
-    if 'cidr_cache' not in st.session_state: st.session_state['cidr_cache'] = {} 
     if 'debug_summary' not in st.session_state: st.session_state['debug_summary'] = {}
-
-    tor_nodes = fetch_tor_exit_nodes()
+    if 'selected_ips' not in st.session_state: st.session_state['selected_ips'] = set()
+
+    # 🆕 Tor出口ノードはディスク上の前回取得分を即座に使い、古ければバックグラウンドで更新する (描画は待たない)
+    tor_nodes = get_tor_exit_node_store()
+    tor_nodes.refresh_in_background()
+    # 🆕 RDAPの管轄RIR表 (IANAブートストラップ) も同様に、古ければバックグラウンドで更新する
+    get_rdap_bootstrap_registry().refresh_in_background()
+    cidr_cache = get_cidr_cache()
+    # 🆕 バックグラウンドジョブの最新状態をセッションへ反映する
+    current_job = sync_search_job_state()
     
     with st.sidebar:
         st.markdown("### 🛠️ Menu")
@@ -1497,8 +1187,25 @@ def main():
         pro_api_key = st.text_input("ipinfo.io API Key", type="password", help="入力するとipinfo.ioの高精度データベースを使用します。空欄の場合はip-api.com(無料)を使用します。")
         
         st.markdown("---")
+        # 🆕 中断した検索ジョブの再開 (未完了・隔離中のIPだけを再照会する)
+        st.markdown("#### 🗂️ 検索ジョブの再開")
+        if current_job is not None:
+            st.caption(f"現在のジョブID: `{current_job.job_id}`")
+        resume_job_id = st.text_input("ジョブID", key="resume_job_id", placeholder="20250101-120000-a1b2c3")
+        resumable_jobs = [job for job in list_search_jobs(statuses=RESUMABLE_JOB_STATUSES, limit=5) if current_job is None or job.job_id != current_job.job_id]
+        if resumable_jobs:
+            st.caption("未完了・実行中のジョブ:\n" + "\n".join(f"- `{job.summary_text()}`" for job in resumable_jobs))
+        if st.button("▶️ ジョブを再開 / 接続", disabled=not resume_job_id.strip() or st.session_state.is_searching):
+            try:
+                resume_search_job(resume_job_id.strip(), cidr_cache, tor_nodes, pro_api_key)
+                st.rerun()
+            except (OSError, ValueError) as e:
+                st.error(f"ジョブを再開できません: {e}")
+
+        st.markdown("---")
+        st.caption(f"🧅 Tor出口ノード: {tor_nodes.status_text()}")
         if st.button("🔄 IPキャッシュクリア", help="キャッシュが古くなった場合にクリック"):
-            st.session_state['cidr_cache'] = {} 
+            cidr_cache.clear()
             st.info("IP/CIDRキャッシュをクリアしました。")
             st.rerun()
 
@@ -1546,15 +1253,25 @@ def main():
             - **IP Geolocation / ISP 情報**: 
                 - 無料版: `ip-api.com` (毎分45リクエスト制限)
                 - Pro版: `ipinfo.io` (APIキーに基づく制限)
-            - **Whois (RDAP)**: APNIC等の各地域レジストリ公式サーバー
-            - **Tor出口ノード**: Tor Project公式サイトより起動時に最新リストを取得
+            - **Whois (RDAP)**: APNIC等の各地域レジストリ公式サーバー（IANAのブートストラップ表から管轄レジストリを判定して直接照会）
+            - **Tor出口ノード**: Tor Project公式サイトの最新リストをディスクに保存し、1時間ごとにバックグラウンドで差分確認（取得失敗時は前回の一覧を継続使用）
 
             #### 2. 強力な名寄せ機能
             `ip-api` 等のデータベースに残る古いISP名称（例: JCN, Jupiter, So-net等）を、独自辞書により現在のブランド名（例: J:COM, Sony, NTT等）に自動変換して集計します。これにより、表記揺れによる分析のストレスを軽減します。
 
             #### 3. 技術的仕様
-            - **並列処理**: マルチスレッドによる高速検索（APIレートリミット自動調整機能付き）
-            - **CIDRキャッシュ**: 同一ネットワーク帯域（/24など）への重複リクエストを回避し、高速化
+            - **並列処理**: マルチスレッドによる高速検索（APIレートリミット自動調整機能付き）。全スレッド共有のトークンバケットが `ip-api.com` の `X-Rl`/`X-Ttl` ヘッダーを読み取り、毎分45リクエストの上限ちょうどで動作するようペースを調整します
+            - **適応型の並列数制御 (AIMD)**: 並列数とリクエスト間隔はデータソース（ip-api・ip-api batch・ipinfo・RDAP）ごとに自動調整します。応答が安定していれば間隔を縮め並列数を少しずつ増やし、429・エラー・応答時間の急増を検知すると並列数を半分程度に絞ります。調整履歴は `.whois_cache/concurrency_logs/` に記録されます
+            - **CIDRキャッシュ**: 同一ネットワーク帯域への重複リクエストを回避し、高速化（SQLiteファイルに24時間保存され、全セッション・再起動後も共有）。RDAP併用時は実際の割り当て範囲（例: /12 のモバイル回線帯域）で保存し、最長一致で検索します
+            - **DNS解決**: オプションを有効にすると、ドメインをスレッドプールで並列にA/AAAA解決し（1件あたりのタイムアウト付き）、得られたIPを通常のIP照会に加えます。ドメイン行には解決したIP、IP行には解決元のドメインを表示・出力します。解決結果は5分間、NXDOMAIN等の失敗は1分間キャッシュします
+            - **逆引き (PTR)**: オプションを有効にすると、各IPのPTRレコードを並列に逆引きしてPTR列に出力します（同時実行数・1件あたりのタイムアウト・全体の時間予算あり）。PTRが無いIPも10分間キャッシュし、再照会しません。判定補助を有効にすると、VPS・クラウド等のホスト名から「Hosting/DataCenter (PTR)」を付けます
+            - **オフラインDB**: ip2asn形式のTSV（またはMaxMind形式の .mmdb）を置くと、IPレンジの開始・終了アドレスをソート済み配列に読み込み、二分探索（NumPy searchsorted）で一括照会します。ネットワーク通信なしで100万件規模を数秒〜十数秒で処理し、未収録のIPだけをAPIへ回します
+            - **RDAPレンジキャッシュ**: RDAP応答は割り当て範囲（startAddress〜endAddress）単位で保持し、同じ割り当て内の後続IPはRDAPへ再照会せずに回答します
+            - **プロバイダ自動切替**: `ip-api.com` が429やタイムアウトを返した場合は待機せず、設定済みの他のデータソース（ipinfo.io・RDAP）へ切り替えて照会を続けます。429を返したデータソースは指示された時刻まで、連続エラーのデータソースは一時的に候補から外します。ヘッジを有効にすると、平均応答時間の2倍を超えて応答がない時に次のデータソースへも同時に照会します
+            - **バッチモード**: `ip-api.com` の `/batch` エンドポイントで未キャッシュIPを最大100件ずつ1リクエストにまとめて照会（数万件規模のリスト向け）
+            - **バックグラウンド実行**: 照会・レートリミット時の再試行・キャッシュ書き込みはサーバー側のジョブスレッドで行い、画面は進捗を定期的に読み取るだけです。ブラウザを閉じても検索は継続し、ジョブIDで再接続できます（複数ジョブの同時実行も可能）
+            - **検索ジョブの再開**: 完了した結果はジョブごとの追記ログ（`.whois_cache/jobs/<ジョブID>/`）へ逐次保存されます。ブラウザの再読み込みやサーバー再起動で中断しても、サイドバーにジョブIDを入力すれば未完了・隔離中のIPだけを再照会します
+            - **ダウンロードの遅延生成**: CSV/Excel/HTMLは「生成」ボタンを押した時にだけ作成し、検索結果と出力設定のハッシュをキーにセッション内で再利用（チェックボックス操作などの再描画ではファイルを作り直しません）
             - **OCR誤読補正**: `1` と `l`、`0` と `O` などのOCR読み取りミスを自動修正して検索
             """)
             
@@ -1621,7 +1338,7 @@ def main():
                     raw_targets.extend(string_data.splitlines())
                     
                     # 元データフレーム機能は無効化
-                    st.session_state['original_df'] = None
+                    st.session_state['original_table'] = None
                     st.session_state['ip_column_name'] = None
                     
                     st.info(f"📄 テキスト読み込み完了: {len(raw_targets)} 行")
@@ -1631,35 +1348,32 @@ def main():
             
             # --- ローカルモードの場合の読み込み処理 (my版ロジック) ---
             else:
-                ip_col = None
                 try:
-                    if uploaded_file.name.endswith('.csv'):
-                        df_orig = pd.read_csv(uploaded_file)
-                    elif uploaded_file.name.endswith(('.xlsx', '.xls')):
-                        df_orig = pd.read_excel(uploaded_file)
-                    else:
-                        # TXTファイル
-                        raw_targets.extend(uploaded_file.read().decode("utf-8").splitlines())
-                        st.session_state['original_df'] = None
-                        st.session_state['ip_column_name'] = None
-
-                    if df_orig is not None:
-                        st.session_state['original_df'] = df_orig
-                        for col in df_orig.columns:
-                            sample = df_orig[col].dropna().head(10).astype(str)
-                            if any(is_valid_ip(val.strip()) for val in sample):
-                                ip_col = col
-                                break
-                        
-                        if ip_col:
-                            st.session_state['ip_column_name'] = ip_col
-                            raw_targets.extend(df_orig[ip_col].dropna().astype(str).tolist())
+                    if uploaded_file.name.lower().endswith(('.csv', '.xlsx', '.xls')):
+                        # 🆕 チャンク単位で読み込み、IP列と行番号だけを保持する (同じファイルは再読込しない)
+                        table = st.session_state.get('original_table')
+                        if table is None or st.session_state.get('original_file_id') != uploaded_file.file_id:
+                            table = StreamedUploadTable(uploaded_file, uploaded_file.name).scan()
+                            st.session_state['original_table'] = table
+                            st.session_state['original_file_id'] = uploaded_file.file_id
+                        table.source = uploaded_file
+
+                        if table.ip_column is not None:
+                            st.session_state['ip_column_name'] = table.ip_column
+                            raw_targets.extend(table.ip_values)
                             
-                            st.info(f"📄 ファイル読み込み完了: {len(df_orig)} 行 / IP列: `{ip_col}`")
+                            st.info(f"📄 ファイル読み込み完了: {table.row_count} 行 / IP列: `{table.ip_column}`")
                             with st.expander("👀 アップロードデータ・プレビュー", expanded=False):
-                                st.dataframe(df_orig)
+                                st.dataframe(table.preview)
+                                st.caption(f"※ 先頭 {len(table.preview)} 行のみ表示しています")
                         else:
+                            st.session_state['ip_column_name'] = None
                             st.error("ファイル内にIPアドレスの列が見つかりませんでした。")
+                    else:
+                        # TXTファイル
+                        raw_targets.extend(uploaded_file.read().decode("utf-8").splitlines())
+                        st.session_state['original_table'] = None
+                        st.session_state['ip_column_name'] = None
 
                 except Exception as e:
                     st.error(f"ファイル読み込みエラー: {e}")
@@ -1672,48 +1386,18 @@ def main():
         * **ファイル名に注意**: アップロードする場合は、ファイル名に機密情報（例: `ClientA_Log.txt`）を含めず、`list.txt` などの無機質な名前を使用してください。
         """)
     
-    cleaned_raw_targets_list = []
-    target_freq_counts = {}
-
-    if raw_targets:
-        cleaned_raw_targets_list = [clean_ocr_error_chars(t) for t in raw_targets]
-        target_freq_counts = pd.Series(cleaned_raw_targets_list).value_counts().to_dict()
-    else:
-        target_freq_counts = {}
-
-    targets = []
-    ocr_error_chars = set('Iil|OoSsAaBⅡ')
-
-    for t in raw_targets:
-        original_t = t
-        is_ocr_error_likely = any(c in ocr_error_chars for c in original_t)
-        if is_ocr_error_likely:
-            cleaned_t = clean_ocr_error_chars(original_t)
-            if is_valid_ip(cleaned_t):
-                if cleaned_t not in targets: targets.append(cleaned_t)
-                continue
-            t = original_t
-        
-        invalid_ip_chars = set('ghijklmnopqrstuvwxyz')
-        has_hyphen = '-' in t
-        has_strictly_domain_char = any(c in invalid_ip_chars for c in t.lower())
-        is_likely_domain_or_host = has_hyphen or has_strictly_domain_char
-    
-        if is_valid_ip(t):
-            if t not in targets: targets.append(t)
-        elif is_likely_domain_or_host:
-            if t not in targets: targets.append(t)
-        else:
-            cleaned_t_final = clean_ocr_error_chars(t)
-            if cleaned_t_final not in targets: targets.append(cleaned_t_final)
+    # 🆕 重複除去・OCR補正・出現回数の集計を1パスで行う (大量行の貼り付けでも線形時間)
+    targets, target_freq_counts, cleaned_raw_targets_list = ingest_targets(raw_targets)
 
     has_new_targets = (targets != st.session_state.targets_cache)
     
-    if has_new_targets or 'target_freq_map' not in st.session_state:
+    # 入力欄が空の場合 (ジョブ再開後など) は直前の検索の入力情報を保持する
+    if (has_new_targets and targets) or 'target_freq_map' not in st.session_state:
         st.session_state['target_freq_map'] = target_freq_counts
         st.session_state['original_input_list'] = cleaned_raw_targets_list
-    ip_targets = [t for t in targets if is_valid_ip(t)]
-    domain_targets = [t for t in targets if not is_valid_ip(t)]
+    ip_targets, domain_targets = [], []
+    for t in targets:
+        (ip_targets if is_valid_ip(t) else domain_targets).append(t)
     ipv6_count = sum(1 for t in ip_targets if not is_ipv4(t))
     ipv4_count = len(ip_targets) - ipv6_count
 
@@ -1724,29 +1408,47 @@ def main():
     with col_set1:
         display_mode = st.radio(
             "**表示モード:** (検索結果の表示形式とAPI使用有無を設定)",
-            ("標準モード", "集約モード (IPv4 Group)", "簡易モード (APIなし)"),
+            ("標準モード", "集約モード (IP Group)", "簡易モード (APIなし)"),
             key="display_mode_radio",
             horizontal=False
         )
     
     with col_set2:
         api_mode_selection = st.radio(
-            "**API 処理モード:** (速度と安定性のトレードオフ)",
+            "**API 処理モード:** (並列数・待機時間は応答状況に合わせて自動調整)",
             list(MODE_SETTINGS.keys()),
             key="api_mode_radio",
             horizontal=False
         )
         # 🆕 RDAPオプション
-        use_rdap_option = st.checkbox("🔍 高精度モード (RDAP公式台帳の併用 - 低速)", value=False, help="無料APIのISP情報に加え、RDAP(公式台帳)から最新のネットワーク名を取得します。通信が増えるため処理が遅くなります。")
+        use_rdap_option = st.checkbox("🔍 高精度モード (RDAP公式台帳の併用 - 低速)", value=False, key="use_rdap_checkbox", help="無料APIのISP情報に加え、RDAP(公式台帳)から最新のネットワーク名を取得します。通信が増えるため処理が遅くなります。")
+        # 🆕 プロバイダ切替: 429・タイムアウト時に隔離せず、他の設定済みデータソースへ切り替える
+        use_failover_option = st.checkbox("🔀 プロバイダ自動切替 (429/タイムアウト時に ipinfo・RDAP 等へフェイルオーバー)", value=True, key="failover_checkbox", help="レートリミット到達時に待機せず、別のデータソースで照会を続けます。切替先によってISP名の表記が異なる場合があります (Statusにデータソースが表示されます)。")
+        use_hedge_option = st.checkbox("⚡ 低速応答のヘッジ (応答が遅い時に次のデータソースへも同時に照会)", value=False, key="hedge_checkbox", disabled=not use_failover_option, help="平均応答時間の2倍を超えても応答がない場合、次のデータソースにも問い合わせて先に返った結果を使います。リクエスト数は増えます。")
+        # 🆕 ドメインのDNS解決: 解決したA/AAAAのIPも通常のIP照会に回す
+        resolve_domains_option = st.checkbox("🌐 ドメインをDNS解決 (A/AAAA) し、解決したIPも照会", value=False, key="resolve_domains_checkbox", help="ドメイン行に解決したIP一覧を表示し、各IPの行には解決元のドメインを表示します。解決結果は一定時間キャッシュされます。")
+        # 🆕 逆引き (PTR): ホスト名から回線種別 (ホスティング・一般回線・モバイル) の手掛かりを得る
+        use_ptr_option = st.checkbox("🔁 逆引き (PTR) ホスト名を取得", value=False, key="ptr_checkbox", help="各IPのPTRレコードを並列に逆引きし、PTR列として表示・出力します。PTRが無い応答も一定時間キャッシュします。")
+        ptr_time_budget = st.number_input("逆引きの時間予算 (秒, 0 = 無制限)", min_value=0, value=0, step=10, key="ptr_budget_input", disabled=not use_ptr_option, help="検索開始からこの秒数を過ぎた後は新たな逆引きを行わず、キャッシュ済みの分だけを反映します。大量検索で逆引きに時間を取られないようにする場合に設定します。")
+        use_ptr_classify_option = st.checkbox("PTRホスト名でホスティング判定を補う", value=False, key="ptr_classify_checkbox", disabled=not use_ptr_option, help="ISP名では一般回線と判定されたIPでも、PTRにVPS・クラウド等の名前が含まれれば「Hosting/DataCenter (PTR)」とします。")
+        # 🆕 オフラインDB: ローカルのASN/国データで先に照会し、未収録のIPだけをAPIへ回す
+        offline_db_available = os.path.exists(OFFLINE_DB_PATH)
+        use_offline_db_option = st.checkbox("📦 オフラインDBを優先 (ローカルのASN/国データで照会し、未収録分のみAPIへ)", value=offline_db_available, key="offline_db_checkbox", disabled=not offline_db_available, help=f"ip2asn形式のTSV (または .mmdb) を {OFFLINE_DB_PATH} に置くと有効になります (環境変数 WHOIS_OFFLINE_DB で変更可)。大量検索でも数秒で照会でき、APIのレートリミットを消費しません。ISP名はAS名になります。")
+        offline_only_option = st.checkbox("✈️ オフラインDBのみ (通信なし)", value=False, key="offline_only_checkbox", disabled=not (offline_db_available and use_offline_db_option), help="オフラインDBに収録されていないIPもAPIへは照会せず、「Not Found (Local DB)」として扱います。")
+        live_refresh_seconds = st.select_slider(
+            "📊 リアルタイム集計の更新間隔 (秒)",
+            options=LIVE_DASHBOARD_REFRESH_OPTIONS,
+            value=LIVE_DASHBOARD_REFRESH_SECONDS,
+            key="live_refresh_seconds",
+            help="検索中のグラフ・地図の再描画間隔です。大量検索時は長めにするとブラウザとサーバーの負荷が下がります。"
+        )
     
     selected_settings = MODE_SETTINGS[api_mode_selection]
-    max_workers = selected_settings["MAX_WORKERS"]
-    delay_between_requests = selected_settings["DELAY_BETWEEN_REQUESTS"]
-    rate_limit_wait_seconds = RATE_LIMIT_WAIT_SECONDS
+    batch_size = selected_settings.get("BATCH_SIZE", 1)
 
     mode_mapping = {
         "標準モード": "標準モード (1ターゲット = 1行)",
-        "集約モード (IPv4 Group)": "集約モード (IPv4アドレスをISP/国別でグループ化)",
+        "集約モード (IP Group)": "集約モード (IPアドレスをISP/国別でグループ化・最小CIDR要約)",
         "簡易モード (APIなし)": "簡易モード (APIなし - セキュリティリンクのみ)"
     }
     current_mode_full_text = mode_mapping[display_mode]
@@ -1759,16 +1461,18 @@ def main():
     total_ip_targets_for_display = len(ip_targets) + len(st.session_state.deferred_ips)
 
     with col_act1:
-        st.success(f"**Target:** IPv4: {ipv4_count} / IPv6: {ipv6_count} / Domain: {len(domain_targets)} (Pending: {len(st.session_state.deferred_ips)}) / **CIDR Cache:** {len(st.session_state.cidr_cache)}")
+        st.success(f"**Target:** IPv4: {ipv4_count} / IPv6: {ipv6_count} / Domain: {len(domain_targets)} (Pending: {len(st.session_state.deferred_ips)}) / **CIDR Cache:** {cidr_cache.stats_text()}")
         if pro_api_key:
             st.info("🔑 **Pro Mode Active:** ipinfo.io データベースを使用します")
 
     with col_act2:
         if is_currently_searching:
             if st.button("❌ 中止", type="secondary", use_container_width=True):
+                # ジョブは実行中のリクエストの完了を待って停止し、状態をチェックポイントへ保存する
                 st.session_state.cancel_search = True
                 st.session_state.is_searching = False
-                st.session_state.deferred_ips = {}
+                if current_job is not None:
+                    current_job.cancel()
                 st.rerun()
         else:
             execute_search = st.button(
@@ -1781,171 +1485,22 @@ def main():
     if ('execute_search' in locals() and execute_search and (has_new_targets or len(st.session_state.deferred_ips) > 0)) or is_currently_searching:
         
         if ('execute_search' in locals() and execute_search and has_new_targets and len(targets) > 0):
-            st.session_state.is_searching = True
-            st.session_state.cancel_search = False
-            st.session_state.raw_results = []
-            st.session_state.deferred_ips = {}
-            st.session_state.finished_ips = set()
-            st.session_state.targets_cache = targets
-            st.session_state.search_start_time = time.time()
+            # 🆕 照会はバックグラウンドジョブで実行する (スクリプトは進捗を読むだけ)
+            checkpoint = SearchJobCheckpoint.create(targets, st.session_state.get('original_input_list', targets), {
+                'display_mode': display_mode, 'api_mode': api_mode_selection, 'use_rdap': use_rdap_option,
+                'failover': use_failover_option, 'hedge': use_failover_option and use_hedge_option,
+                'offline_db': offline_db_available and use_offline_db_option,
+                'offline_only': offline_db_available and use_offline_db_option and offline_only_option,
+                'resolve_domains': resolve_domains_option,
+                'ptr': use_ptr_option, 'ptr_time_budget': ptr_time_budget if use_ptr_option else 0,
+                'ptr_classify': use_ptr_option and use_ptr_classify_option,
+            })
+            attach_search_job(submit_search_job(checkpoint, cidr_cache, tor_nodes, pro_api_key))
             st.rerun() 
             
-        elif is_currently_searching:
-            targets = st.session_state.targets_cache
-            ip_targets = [t for t in targets if is_valid_ip(t)]
-            domain_targets = [t for t in targets if not is_valid_ip(t)]
-
+        elif is_currently_searching and current_job is not None:
             st.subheader("⏳ 処理中...")
-            
-            total_targets = len(targets)
-            total_ip_api_targets = len(ip_targets)
-            
-            ip_targets_to_process = [ip for ip in ip_targets if ip not in st.session_state.finished_ips]
-            
-            current_time = time.time()
-            ready_to_retry_ips = []
-            deferred_ips_new = {}
-            for ip, defer_time in st.session_state.deferred_ips.items():
-                if current_time >= defer_time:
-                    ready_to_retry_ips.append(ip)
-                else:
-                    deferred_ips_new[ip] = defer_time
-            
-            st.session_state.deferred_ips = deferred_ips_new
-            
-            immediate_ip_queue_unique = []
-            for ip in ip_targets_to_process:
-                if ip not in st.session_state.deferred_ips and ip not in immediate_ip_queue_unique:
-                    immediate_ip_queue_unique.append(ip)
-
-            immediate_ip_queue = immediate_ip_queue_unique
-            immediate_ip_queue.extend(ready_to_retry_ips)
-            
-            if "簡易" in current_mode_full_text:
-                if not st.session_state.raw_results:
-                    results_list = []
-                    for t in targets:
-                        results_list.append(get_simple_mode_details(t))
-                    st.session_state.raw_results = results_list
-                    st.session_state.finished_ips.update(targets)
-                    st.session_state.is_searching = False
-                    st.rerun()
-
-            else:
-                if not any(res['ISP'] == 'Domain/Host' for res in st.session_state.raw_results) and domain_targets:
-                    st.session_state.raw_results.extend([get_domain_details(d) for d in domain_targets])
-                    st.session_state.finished_ips.update(domain_targets)
-                    
-                prog_bar_container = st.empty()
-                status_text_container = st.empty()
-                summary_container = st.empty() 
-
-                if immediate_ip_queue:
-                    cidr_cache_snapshot = st.session_state.cidr_cache.copy() 
-                    
-                    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                        future_to_ip = {
-                            executor.submit(
-                                get_ip_details_from_api, 
-                                ip, 
-                                cidr_cache_snapshot, 
-                                delay_between_requests, 
-                                rate_limit_wait_seconds,
-                                tor_nodes,
-                                use_rdap_option,
-                                pro_api_key # APIキーを渡す
-                            ): ip for ip in immediate_ip_queue
-                        }
-                        remaining = set(future_to_ip.keys())
-                        
-                        while remaining and not st.session_state.cancel_search:
-                            done, remaining = wait(remaining, timeout=0.1, return_when=FIRST_COMPLETED)
-                            
-                            for f in done:
-                                res_tuple = f.result()
-                                res = res_tuple[0]
-                                new_cache_entry = res_tuple[1]
-                                ip = res['Target_IP']
-                                
-                                if new_cache_entry:
-                                    st.session_state.cidr_cache.update(new_cache_entry)
-                                
-                                if res.get('Status', '').startswith('Success'):
-                                    st.session_state.raw_results.append(res)
-                                    st.session_state.finished_ips.add(ip)
-                                elif res.get('Defer_Until'):
-                                    st.session_state.deferred_ips[ip] = res['Defer_Until']
-                                else:
-                                    st.session_state.raw_results.append(res)
-                                    st.session_state.finished_ips.add(ip)
-
-                            if total_ip_api_targets > 0:
-                                processed_api_ips_count = len([ip for ip in st.session_state.finished_ips if is_valid_ip(ip)])
-                                pct = int(processed_api_ips_count / total_ip_api_targets * 100)
-                                elapsed_time = time.time() - st.session_state.search_start_time
-                                eta_seconds = 0
-                                if processed_api_ips_count > 0:
-                                    rate = processed_api_ips_count / elapsed_time
-                                    remaining_count = total_ip_api_targets - processed_api_ips_count
-                                    eta_seconds = math.ceil(remaining_count / rate)
-                                
-                                eta_display = "計算中..."
-                                if eta_seconds > 0:
-                                    minutes = int(eta_seconds // 60)
-                                    seconds = int(eta_seconds % 60)
-                                    eta_display = f"{minutes:02d}:{seconds:02d}"
-                                    
-                                with prog_bar_container:
-                                    st.progress(pct)
-                                with status_text_container:
-                                    st.caption(f"**Progress:** {processed_api_ips_count}/{total_ip_api_targets} | **Deferred:** {len(st.session_state.deferred_ips)} | **CIDR Cache:** {len(st.session_state.cidr_cache)} | **Remaining Time:** {eta_display}")
-                                
-                                isp_df, country_df, freq_df, country_all_df, isp_full_df, country_full_df, freq_full_df = summarize_in_realtime(st.session_state.raw_results)
-                                with summary_container.container():
-                                    st.markdown("---")
-                                    draw_summary_content(isp_df, country_df, freq_df, country_all_df, "📊 Real-time analysis")
-                                st.markdown("---")
-
-                            if not remaining and not st.session_state.deferred_ips:
-                                break
-                            
-                            if st.session_state.deferred_ips:
-                                st.rerun()  
-                            
-                            time.sleep(0.5) 
-                            
-                        if total_ip_api_targets > 0 and not st.session_state.deferred_ips:
-                            processed_api_ips_count = len([ip for ip in st.session_state.finished_ips if is_valid_ip(ip)])
-                            final_pct = int(processed_api_ips_count / total_ip_api_targets * 100)
-                            with prog_bar_container:
-                                st.progress(final_pct)
-                            with status_text_container:
-                                st.caption(f"**Progress:** {processed_api_ips_count}/{total_ip_api_targets} | **Deferred:** {len(st.session_state.deferred_ips)} | **CIDR Cache:** {len(st.session_state.cidr_cache)} | **Remaining Time:** 完了")
-                        
-                if len(st.session_state.finished_ips) == total_targets and not st.session_state.deferred_ips:
-                    st.session_state.is_searching = False
-                    st.info("✅ 全ての検索が完了しました。")
-                    summary_container.empty()
-                    st.rerun()
-                
-                elif st.session_state.deferred_ips and not st.session_state.cancel_search:
-                    next_retry_time = min(st.session_state.deferred_ips.values())
-                    wait_time = max(1, int(next_retry_time - time.time()))
-                    
-                    prog_bar_container.empty()
-                    status_text_container.empty()
-                    summary_container.empty()
-                    st.warning(f"⚠️ **APIレートリミットに達しました。** 隔離中の **{len(st.session_state.deferred_ips)}** 件のIPアドレスは **{wait_time}** 秒後に再試行されます。")
-                    time.sleep(min(5, wait_time)) 
-                    st.rerun()
-
-                elif st.session_state.cancel_search:
-                    prog_bar_container.empty()
-                    status_text_container.empty()
-                    summary_container.empty()
-                    st.warning("検索がユーザーによって中止されました。")
-                    st.session_state.is_searching = False
-                    st.rerun()
+            st.fragment(run_every=live_refresh_seconds)(render_search_progress)(current_job, cidr_cache)
 
 
     # --- 結果表示 ---
@@ -1955,13 +1510,27 @@ def main():
         if st.session_state.get('debug_summary'):
             with st.expander("🛠️ デバッグ情報 (集計データ確認用)", expanded=False):
                 st.markdown("**API 処理モード設定**")
-                st.write(f"MAX_WORKERS: {max_workers}")
-                st.write(f"DELAY_BETWEEN_REQUESTS: {delay_between_requests}")
+                st.write(f"BATCH_SIZE: {batch_size}")
+                for provider, controller in concurrency_controllers.items():
+                    st.write(f"CONCURRENCY[{provider}]: {controller.status_text()}")
+                for provider, limiter in rate_limiters.items():
+                    st.write(f"RATE_LIMITER[{provider}]: {limiter.status_text()}")
+                for provider, stats in provider_stats.items():
+                    st.write(f"PROVIDER[{provider}]: {stats.status_text()}")
+                st.write(f"RDAP_BOOTSTRAP: {get_rdap_bootstrap_registry().status_text()}")
+                st.write(f"RDAP_RANGE_CACHE: {rdap_range_cache.stats_text()}")
+                st.write(f"DNS_CACHE: {dns_resolver.stats_text()}")
+                st.write(f"PTR_CACHE: {ptr_resolver.stats_text()}")
+                offline_db = get_offline_database() if use_offline_db_option else None
+                st.write(f"OFFLINE_DB: {offline_db.status_text() if offline_db else '未使用'}")
+                st.write(f"ACTIVE_JOBS: {[job.job_id for job in search_job_manager.active_jobs()]}")
                 st.markdown("---")
                 st.json(st.session_state['debug_summary'].get('country_code_counts', {}))
                 st.json(st.session_state['debug_summary'].get('country_all_df', []))
                 st.markdown("---")
-                st.json(st.session_state.get('cidr_cache', {}))
+                st.json(cidr_cache.snapshot())
+                st.markdown(f"**並列数・間隔の調整履歴** (`{concurrency_decision_log.path}`)")
+                st.json(concurrency_decision_log.recent_entries())
 
         
         successful_results = [r for r in res if r['Status'].startswith('Success') or r['Status'].startswith('Aggregated')]
@@ -1981,147 +1550,152 @@ def main():
         else:
             display_res = successful_results + error_results
             target_order = {ip: i for i, ip in enumerate(targets)}
-            display_res.sort(key=lambda x: target_order.get(get_copy_target(x['Target_IP']), float('inf')))
+            # DNS解決で追加したIPは、解決元ドメインの直後に並べる
+            display_res.sort(key=lambda x: target_order.get(
+                get_copy_target(x['Target_IP']),
+                target_order.get(x.get('Resolved_From', '').split(', ')[0], float('inf')) + 0.5
+            ))
 
         display_results(display_res, current_mode_full_text, display_mode)
         
+        # 🆕 ダウンロード成果物のキー: 結果セットの内容ハッシュ (追記がなければ再計算しない)
+        results_digest = content_digest('raw_results', st.session_state.raw_results)
+        pending_ips = sorted(st.session_state.deferred_ips)
+
+        # 元データ結合の結果 (検索中は作らないが、下のダウンロード欄から参照する)
+        # merged_key は結合対象がある時だけ設定し、大きい表では df_with_res を作らない
+        df_with_res = pd.DataFrame()
+        merged_key = None
         if not st.session_state.is_searching or st.session_state.cancel_search:
-            isp_df, country_df, freq_df, country_all_df, isp_full_df, country_full_df, freq_full_df = summarize_in_realtime(st.session_state.raw_results)
+            # 全件テーブルはダウンロード生成時にだけ作る
+            isp_df, country_df, freq_df, country_all_df, _, _, _ = summarize_in_realtime(st.session_state.raw_results, include_full=False)
             
             st.markdown("---")
-            draw_summary_content(isp_df, country_df, freq_df, country_all_df, "✅ 集計結果")
+            draw_summary_content(build_summary_charts(isp_df, country_df, freq_df, country_all_df), "✅ 集計結果")
 
             # --- 元データ結合処理（画面表示 & ダウンロード共通） ---
-            df_with_res = pd.DataFrame() # 初期化
-            if st.session_state.get('original_df') is not None and st.session_state.get('ip_column_name'):
-                df_with_res = st.session_state['original_df'].copy()
-                ip_col = st.session_state['ip_column_name']
+            table = st.session_state.get('original_table')
+            if table is not None and st.session_state.get('ip_column_name'):
                 results = st.session_state.get('raw_results', []) 
-                
-                if results:
-                    res_dict = {r['Target_IP']: r for r in results}
-
-                    # 各行のIPに基づいて結果をマッピング
-                    isps, isps_jp, countries, countries_jp, proxy_type, statuses = [], [], [], [], [], []
-                    for ip_val in df_with_res[ip_col]:
-                        ip_val_str = str(ip_val).strip()
-                        info = res_dict.get(ip_val_str, {})
-                        isps.append(info.get('ISP', 'N/A'))
-                        isps_jp.append(info.get('ISP_JP', 'N/A')) 
-                        countries.append(info.get('Country', 'N/A'))
-                        countries_jp.append(info.get('Country_JP', 'N/A'))
-                        proxy_type.append(info.get('Proxy_Type', ''))
-                        statuses.append(info.get('Status', 'N/A'))
-                    
-                    # 結合
-                    insert_idx = df_with_res.columns.get_loc(ip_col) + 1
-                    df_with_res.insert(insert_idx, 'Status', statuses)
-                    df_with_res.insert(insert_idx, 'Proxy Type', proxy_type)
-                    df_with_res.insert(insert_idx, 'Country_JP', countries_jp)
-                    df_with_res.insert(insert_idx, 'Country', countries)
-                    df_with_res.insert(insert_idx, 'ISP_JP', isps_jp)
-                    df_with_res.insert(insert_idx, 'ISP', isps)
+                merged_key = artifact_key('merged', st.session_state.get('original_file_id'), table.ip_column, results_digest)
+
+                # 🆕 元データはアップロードファイルを読み直して結合する (全列を常駐させない)
+                if table.row_count <= MERGED_VIEW_MAX_ROWS:
+                    df_with_res = get_merged_dataframe(table, results)
+                else:
+                    st.info(f"📄 アップロードデータが {table.row_count} 行あるため、画面上のクロス分析は省略します。結合データはCSVとしてローカルに保存でき、分析付きExcelはファイルから順に読み直して生成します。")
+                    if st.button("💾 元データ + 検索結果をCSVで保存", key="save_merged_csv"):
+                        export_path = os.path.join(EXPORT_DIR, f"{os.path.splitext(table.name)[0]}_whois.csv")
+                        with st.spinner("結合データを書き出しています..."):
+                            table.write_merged_csv(build_results_table(results), export_path)
+                        st.success(f"保存しました: `{os.path.abspath(export_path)}`")
 
             # --- 新機能：元データ x 検索結果 クロス分析表示 ---
             if not df_with_res.empty:
                 st.markdown("---")
-                render_merged_analysis(df_with_res)
+                render_merged_analysis(df_with_res, merged_key)
             # ------------------------------------------------
 
             # --- 全件集計データのダウンロードセクション ---
             st.markdown("### 📊 集計データの完全版ダウンロード")
-            st.caption("※ 上記グラフのTop10制限を解除した、すべての集計データとグラフをダウンロードできます。")
+            st.caption("※ 上記グラフのTop10制限を解除した、すべての集計データとグラフをダウンロードできます。ファイルは「生成」ボタンを押した時に作成され、結果が変わるまで再利用されます。")
             
             col_full_dl1, col_full_dl2, col_full_dl3, col_full_dl4 = st.columns(4)
+            summary_key = (results_digest, content_digest('original_input_list', st.session_state.get('original_input_list', [])))
             
             with col_full_dl1:
-                st.download_button(
+                lazy_download_button(
                     "⬇️ 対象IP カウント (全件)",
-                    freq_full_df.to_csv(index=False).encode('utf-8-sig'),
+                    artifact_key('freq_csv', *summary_key),
+                    lambda: encode_csv(build_full_summary_tables()[2]),
                     "target_ip_frequency_all.csv",
-                    "text/csv",
-                    use_container_width=True
+                    "text/csv"
                 )
             with col_full_dl2:
-                st.download_button(
+                lazy_download_button(
                     "⬇️ ISP別 カウント (全件)",
-                    isp_full_df.to_csv(index=False).encode('utf-8-sig'),
+                    artifact_key('isp_csv', *summary_key),
+                    lambda: encode_csv(build_full_summary_tables()[0]),
                     "isp_counts_all.csv",
-                    "text/csv",
-                    use_container_width=True
+                    "text/csv"
                 )
             with col_full_dl3:
-                st.download_button(
+                lazy_download_button(
                     "⬇️ 国別 カウント (全件)",
-                    country_full_df.to_csv(index=False).encode('utf-8-sig'),
+                    artifact_key('country_csv', *summary_key),
+                    lambda: encode_csv(build_full_summary_tables()[1]),
                     "country_counts_all.csv",
-                    "text/csv",
-                    use_container_width=True
+                    "text/csv"
                 )
             
             with col_full_dl4:
                 # 全件グラフHTMLレポートの生成
-                html_report = generate_full_report_html(isp_full_df, country_full_df, freq_full_df)
-                st.download_button(
+                lazy_download_button(
                     "⬇️ 全件グラフHTMLレポート",
-                    html_report,
+                    artifact_key('full_report_html', *summary_key),
+                    lambda: generate_full_report_html(*build_full_summary_tables()),
                     "whois_analysis_report.html",
-                    "text/html",
-                    use_container_width=True
+                    "text/html"
                 )
 
         
         st.markdown("### ⬇️ 検索結果リストのダウンロード")
         col_dl1, col_dl2, col_dl3 = st.columns(3)
         # 1. 画面表示順データ
-        csv_display = pd.DataFrame(display_res).drop(columns=['CountryCode', 'Secondary_Security_Links', 'RIR_Link'], errors='ignore').astype(str)
+        display_key = (results_digest, pending_ips, current_mode_full_text, content_digest('targets', targets))
         with col_dl1:
-            st.download_button("⬇️ CSV (画面表示順)", csv_display.to_csv(index=False).encode('utf-8-sig'), "whois_results_display.csv", "text/csv", use_container_width=True)
+            lazy_download_button("⬇️ CSV (画面表示順)", artifact_key('display_csv', *display_key), lambda: encode_csv(build_result_csv_frame(display_res)), "whois_results_display.csv", "text/csv")
             # Excel (Display)
-            excel_display = convert_df_to_excel(csv_display)
-            st.download_button("⬇️ Excel (画面表示順)", excel_display, "whois_results_display.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+            lazy_download_button("⬇️ Excel (画面表示順)", artifact_key('display_xlsx', *display_key), lambda: convert_df_to_excel(build_result_csv_frame(display_res)), "whois_results_display.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            if "集約" in current_mode_full_text:
+                lazy_download_button("⬇️ FWルール用CIDRリスト (.txt)", artifact_key('cidr_txt', *display_key), lambda: build_firewall_cidr_text(display_res).encode('utf-8'), "whois_cidr_blocklist.txt", "text/plain")
 
         # 2. 全入力データ（入力順）
-        result_lookup = {r['Target_IP']: r for r in st.session_state.raw_results}
-        full_output_data = []
-        for original_t in st.session_state.get('original_input_list', []):
-            if original_t in result_lookup:
-                full_output_data.append(result_lookup[original_t])
-            else:
-                full_output_data.append({'Target_IP': original_t, 'ISP': 'N/A', 'ISP_JP': 'N/A', 'Country': 'N/A', 'Country_JP': 'N/A', 'Status': 'Pending/Error'})
+        def build_full_output_frame():
+            result_lookup = {r['Target_IP']: r for r in st.session_state.raw_results}
+            full_output_data = []
+            for original_t in st.session_state.get('original_input_list', []):
+                if original_t in result_lookup:
+                    full_output_data.append(result_lookup[original_t])
+                else:
+                    full_output_data.append({'Target_IP': original_t, 'ISP': 'N/A', 'ISP_JP': 'N/A', 'Country': 'N/A', 'Country_JP': 'N/A', 'Status': 'Pending/Error'})
+            return build_result_csv_frame(full_output_data)
         
-        csv_full = pd.DataFrame(full_output_data).drop(columns=['CountryCode', 'Secondary_Security_Links', 'RIR_Link'], errors='ignore').astype(str)
+        full_key = (results_digest, content_digest('original_input_list', st.session_state.get('original_input_list', [])))
         with col_dl2:
-            st.download_button("⬇️ CSV (全入力データ順)", csv_full.to_csv(index=False).encode('utf-8-sig'), "whois_results_full.csv", "text/csv", use_container_width=True)
+            lazy_download_button("⬇️ CSV (全入力データ順)", artifact_key('full_csv', *full_key), lambda: encode_csv(build_full_output_frame()), "whois_results_full.csv", "text/csv")
             # Excel (Full)
-            excel_full = convert_df_to_excel(csv_full)
-            st.download_button("⬇️ Excel (全入力データ順)", excel_full, "whois_results_full.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", use_container_width=True)
+            lazy_download_button("⬇️ Excel (全入力データ順)", artifact_key('full_xlsx', *full_key), lambda: convert_df_to_excel(build_full_output_frame()), "whois_results_full.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
         with col_dl3:
-            # 3. 元データ結合ダウンロード（共通処理で作成済みのdf_with_resを使用）
-            if not IS_PUBLIC_MODE and not df_with_res.empty:
+            # 3. 元データ結合ダウンロード（小さい表は共通処理で作成済みのdf_with_res、大きい表はファイルを読み直して使用）
+            if not IS_PUBLIC_MODE and merged_key is not None:
                 st.markdown("**🔍 分析付きExcel (Pivot/Graph)**")
                 
                 # 時間帯分析用の列選択ボックス
-                time_cols = [c for c in df_with_res.columns if 'date' in c.lower() or 'time' in c.lower() or 'jst' in c.lower()]
-                default_idx = df_with_res.columns.get_loc(time_cols[0]) if time_cols else 0
+                merged_columns = list(df_with_res.columns) if not df_with_res.empty else table.columns
+                time_cols = [c for c in merged_columns if 'date' in str(c).lower() or 'time' in str(c).lower() or 'jst' in str(c).lower()]
+                default_idx = merged_columns.index(time_cols[0]) if time_cols else 0
                 
                 selected_time_col = st.selectbox(
                     "時間帯分析(Hour列)に使う日時列を選択:", 
-                    df_with_res.columns, 
+                    merged_columns, 
                     index=default_idx,
                     key="time_col_selector"
                 )
 
-                # Advanced Excel生成 (v5.0)
-                excel_advanced = create_advanced_excel(df_with_res, selected_time_col)
-                
-                st.download_button(
+                def build_advanced_excel():
+                    if not df_with_res.empty:
+                        return create_advanced_excel(df_with_res, selected_time_col)
+                    return create_advanced_excel_streaming(table.iter_merged_chunks(build_results_table(results)), selected_time_col)
+
+                # Advanced Excel生成 (v5.0) はボタンが押された時だけ
+                lazy_download_button(
                     "⬇️ Excel (分析・グラフ付き)", 
-                    excel_advanced, 
+                    artifact_key('advanced_xlsx', merged_key, selected_time_col),
+                    build_advanced_excel,
                     "whois_analysis_master.xlsx", 
                     "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", 
-                    use_container_width=True,
                     help="生データに加え、ISP別・時間帯別の集計表とグラフ（ピボット）が別シートに含まれます。"
                 )
             else:
@@ -0,0 +1,44 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+# whois_engine はインポート時にキャッシュ等の保存先を決めるため、テスト用の一時ディレクトリを先に設定する
+os.environ.setdefault("WHOIS_DATA_DIR", tempfile.mkdtemp(prefix="whois_test_"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeClock:
+    # whois_engine の time モジュールの代わり。sleep() は待たずに時計だけ進める
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = 0.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def localtime(self, seconds=None):
+        return time.localtime(self.now if seconds is None else seconds)
+
+    def strftime(self, fmt, struct_time=None):
+        return time.strftime(fmt, struct_time or self.localtime())
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    import whois_engine
+    clock = FakeClock()
+    monkeypatch.setattr(whois_engine, "time", clock)
+    return clock
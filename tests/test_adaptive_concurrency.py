@@ -0,0 +1,114 @@
+import threading
+
+import pytest
+
+import whois_engine as we
+
+
+class ListLog:
+    def __init__(self):
+        self.entries = []
+
+    def write(self, entry):
+        self.entries.append(entry)
+
+
+def make_controller(initial_workers=1, max_workers=3, initial_delay=0.0, delay_step=0.1, max_delay=10.0):
+    return we.AdaptiveConcurrencyController(
+        'test', initial_workers, max_workers, initial_delay, 0.0, max_delay, delay_step, decision_log=ListLog(),
+    )
+
+
+def succeed(controller, times=1, latency=0.1):
+    for _ in range(times):
+        controller.release(controller.acquire(), 'success', latency)
+
+
+def test_delay_shrinks_before_workers_grow(fake_clock):
+    controller = make_controller(initial_delay=0.2)
+    controller.release(controller.acquire(), 'success', 0.1)
+    assert (controller.delay, controller.workers) == (0.1, 1)
+    fake_clock.advance(1)
+    controller.release(controller.acquire(), 'success', 0.1)
+    assert (controller.delay, controller.workers) == (0.0, 1)
+    fake_clock.advance(1)
+    succeed(controller)
+    assert controller.workers == 2
+
+
+def test_additive_increase_needs_one_success_per_worker_and_stops_at_max(fake_clock):
+    controller = make_controller()
+    succeed(controller)
+    assert controller.workers == 2
+    succeed(controller)
+    assert controller.workers == 2
+    succeed(controller)
+    assert controller.workers == 3
+    succeed(controller, 10)
+    assert controller.workers == 3
+    assert [entry['workers'] for entry in controller.decision_log.entries] == [2, 3]
+
+
+def test_rate_limit_halves_workers_and_backs_off_delay(fake_clock):
+    controller = make_controller(initial_workers=4, max_workers=4)
+    started = controller.acquire()
+    fake_clock.advance(1)
+    controller.release(started, 'rate_limited')
+    assert controller.workers == 2
+    assert controller.delay == pytest.approx(0.1 * we.AIMD_DELAY_BACKOFF_FACTOR)
+    assert controller.decision_log.entries[-1]['reason'] == '429'
+
+
+def test_failures_started_before_the_last_decrease_are_ignored(fake_clock):
+    controller = make_controller(initial_workers=4, max_workers=4)
+    first, second = controller.acquire(), controller.acquire()
+    fake_clock.advance(1)
+    controller.release(first, 'rate_limited')
+    controller.release(second, 'rate_limited')
+    assert controller.workers == 2
+    assert controller.decreases == 1
+
+    fake_clock.advance(1)
+    controller.release(controller.acquire(), 'rate_limited')
+    assert controller.workers == 1
+    assert controller.decreases == 2
+
+
+def test_errors_shrink_workers_then_back_off_at_one_worker(fake_clock):
+    controller = make_controller(initial_workers=4, max_workers=4)
+    fake_clock.advance(1)
+    controller.release(controller.acquire(), 'error')
+    assert (controller.workers, controller.delay) == (3, 0.0)
+
+    controller = make_controller(initial_workers=1)
+    fake_clock.advance(1)
+    controller.release(controller.acquire(), 'error')
+    assert controller.workers == 1
+    assert controller.delay == pytest.approx(0.1 * we.AIMD_DELAY_BACKOFF_FACTOR)
+    assert controller.decision_log.entries[-1]['reason'] == 'error'
+
+
+def test_latency_spike_decreases_workers(fake_clock):
+    controller = make_controller(initial_workers=3, max_workers=3)
+    succeed(controller, 3, latency=0.1)
+    fake_clock.advance(1)
+    controller.release(controller.acquire(), 'success', latency=5.0)
+    assert controller.workers == 2
+    assert controller.decision_log.entries[-1]['reason'] == 'latency'
+
+
+def test_acquire_waits_for_a_free_slot():
+    controller = make_controller(initial_workers=1)
+    started = controller.acquire()
+    acquired = threading.Event()
+
+    def second():
+        controller.release(controller.acquire(), 'success', 0.1)
+        acquired.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    assert not acquired.wait(0.2)
+    controller.release(started, 'success', 0.1)
+    assert acquired.wait(5)
+    thread.join(5)
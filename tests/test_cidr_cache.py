@@ -0,0 +1,74 @@
+import time
+
+import whois_engine as we
+
+
+def entry(isp, age=0):
+    return {'ISP': isp, 'Country': 'Japan', 'CountryCode': 'JP', 'Timestamp': time.time() - age}
+
+
+def test_entries_survive_restart(tmp_path):
+    db_path = str(tmp_path / "cidr.db")
+    we.PersistentCidrCache(db_path).update({'203.0.113.0/24': entry('EXAMPLE')})
+
+    cache = we.PersistentCidrCache(db_path)
+    assert cache.lookup('203.0.113.77')['ISP'] == 'EXAMPLE'
+    assert cache.lookup('203.0.114.1') is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_written_by_another_process_are_picked_up(tmp_path):
+    db_path = str(tmp_path / "cidr.db")
+    reader = we.PersistentCidrCache(db_path)
+    assert reader.lookup('198.51.100.5') is None
+
+    we.PersistentCidrCache(db_path).update({'198.51.100.0/24': entry('OTHER-WORKER')})
+    assert reader.lookup('198.51.100.5')['ISP'] == 'OTHER-WORKER'
+
+
+def test_expired_entries_are_ignored(tmp_path):
+    cache = we.PersistentCidrCache(str(tmp_path / "cidr.db"), ttl_seconds=60)
+    cache.update({'192.0.2.0/24': entry('STALE', age=120)})
+    assert cache.lookup('192.0.2.1') is None
+    assert len(cache) == 0
+
+    # 期限切れの長いプレフィックスより、有効な短いプレフィックスを使う
+    cache.update({'192.0.0.0/16': entry('FRESH-PARENT')})
+    assert cache.lookup('192.0.2.1')['ISP'] == 'FRESH-PARENT'
+
+    reopened = we.PersistentCidrCache(cache.db_path, ttl_seconds=60)
+    assert reopened.lookup('192.0.2.1')['ISP'] == 'FRESH-PARENT'
+
+
+def test_clear_removes_persisted_entries(tmp_path):
+    db_path = str(tmp_path / "cidr.db")
+    cache = we.PersistentCidrCache(db_path)
+    cache.update({'203.0.113.0/24': entry('EXAMPLE')})
+    cache.clear()
+    assert cache.lookup('203.0.113.1') is None
+    assert we.PersistentCidrCache(db_path).lookup('203.0.113.1') is None
+
+
+def test_prefix_table_returns_longest_match():
+    table = we.CidrPrefixTable()
+    table.insert(we.ipaddress.ip_network('10.0.0.0/8'), 'slash8')
+    table.insert(we.ipaddress.ip_network('10.1.0.0/16'), 'slash16')
+    table.insert(we.ipaddress.ip_network('10.1.2.0/24'), 'slash24')
+    table.insert(we.ipaddress.ip_network('2001:db8::/32'), 'v6')
+
+    assert table.longest_match(we.ipaddress.ip_address('10.1.2.3')) == 'slash24'
+    assert table.longest_match(we.ipaddress.ip_address('10.1.3.3')) == 'slash16'
+    assert table.longest_match(we.ipaddress.ip_address('10.2.0.1')) == 'slash8'
+    assert table.longest_match(we.ipaddress.ip_address('11.0.0.1')) is None
+    assert table.longest_match(we.ipaddress.ip_address('2001:db8:1::1')) == 'v6'
+    assert table.longest_match(we.ipaddress.ip_address('10.1.2.3'), lambda value: value != 'slash24') == 'slash16'
+    assert len(table) == 4
+
+
+def test_cache_uses_the_allocated_network_not_a_fixed_slash24(tmp_path):
+    cache = we.PersistentCidrCache(str(tmp_path / "cidr.db"))
+    cache.update({'203.0.112.0/22': entry('ALLOCATION'), '203.0.113.128/25': entry('REASSIGNED')})
+    assert cache.lookup('203.0.112.9')['ISP'] == 'ALLOCATION'
+    assert cache.lookup('203.0.113.5')['ISP'] == 'ALLOCATION'
+    assert cache.lookup('203.0.113.200')['ISP'] == 'REASSIGNED'
+    assert cache.lookup('203.0.116.1') is None
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import whois_engine as we
+
+
+class BlockingResolver:
+    # release がセットされるまで戻らないリゾルバ (応答しないDNSサーバーの代わり)
+    def __init__(self):
+        self.release = threading.Event()
+
+    def __call__(self, domain):
+        self.release.wait(5)
+        return ['192.0.2.1'], None
+
+
+def test_resolve_caches_answers_and_failures():
+    calls = []
+
+    def stub(domain):
+        calls.append(domain)
+        if domain == 'missing.test':
+            raise we.socket.gaierror(next(iter(we.DNS_NOT_FOUND_ERRNOS)), 'not found')
+        return ['192.0.2.1', 'not-an-ip'], 60
+
+    resolver = we.DnsResolver(resolver=stub, max_workers=2)
+    assert resolver.resolve('example.test') == (['192.0.2.1'], None)
+    assert resolver.resolve('example.test') == (['192.0.2.1'], None)
+    assert resolver.resolve('missing.test') == ([], 'NXDOMAIN')
+    assert resolver.resolve('missing.test') == ([], 'NXDOMAIN')
+    assert calls == ['example.test', 'missing.test']
+
+
+def test_timed_out_calls_keep_their_slot_until_they_finish():
+    stub = BlockingResolver()
+    resolver = we.DnsResolver(resolver=stub, max_workers=2, timeout=0.05)
+    futures = [resolver.submit('a.test'), resolver.submit('b.test')]
+    time.sleep(0.1)
+    # 呼び出し側はタイムアウトで見切っているが、スレッドはまだ解決中
+    assert not any(f.done() for f in futures)
+    assert not resolver.has_capacity()
+
+    stub.release.set()
+    for f in futures:
+        f.result(timeout=5)
+    assert resolver.outstanding == 0
+    assert resolver.has_capacity()
+
+
+def test_lookup_pipeline_does_not_queue_behind_hung_resolutions(tmp_path):
+    db_path = tmp_path / "ip2asn.tsv"
+    db_path.write_text("192.0.2.0\t192.0.2.255\t64500\tJP\tEXAMPLE-NET\n", encoding="utf-8")
+    stub = BlockingResolver()
+    resolver = we.DnsResolver(resolver=stub, max_workers=2, timeout=0.05)
+    domains = [f'host{i}.test' for i in range(6)]
+    threading.Timer(1.0, stub.release.set).start()
+
+    results = list(we.iter_lookup_results(
+        domains, None, set(), next(iter(we.MODE_SETTINGS.values())), resolver=resolver,
+        offline_db=we.OfflineIpDatabase(str(db_path)), offline_only=True,
+    ))
+    # 最初の2件はスレッドを塞いだままタイムアウトするが、残りはその後ろの待ち行列で時間切れにならず、空いてから解決される
+    domain_rows = {res['Target_IP']: res for res in results if res['Target_IP'] in domains}
+    assert len(domain_rows) == len(domains)
+    timed_out = [domain for domain, res in domain_rows.items() if res['Status'] == 'Error: DNS (Timeout)']
+    assert len(timed_out) == 2
+    assert all(domain_rows[domain]['Resolved_IPs'] == '192.0.2.1' for domain in domains if domain not in timed_out)
@@ -0,0 +1,49 @@
+import random
+from collections import Counter
+
+import whois_engine as we
+
+
+def legacy_ingest(raw_targets):
+    # 行ごとに補正・判定し、リストの in で重複を除く従来の実装 (比較用)
+    cleaned_list = [we.clean_ocr_error_chars(t) for t in raw_targets]
+    targets = []
+    for t in raw_targets:
+        if any(c in set('Iil|OoSsAaBⅡ') for c in t):
+            cleaned_t = we.clean_ocr_error_chars(t)
+            if we.is_valid_ip(cleaned_t):
+                if cleaned_t not in targets:
+                    targets.append(cleaned_t)
+                continue
+        is_likely_domain_or_host = '-' in t or any(c in set('ghijklmnopqrstuvwxyz') for c in t.lower())
+        if we.is_valid_ip(t) or is_likely_domain_or_host:
+            if t not in targets:
+                targets.append(t)
+        else:
+            cleaned_t = we.clean_ocr_error_chars(t)
+            if cleaned_t not in targets:
+                targets.append(cleaned_t)
+    return targets, dict(Counter(cleaned_list)), cleaned_list
+
+
+def test_ocr_correction_and_deduplication():
+    lines = ['1.2.3.4', 'l.2.3.4', '1.2.3.4', 'example-host.com', '192.168.O.l', '2001:db8::1', 'l.2.3.4']
+    targets, freq, cleaned = we.ingest_targets(lines)
+    assert targets == ['1.2.3.4', 'example-host.com', '192.168.0.1', '2001:db8::1']
+    assert freq['1.2.3.4'] == 4
+    assert freq['192.168.0.1'] == 1
+    assert cleaned == [we.clean_ocr_error_chars(line) for line in lines]
+
+
+def test_matches_legacy_ingestion_on_random_input():
+    rng = random.Random(3)
+    pool = [f'{rng.randint(1, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 9)}.{rng.randint(0, 9)}' for _ in range(200)]
+    pool += ['l.2.3.4', 'O.O.O.l', '10.0.O.1', 'host-1.example.com', 'example.org', 'Sl.2', '2001:db8::a', 'IIl', '']
+    lines = [rng.choice(pool) for _ in range(3000)]
+    assert we.ingest_targets(lines) == legacy_ingest(lines)
+    assert we.ingest_targets(iter(lines)) == legacy_ingest(lines)
+
+
+def test_iter_unique_targets_streams_the_same_targets():
+    lines = ['1.2.3.4\n', 'l.2.3.4\r\n', 'example.com\n', 'example.com\n']
+    assert list(we.iter_unique_targets(lines)) == ['1.2.3.4', 'example.com']
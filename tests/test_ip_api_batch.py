@@ -0,0 +1,148 @@
+import threading
+
+import pytest
+
+import whois_engine as we
+
+
+class FakeResponse:
+    def __init__(self, payload=None, status_code=200, headers=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.payload
+
+
+class BatchApi:
+    # ip-api.com/batch の代わり。POSTされたIPのリストを記録し、respond(ips) の応答を返す
+    def __init__(self, respond=None):
+        self.posts = []
+        self.respond = respond or (lambda ips: FakeResponse([ip_api_data(ip) for ip in ips]))
+
+    def __call__(self, url, json, timeout):
+        self.posts.append(list(json))
+        return self.respond(json)
+
+
+class RecordingLimiter:
+    def __init__(self):
+        self.blocked_for = []
+
+    def acquire(self):
+        pass
+
+    def update_from_headers(self, headers):
+        pass
+
+    def block_for(self, seconds):
+        self.blocked_for.append(seconds)
+
+
+class StubCidrCache:
+    def __init__(self, cached_ips=()):
+        self.cached_ips = set(cached_ips)
+        self.updates = []
+
+    def lookup(self, ip):
+        if ip in self.cached_ips:
+            return {'ISP': 'Cached ISP', 'Country': 'Japan', 'CountryCode': 'JP'}
+        return None
+
+    def update(self, entry):
+        self.updates.append(entry)
+
+
+def ip_api_data(ip):
+    return {'status': 'success', 'isp': 'Example ISP', 'country': 'Japan', 'countryCode': 'JP', 'query': ip}
+
+
+def ips(count, third_octet=0):
+    return [f"198.51.{third_octet + i // 250}.{i % 250 + 1}" for i in range(count)]
+
+
+@pytest.fixture
+def batch_api(monkeypatch):
+    api = BatchApi()
+    monkeypatch.setattr(we.session, 'post', api)
+    monkeypatch.setitem(we.rate_limiters, 'ip-api-batch', RecordingLimiter())
+    monkeypatch.setitem(
+        we.concurrency_controllers, 'ip-api-batch', we.AdaptiveConcurrencyController('ip-api-batch', 1, 1, 0.0, 0.0, 1.0, 0.1)
+    )
+    return api
+
+
+def test_batch_splits_uncached_ips_into_posts_of_at_most_100(batch_api):
+    targets = ips(260)
+    cache = StubCidrCache(targets[:10])
+    results = we.get_ip_details_batch(targets + targets[:5], cache, 60, set(), use_rdap=False)
+
+    assert [len(post) for post in batch_api.posts] == [100, 100, 50]
+    assert sum(batch_api.posts, []) == targets[10:]
+    assert [res['Target_IP'] for res, _ in results] == targets + targets[:5]
+    assert {res['Status'] for res, _ in results[:10]} == {'Success (Cache)'}
+    assert {res['Status'] for res, _ in results[10:260]} == {'Success (IPv4 API)'}
+
+
+def test_rate_limit_defers_the_whole_batch(fake_clock, batch_api):
+    batch_api.respond = lambda ips: FakeResponse(status_code=429, headers={'X-Ttl': '20'})
+    targets = ips(3)
+    results = we.get_ip_details_batch(targets, StubCidrCache(), 60, set(), use_rdap=False)
+
+    assert we.rate_limiters['ip-api-batch'].blocked_for == [21]
+    for res, cache_entry in results:
+        assert res['Status'] == 'Error: Rate Limit (429)'
+        assert res['Defer_Until'] == pytest.approx(fake_clock.time() + 21)
+        assert cache_entry is None
+    assert we.is_retryable_result(results[0][0])
+
+
+def test_response_length_mismatch_fails_every_ip_in_the_batch(batch_api):
+    batch_api.respond = lambda ips: FakeResponse([ip_api_data(ip) for ip in ips[:-1]])
+    results = we.get_ip_details_batch(ips(3), StubCidrCache(), 60, set(), use_rdap=False)
+
+    assert {res['Status'] for res, _ in results} == {'Error: Network/Timeout (ValueError)'}
+    assert not any('Defer_Until' in res for res, _ in results)
+
+
+def test_pipeline_fills_each_post_with_uncached_ips(batch_api):
+    targets = ips(300)
+    cached = targets[::3]
+    results = list(we.iter_lookup_results(targets, StubCidrCache(cached), set(), {'BATCH_SIZE': 100}))
+
+    # キャッシュヒットを除いた200件が、100件ずつ2回のPOSTになる
+    assert [len(post) for post in batch_api.posts] == [100, 100]
+    assert not set(cached) & set(sum(batch_api.posts, []))
+    statuses = {res['Target_IP']: res['Status'] for res in results}
+    assert len(statuses) == 300
+    assert {statuses[ip] for ip in cached} == {'Success (Cache)'}
+
+
+def test_pipeline_enriches_batch_results_with_rdap_outside_the_batch_worker(batch_api, monkeypatch):
+    second_post = threading.Event()
+    waited = []
+
+    def respond(ips):
+        if len(batch_api.posts) == 2:
+            second_post.set()
+        return FakeResponse([ip_api_data(ip) for ip in ips])
+
+    def fetch_rdap(ip):
+        # 最初の補完 (並列に始まった分を含む) では次のバッチが送信されるのを待つ
+        # (補完がバッチの枠を塞いでいれば送信されない)
+        if not waited:
+            waited.append(second_post.wait(2))
+        return {'name': 'EXAMPLE-NET', 'network': None, 'country': 'JP'}
+
+    batch_api.respond = respond
+    monkeypatch.setattr(we, 'fetch_rdap_data', fetch_rdap)
+    results = list(we.iter_lookup_results(ips(200), StubCidrCache(), set(), {'BATCH_SIZE': 100}, use_rdap=True))
+
+    assert waited and all(waited)
+    assert len(results) == 200
+    assert all('[RDAP: EXAMPLE-NET]' in res['ISP'] for res in results)
@@ -0,0 +1,85 @@
+import ipaddress
+import random
+
+import numpy as np
+
+import whois_engine as we
+
+
+def test_summarize_ip_ints_merges_contiguous_ranges():
+    ips = ['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.3', '10.0.0.9']
+    summary = we.summarize_ip_ints([int(ipaddress.IPv4Address(ip)) for ip in ips], 4)
+    assert str(summary['cidr_text']) == '10.0.0.0/30\n10.0.0.9/32'
+    assert str(summary['range_text']) == '10.0.0.0-10.0.0.3\n10.0.0.9'
+    assert summary['unique_count'] == 5
+    assert summary['density'] == 5 / 10
+
+
+def test_summarize_ip_ints_ipv6():
+    base = int(ipaddress.IPv6Address('2001:db8::'))
+    summary = we.summarize_ip_ints([base + offset for offset in range(4)], 6)
+    assert str(summary['cidr_text']) == '2001:db8::/126'
+    assert summary['density'] == 1.0
+
+
+def test_ipv4_groups_match_per_group_summary():
+    rng = random.Random(2)
+    group_ids = []
+    ip_ints = []
+    for group in range(30):
+        base = rng.randrange(0, 2 ** 32 - 4096)
+        for _ in range(rng.randint(1, 300)):
+            group_ids.append(group)
+            ip_ints.append(base + rng.randrange(0, 512))
+    # グループ境界をまたいでアドレスが連続していても、範囲はグループごとに分かれること
+    group_ids += [30, 31]
+    ip_ints += [2 ** 32 - 1, 1]
+
+    summaries = we.summarize_ipv4_groups(np.array(group_ids), np.array(ip_ints, dtype=np.uint32))
+    assert len(summaries) == 32
+    for group, (min_int, max_int, summary) in enumerate(summaries):
+        members = [ip for gid, ip in zip(group_ids, ip_ints) if gid == group]
+        expected = we.summarize_ip_ints(members, 4)
+        assert (min_int, max_int) == (min(members), max(members))
+        assert summary['unique_count'] == expected['unique_count']
+        assert summary['density'] == expected['density']
+        assert str(summary['cidr_text']) == str(expected['cidr_text'])
+        assert str(summary['range_text']) == str(expected['range_text'])
+
+
+def test_lazy_text_builds_once():
+    calls = []
+
+    def build():
+        calls.append(1)
+        return 'text'
+
+    lazy = we.LazyText(build)
+    assert calls == []
+    assert str(lazy) == 'text'
+    assert str(lazy) == 'text'
+    assert calls == [1]
+
+
+def test_range_to_cidrs_matches_ipaddress():
+    rng = random.Random(4)
+    cases = [(0, 2 ** 32 - 1), (0, 0), (2 ** 32 - 1, 2 ** 32 - 1), (1, 2 ** 32 - 2)]
+    cases += [tuple(sorted((rng.randrange(2 ** 32), rng.randrange(2 ** 32)))) for _ in range(200)]
+    cases += [(start, start + rng.randrange(1, 5000)) for start in (rng.randrange(2 ** 32 - 5000) for _ in range(200))]
+    for start, end in cases:
+        expected = [
+            (int(network.network_address), network.prefixlen)
+            for network in ipaddress.summarize_address_range(ipaddress.IPv4Address(start), ipaddress.IPv4Address(end))
+        ]
+        assert we.range_to_cidrs(start, end, 4) == expected
+
+
+def test_range_to_cidrs_ipv6():
+    start = int(ipaddress.IPv6Address('2001:db8::1'))
+    end = int(ipaddress.IPv6Address('2001:db8::ffff'))
+    expected = [
+        (int(network.network_address), network.prefixlen)
+        for network in ipaddress.summarize_address_range(ipaddress.IPv6Address(start), ipaddress.IPv6Address(end))
+    ]
+    assert we.range_to_cidrs(start, end, 6) == expected
+    assert we.range_to_cidrs(0, 2 ** 128 - 1, 6) == [(0, 0)]
@@ -0,0 +1,107 @@
+import ipaddress
+import random
+import socket
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import whois_engine as we
+
+
+def reference_ipv4(text):
+    try:
+        return int(ipaddress.IPv4Address(str(text))), True
+    except ValueError:
+        return 0, False
+
+
+def legacy_ipv4_strings_to_uint32(ip_series):
+    # 正規表現 + inet_aton による従来の実装 (比較用)
+    octet = r'(?:25[0-5]|2[0-4][0-9]|1[0-9][0-9]|[1-9]?[0-9])'
+    ip_series = pd.Series(ip_series, dtype=object).astype(str)
+    is_v4 = ip_series.str.fullmatch(rf'{octet}(?:\.{octet}){{3}}').fillna(False).to_numpy(dtype=bool)
+    ip_ints = np.zeros(len(ip_series), dtype=np.uint32)
+    if is_v4.any():
+        packed = b''.join(map(socket.inet_aton, ip_series[is_v4].tolist()))
+        ip_ints[is_v4] = np.frombuffer(packed, dtype='>u4')
+    return ip_ints, is_v4
+
+
+EDGE_CASES = [
+    '1.2.3.4', '0.0.0.0', '255.255.255.255', '100.200.250.199', '10.0.0.255',
+    '256.1.1.1', '999.1.1.1', '01.2.3.4', '1.2.3.04', '1.2.3.00', '0001.2.3.4', '1.2.3.4000',
+    '1.2.3', '1.2.3.4.5', '1..2.3', '.1.2.3', '1.2.3.', '1.2.3.4 ', ' 1.2.3.4', '1.2.3.4\x00',
+    '１.2.3.4', '::1', '2001:db8::1', 'example.com', '', 'nan', None, float('nan'), 12345,
+]
+
+
+@pytest.mark.parametrize('text', EDGE_CASES)
+def test_edge_cases_match_ipaddress(text):
+    ip_ints, is_v4 = we.ipv4_strings_to_uint32([text])
+    assert (int(ip_ints[0]), bool(is_v4[0])) == reference_ipv4(text)
+
+
+def test_random_inputs_match_ipaddress_and_legacy_parser():
+    rng = random.Random(0)
+    chars = '0123456789..1a :０x'
+    cases = [''.join(rng.choice(chars) for _ in range(rng.randint(5, 16))) for _ in range(20000)]
+    cases += ['.'.join(str(rng.randint(0, 300)) for _ in range(4)) for _ in range(20000)]
+
+    ip_ints, is_v4 = we.ipv4_strings_to_uint32(cases)
+    expected = [reference_ipv4(text) for text in cases]
+    assert [(int(value), bool(ok)) for value, ok in zip(ip_ints, is_v4)] == expected
+
+    legacy_ints, legacy_v4 = legacy_ipv4_strings_to_uint32(cases)
+    np.testing.assert_array_equal(ip_ints, legacy_ints)
+    np.testing.assert_array_equal(is_v4, legacy_v4)
+
+
+def make_result(ip, isp, country_code):
+    return {
+        'Target_IP': ip, 'ISP': isp, 'ISP_JP': isp, 'Country': country_code, 'Country_JP': country_code,
+        'CountryCode': country_code, 'RIR_Link': '', 'Secondary_Security_Links': '', 'Status': 'Success',
+    }
+
+
+def test_grouping_matches_per_group_reference():
+    rng = random.Random(1)
+    isps = [(f'ISP {i}', rng.choice(['JP', 'US', 'DE'])) for i in range(20)]
+    results = []
+    for _ in range(3000):
+        isp, country_code = rng.choice(isps)
+        if rng.random() < 0.05:
+            ip = f'2001:db8::{rng.randint(0, 0xffff):x}'
+        else:
+            ip = f'{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}'
+        results.append(make_result(ip, isp, country_code))
+    results.append(make_result('not-an-ip', 'ISP 0', 'JP'))
+
+    # 従来の dict ベースのまとめ方で期待値を作る
+    expected = {}
+    for res in results:
+        try:
+            address = ipaddress.ip_address(res['Target_IP'])
+        except ValueError:
+            continue
+        expected.setdefault((res['ISP'], res['CountryCode'], address.version), []).append(address)
+
+    grouped = [res for res in we.group_results_by_isp(results) if res['Status'].startswith(('Aggregated', 'Success'))]
+    assert len(grouped) == len(expected) + 1
+    by_key = {}
+    for res in grouped:
+        if res['Target_IP'] == 'not-an-ip':
+            continue
+        version = 6 if ':' in res['Target_IP'] else 4
+        by_key[(res['ISP'], res['CountryCode'], version)] = res
+
+    assert list(by_key) == list(expected)
+    for key, addresses in expected.items():
+        res = by_key[key]
+        if len(addresses) == 1:
+            assert res['Target_IP'] == str(addresses[0])
+        else:
+            assert res['Target_IP'] == f"{min(addresses)} - {max(addresses)} (x{len(addresses)} IPs)"
+        networks = [ipaddress.ip_network(cidr) for cidr in str(res['CIDR_Summary']).split('\n')]
+        covered = {address for network in networks for address in network}
+        assert covered == set(addresses)
@@ -0,0 +1,254 @@
+import threading
+import time
+
+import pytest
+
+import whois_engine as we
+
+
+def success(ip, provider):
+    result = we.new_ip_result(ip)
+    result['Status'] = f'Success ({provider})'
+    return result, None
+
+
+def failure(ip, status, defer_until=None):
+    result = we.new_ip_result(ip)
+    result['Status'] = status
+    if defer_until is not None:
+        result['Defer_Until'] = defer_until
+    return result, None
+
+
+class StubProviders:
+    # プロバイダごとの応答を outcomes[provider] の関数で返し、呼ばれた順序を記録する
+    def __init__(self, monkeypatch, **outcomes):
+        self.calls = []
+        self.outcomes = outcomes
+        monkeypatch.setattr(we, 'get_ip_details_ipinfo', self._stub('ipinfo'))
+        monkeypatch.setattr(we, 'get_ip_details_ip_api', self._stub('ip-api'))
+        monkeypatch.setattr(we, 'get_ip_details_rdap', self._stub('rdap'))
+
+    def _stub(self, provider):
+        def call(ip, *args, timing=None):
+            self.calls.append(provider)
+            if timing is not None:
+                timing.mark_sent()
+            res = self.outcomes[provider](ip)
+            if timing is not None:
+                timing.mark_received()
+            return res
+        return call
+
+
+@pytest.fixture(autouse=True)
+def fresh_provider_stats(monkeypatch):
+    stats = {provider: we.ProviderStats() for provider in ('ipinfo', 'ip-api', 'rdap')}
+    monkeypatch.setattr(we, 'provider_stats', stats)
+    return stats
+
+
+def make_router(api_key=None, hedge=False):
+    return we.ProviderRouter(cidr_cache=None, tor_nodes=set(), rate_limit_wait_seconds=60, api_key=api_key, hedge=hedge)
+
+
+def test_failover_tries_providers_in_order_until_one_succeeds(fake_clock, monkeypatch):
+    providers = StubProviders(
+        monkeypatch,
+        **{
+            'ipinfo': lambda ip: failure(ip, 'Error: Pro API (ConnectionError)'),
+            'ip-api': lambda ip: failure(ip, 'Error: Network/Timeout (ReadTimeout)'),
+            'rdap': lambda ip: success(ip, 'RDAP'),
+        },
+    )
+    result, _ = make_router(api_key='token').lookup('192.0.2.1')
+    assert result['Status'] == 'Success (RDAP)'
+    assert providers.calls == ['ipinfo', 'ip-api', 'rdap']
+
+    providers.calls.clear()
+    make_router().lookup('192.0.2.1', skip=('ip-api',))
+    assert providers.calls == ['rdap']
+
+
+def test_non_retryable_result_stops_failover(fake_clock, monkeypatch):
+    providers = StubProviders(
+        monkeypatch,
+        **{'ip-api': lambda ip: failure(ip, 'API Fail: private range'), 'rdap': lambda ip: success(ip, 'RDAP')},
+    )
+    result, _ = make_router().lookup('10.0.0.1')
+    assert result['Status'] == 'API Fail: private range'
+    assert providers.calls == ['ip-api']
+
+
+def test_rate_limited_provider_cools_down_until_defer_time(fake_clock, monkeypatch, fresh_provider_stats):
+    providers = StubProviders(
+        monkeypatch,
+        **{
+            'ip-api': lambda ip: failure(ip, 'Error: Rate Limit (429)', fake_clock.time() + 30),
+            'rdap': lambda ip: success(ip, 'RDAP'),
+        },
+    )
+    router = make_router()
+    assert router.lookup('192.0.2.1')[0]['Status'] == 'Success (RDAP)'
+    assert fresh_provider_stats['ip-api'].rate_limited == 1
+
+    providers.calls.clear()
+    router.lookup('192.0.2.2')
+    assert providers.calls == ['rdap']
+
+    fake_clock.advance(31)
+    providers.calls.clear()
+    router.lookup('192.0.2.3')
+    assert providers.calls == ['ip-api', 'rdap']
+
+
+def test_repeated_errors_put_a_provider_on_cooldown(fake_clock, monkeypatch):
+    providers = StubProviders(
+        monkeypatch,
+        **{
+            'ip-api': lambda ip: failure(ip, 'Error: Network/Timeout (ConnectTimeout)'),
+            'rdap': lambda ip: success(ip, 'RDAP'),
+        },
+    )
+    router = make_router()
+    for _ in range(we.PROVIDER_ERROR_COOLDOWN_THRESHOLD):
+        router.lookup('192.0.2.1')
+    assert providers.calls.count('ip-api') == we.PROVIDER_ERROR_COOLDOWN_THRESHOLD
+
+    providers.calls.clear()
+    router.lookup('192.0.2.1')
+    assert providers.calls == ['rdap']
+
+    fake_clock.advance(we.PROVIDER_ERROR_COOLDOWN_SECONDS + 1)
+    providers.calls.clear()
+    router.lookup('192.0.2.1')
+    assert providers.calls == ['ip-api', 'rdap']
+
+
+def test_all_providers_down_returns_defer_until_of_earliest_recovery(fake_clock, monkeypatch):
+    providers = StubProviders(
+        monkeypatch,
+        **{
+            'ip-api': lambda ip: failure(ip, 'Error: Rate Limit (429)', fake_clock.time() + 40),
+            'rdap': lambda ip: failure(ip, 'Error: Rate Limit (RDAP)', fake_clock.time() + 20),
+        },
+    )
+    router = make_router()
+    # 全ソースが失敗した照会は、最初の失敗結果をそのまま返す
+    result, _ = router.lookup('192.0.2.1')
+    assert result['Status'] == 'Error: Rate Limit (429)'
+
+    providers.calls.clear()
+    result, _ = router.lookup('192.0.2.2')
+    assert providers.calls == []
+    assert result['Status'] == 'Error: Rate Limit (All Providers)'
+    assert result['Defer_Until'] == pytest.approx(fake_clock.time() + 20)
+
+
+class FakeResponse:
+    status_code = 200
+    ok = True
+    headers = {}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'status': 'success', 'isp': 'Example ISP', 'country': 'Japan', 'countryCode': 'JP'}
+
+
+class NoCache:
+    def lookup(self, ip):
+        return None
+
+
+def test_latency_excludes_local_throttling(fake_clock, monkeypatch, fresh_provider_stats):
+    class SlowLimiter:
+        # トークンバケットの待ち (1.3秒) を時計だけ進めて再現する
+        def acquire(self):
+            fake_clock.advance(1.3)
+
+        def update_from_headers(self, headers):
+            pass
+
+    def get(url, timeout):
+        fake_clock.advance(0.2)
+        return FakeResponse()
+
+    monkeypatch.setitem(we.rate_limiters, 'ip-api', SlowLimiter())
+    monkeypatch.setitem(
+        we.concurrency_controllers, 'ip-api', we.AdaptiveConcurrencyController('ip-api', 1, 1, 0.0, 0.0, 1.0, 0.1)
+    )
+    monkeypatch.setattr(we.session, 'get', get)
+
+    router = we.ProviderRouter(NoCache(), set(), 60)
+    result, _ = router.lookup('192.0.2.1')
+    assert result['Status'] == 'Success (IPv4 API)'
+    assert fresh_provider_stats['ip-api'].latency_ewma == pytest.approx(0.2)
+
+
+def hedge_quickly(monkeypatch):
+    monkeypatch.setattr(we, 'PROVIDER_HEDGE_DEFAULT_DELAY', 0.05)
+    monkeypatch.setattr(we, 'PROVIDER_HEDGE_MIN_DELAY', 0.05)
+
+
+def test_hedge_timer_starts_only_after_the_primary_request_is_sent(monkeypatch, fresh_provider_stats):
+    hedge_quickly(monkeypatch)
+    calls = []
+
+    def primary(ip, *args, timing=None):
+        calls.append('ip-api')
+        # 並列数・レート制限による手元での待ち (ヘッジ遅延より長い)
+        time.sleep(0.3)
+        timing.mark_sent()
+        timing.mark_received()
+        return success(ip, 'IPv4 API')
+
+    def secondary(ip, *args, timing=None):
+        calls.append('rdap')
+        return success(ip, 'RDAP')
+
+    monkeypatch.setattr(we, 'get_ip_details_ip_api', primary)
+    monkeypatch.setattr(we, 'get_ip_details_rdap', secondary)
+    router = make_router(hedge=True)
+    try:
+        result, _ = router.lookup('192.0.2.1')
+    finally:
+        router.close()
+    assert result['Status'] == 'Success (IPv4 API)'
+    assert calls == ['ip-api']
+    assert fresh_provider_stats['ip-api'].hedges == 0
+
+
+def test_hedge_fires_when_a_sent_request_is_slow(monkeypatch, fresh_provider_stats):
+    hedge_quickly(monkeypatch)
+    release = threading.Event()
+
+    def primary(ip, *args, timing=None):
+        timing.mark_sent()
+        release.wait(5)
+        timing.mark_received()
+        return success(ip, 'IPv4 API')
+
+    monkeypatch.setattr(we, 'get_ip_details_ip_api', primary)
+    monkeypatch.setattr(we, 'get_ip_details_rdap', lambda ip, *args, timing=None: success(ip, 'RDAP'))
+    router = make_router(hedge=True)
+    try:
+        result, _ = router.lookup('192.0.2.1')
+    finally:
+        release.set()
+        router.close()
+    assert result['Status'] == 'Success (RDAP)'
+    assert fresh_provider_stats['ip-api'].hedges == 1
+
+
+def test_hedge_does_not_wait_for_a_primary_that_never_sends(monkeypatch):
+    hedge_quickly(monkeypatch)
+    # キャッシュヒット等で送信せずに返った場合も、ヘッジ待ちで止まらない
+    monkeypatch.setattr(we, 'get_ip_details_ip_api', lambda ip, *args, timing=None: failure(ip, 'Success (Cache)'))
+    router = make_router(hedge=True)
+    try:
+        result, _ = router.lookup('192.0.2.1')
+    finally:
+        router.close()
+    assert result['Status'] == 'Success (Cache)'
@@ -0,0 +1,40 @@
+import pytest
+
+import whois_engine as we
+
+HOSTING = "Hosting/DataCenter (PTR)"
+STANDARD = "Standard Connection"
+
+
+@pytest.mark.parametrize('hostname', [
+    'ec2-203-0-113-5.ap-northeast-1.compute.amazonaws.com',
+    'vps123.example.jp',
+    'server42.example.net',
+    'rack1.colo.example.net',
+    'static.5.113.0.203.clients.your-server.de',
+    'www1234.sakura.ne.jp',
+    'CLOUD.EXAMPLE.COM',
+])
+def test_hosting_hostnames(hostname):
+    assert we.classify_ptr_hostname(hostname) == HOSTING
+
+
+@pytest.mark.parametrize('hostname', [
+    'host-203-0-113-5.colorado.edu',
+    'observer.example.com',
+    'computer-lab.example.ac.jp',
+    'softbank126000000000.bbtec.net',
+    '',
+    None,
+])
+def test_residential_hostnames_are_not_matched_by_substrings(hostname):
+    assert we.classify_ptr_hostname(hostname) == STANDARD
+
+
+def test_apply_ptr_result_only_reclassifies_standard_rows():
+    res = we.apply_ptr_result({'Target_IP': '203.0.113.5', 'Proxy_Type': ''}, ['vps1.example.net'], None, classify=True)
+    assert res['PTR'] == 'vps1.example.net'
+    assert res['Proxy_Type'] == HOSTING
+
+    res = we.apply_ptr_result({'Target_IP': '203.0.113.6', 'Proxy_Type': 'Tor Node'}, ['vps1.example.net'], None, classify=True)
+    assert res['Proxy_Type'] == 'Tor Node'
@@ -0,0 +1,48 @@
+import pytest
+
+import whois_engine as we
+
+
+def test_acquire_paces_requests_at_the_base_rate(fake_clock):
+    limiter = we.TokenBucketRateLimiter(60) # 1 req/s
+    limiter.acquire()
+    assert fake_clock.slept == 0
+    limiter.acquire()
+    limiter.acquire()
+    assert fake_clock.slept == pytest.approx(2.0)
+
+
+def test_tokens_do_not_accumulate_beyond_capacity(fake_clock):
+    limiter = we.TokenBucketRateLimiter(60, capacity=2)
+    fake_clock.advance(100)
+    limiter.acquire()
+    limiter.acquire()
+    assert fake_clock.slept == 0
+    limiter.acquire()
+    assert fake_clock.slept == pytest.approx(1.0)
+
+
+def test_headers_spread_the_remaining_quota_until_reset(fake_clock):
+    limiter = we.TokenBucketRateLimiter(45)
+    limiter.update_from_headers({'X-Rl': '11', 'X-Ttl': '20'})
+    # 安全マージン1枠を除いた10回を20秒で使い切るペース
+    assert limiter.rate == pytest.approx(10 / 20)
+    assert limiter.remaining == 11
+
+    limiter.update_from_headers({'X-Rl': 'abc', 'X-Ttl': '20'})
+    assert limiter.rate == pytest.approx(10 / 20)
+
+
+def test_exhausted_quota_blocks_until_reset(fake_clock):
+    limiter = we.TokenBucketRateLimiter(45)
+    limiter.update_from_headers({'X-Rl': '1', 'X-Ttl': '30'})
+    assert limiter.rate == limiter.base_rate
+    limiter.acquire()
+    assert fake_clock.slept >= 31
+
+
+def test_block_for_stops_all_callers(fake_clock):
+    limiter = we.TokenBucketRateLimiter(6000)
+    limiter.block_for(60)
+    limiter.acquire()
+    assert fake_clock.slept == pytest.approx(60, abs=0.1)
@@ -0,0 +1,146 @@
+import ipaddress
+
+import pytest
+import requests
+
+import whois_engine as we
+
+URLS = {4: 'https://iana.test/ipv4.json', 6: 'https://iana.test/ipv6.json'}
+
+IPV4_DOCUMENT = {
+    'publication': '2024-01-01T00:00:00Z',
+    'services': [
+        [['10.0.0.0/8'], ['https://wide.test/rdap/']],
+        [['10.1.0.0/16', '10.2.0.0/16'], ['http://narrow.test/rdap/', 'https://narrow.test/rdap']],
+    ],
+}
+IPV6_DOCUMENT = {'publication': '2024-01-01T00:00:00Z', 'services': [[['2001:db8::/32'], ['https://v6.test/']]]}
+
+
+class FakeResponse:
+    def __init__(self, payload, status_code=200):
+        self.payload = payload
+        self.status_code = status_code
+        self.ok = status_code < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.exceptions.HTTPError(str(self.status_code))
+
+    def json(self):
+        return self.payload
+
+
+def serve(monkeypatch, documents):
+    # URL -> ドキュメント (例外インスタンスなら送出する)
+    def get(url, timeout=None, **kwargs):
+        document = documents[url]
+        if isinstance(document, Exception):
+            raise document
+        return FakeResponse(document)
+    monkeypatch.setattr(we.session, 'get', get)
+
+
+def refreshed_registry(tmp_path, monkeypatch):
+    serve(monkeypatch, {URLS[4]: IPV4_DOCUMENT, URLS[6]: IPV6_DOCUMENT})
+    registry = we.RdapBootstrapRegistry(str(tmp_path), URLS)
+    registry.refresh()
+    return registry
+
+
+def test_bootstrap_matches_the_longest_service_prefix(tmp_path, monkeypatch):
+    registry = refreshed_registry(tmp_path, monkeypatch)
+    assert registry.last_error is None
+    assert registry.base_url_for(ipaddress.ip_address('10.9.0.1')) == 'https://wide.test/rdap/'
+    # https を優先し、末尾の / を補う
+    assert registry.base_url_for(ipaddress.ip_address('10.2.3.4')) == 'https://narrow.test/rdap/'
+    assert registry.base_url_for(ipaddress.ip_address('2001:db8::1')) == 'https://v6.test/'
+    assert registry.base_url_for(ipaddress.ip_address('192.0.2.1')) is None
+    assert not registry.is_stale()
+
+
+def test_rdap_url_falls_back_to_apnic_outside_the_registry(tmp_path, monkeypatch):
+    registry = refreshed_registry(tmp_path, monkeypatch)
+    monkeypatch.setattr(we, 'get_rdap_bootstrap_registry', lambda: registry)
+    assert we.get_rdap_url('10.1.0.5') == 'https://narrow.test/rdap/ip/10.1.0.5'
+    assert we.get_rdap_url('192.0.2.1') == we.RDAP_BOOTSTRAP_URL.format(ip='192.0.2.1')
+
+
+def test_saved_registry_is_used_when_a_refresh_fails(fake_clock, tmp_path, monkeypatch):
+    refreshed_registry(tmp_path, monkeypatch)
+
+    # 再起動後はディスク上の表を読み込み、更新に失敗しても前回の表を使い続ける
+    registry = we.RdapBootstrapRegistry(str(tmp_path), URLS)
+    assert registry.base_url_for(ipaddress.ip_address('10.1.0.1')) == 'https://narrow.test/rdap/'
+    fake_clock.advance(we.RDAP_BOOTSTRAP_REFRESH_SECONDS + 1)
+    assert registry.is_stale()
+
+    serve(monkeypatch, {URLS[4]: IPV4_DOCUMENT, URLS[6]: requests.exceptions.ConnectionError('down')})
+    registry.refresh()
+    assert registry.last_error.startswith('ConnectionError')
+    assert registry.base_url_for(ipaddress.ip_address('10.1.0.1')) == 'https://narrow.test/rdap/'
+    assert '更新失敗' in registry.status_text()
+    # 失敗後は再試行間隔が過ぎるまで更新しない
+    assert not registry.is_stale()
+    fake_clock.advance(we.RDAP_BOOTSTRAP_RETRY_SECONDS)
+    assert registry.is_stale()
+
+
+def test_empty_registry_is_not_saved(tmp_path, monkeypatch):
+    serve(monkeypatch, {URLS[4]: {'services': []}, URLS[6]: {'services': []}})
+    registry = we.RdapBootstrapRegistry(str(tmp_path), URLS)
+    registry.refresh()
+    assert registry.last_error.startswith('ValueError')
+    assert list(tmp_path.iterdir()) == []
+    assert '未取得' in registry.status_text()
+
+
+def rdap_range(start, end, name):
+    return {'startAddress': start, 'endAddress': end, 'name': name, 'country': 'JP', 'port43': 'whois.test'}
+
+
+def test_range_cache_answers_ips_inside_stored_ranges(fake_clock):
+    cache = we.RdapRangeCache(ttl_seconds=100)
+    cache.store(rdap_range('198.51.100.0', '198.51.100.255', 'WIDE'))
+    cache.store(rdap_range('198.51.100.16', '198.51.100.23', 'NARROW'))
+
+    assert cache.lookup('198.51.100.200')['name'] == 'WIDE'
+    assert cache.lookup('198.51.100.20')['name'] == 'NARROW'
+    assert cache.lookup('198.51.101.1') is None
+    # 解析に使わないフィールドは保持しない
+    assert 'port43' not in cache.lookup('198.51.100.1')
+    assert (cache.hits, cache.misses) == (3, 1)
+    assert cache.stats_text() == '2 ranges (Hit: 3 / Miss: 1 / 75%)'
+
+    fake_clock.advance(101)
+    assert cache.lookup('198.51.100.200') is None
+
+
+def test_range_cache_ignores_malformed_ranges():
+    cache = we.RdapRangeCache()
+    cache.store({'name': 'NO-RANGE'})
+    cache.store(rdap_range('198.51.100.10', '198.51.100.1', 'REVERSED'))
+    cache.store(rdap_range('198.51.100.0', '2001:db8::', 'MIXED'))
+    assert len(cache) == 0
+
+
+def test_query_rdap_skips_the_request_for_cached_ranges(monkeypatch):
+    calls = []
+
+    def get(url, timeout=None, **kwargs):
+        calls.append(url)
+        return FakeResponse(rdap_range('203.0.113.0', '203.0.113.255', 'EXAMPLE-NET'))
+
+    monkeypatch.setattr(we, 'rdap_range_cache', we.RdapRangeCache())
+    monkeypatch.setattr(we, 'get_rdap_url', lambda ip: f'https://rdap.test/ip/{ip}')
+    monkeypatch.setitem(we.concurrency_controllers, 'rdap', we.AdaptiveConcurrencyController('rdap', 1, 1, 0.0, 0.0, 1.0, 0.1))
+    monkeypatch.setattr(we.session, 'get', get)
+
+    summary, response = we.query_rdap('203.0.113.5')
+    assert summary == {'name': 'EXAMPLE-NET', 'network': '203.0.113.0/24', 'country': 'JP'}
+    assert response is not None
+
+    summary, response = we.query_rdap('203.0.113.77')
+    assert summary['network'] == '203.0.113.0/24'
+    assert response is None
+    assert calls == ['https://rdap.test/ip/203.0.113.5']
@@ -0,0 +1,66 @@
+import os
+
+import whois_engine as we
+
+
+def make_offline_db(tmp_path):
+    path = tmp_path / "ip2asn.tsv"
+    path.write_text("192.0.2.0\t192.0.2.255\t64500\tJP\tEXAMPLE-NET\n", encoding="utf-8")
+    return we.OfflineIpDatabase(str(path))
+
+
+def run_job(checkpoint, tmp_path, **kwargs):
+    job = we.BackgroundSearchJob(
+        checkpoint, we.PersistentCidrCache(str(tmp_path / "cidr.db")), set(),
+        next(iter(we.MODE_SETTINGS.values())), offline_db=make_offline_db(tmp_path), offline_only=True, **kwargs,
+    )
+    job._run()
+    return job
+
+
+def test_read_results_skips_torn_last_line(tmp_path):
+    checkpoint = we.SearchJobCheckpoint.create(["192.0.2.1", "192.0.2.2"], jobs_dir=str(tmp_path))
+    checkpoint.append_results([{'Target_IP': '192.0.2.1', 'Status': 'Success'}])
+    with open(checkpoint.results_path, "a", encoding="utf-8") as f:
+        f.write('{"Target_IP": "192.0.2.2", "Sta')
+
+    loaded = we.SearchJobCheckpoint.load(checkpoint.job_id, jobs_dir=str(tmp_path))
+    assert [res['Target_IP'] for res in loaded.read_results()] == ['192.0.2.1']
+
+    job = run_job(loaded, tmp_path)
+    assert job.state == 'completed'
+    reloaded = we.SearchJobCheckpoint.load(checkpoint.job_id, jobs_dir=str(tmp_path))
+    assert {res['Target_IP'] for res in reloaded.read_results()} == {'192.0.2.1', '192.0.2.2'}
+    assert reloaded.status == 'completed'
+
+
+def test_resume_requeues_unfinished_ips_of_resolved_domain(tmp_path):
+    # ドメインは解決済み (行は保存済み) だが、解決したIPのうち 192.0.2.2 の照会前に中断されたジョブ
+    checkpoint = we.SearchJobCheckpoint.create(["example.test"], jobs_dir=str(tmp_path))
+    domain_row = we.build_domain_result("example.test", ["192.0.2.1", "192.0.2.2"], None)
+    checkpoint.append_results([domain_row, {'Target_IP': '192.0.2.1', 'Status': 'Success', 'Resolved_From': 'example.test'}])
+    checkpoint.update(finished_count=2, status='running')
+
+    loaded = we.SearchJobCheckpoint.load(checkpoint.job_id, jobs_dir=str(tmp_path))
+    job = run_job(loaded, tmp_path, resolve_domains=True)
+
+    assert job.state == 'completed'
+    resumed = {res['Target_IP']: res for res in job.results}
+    assert resumed['192.0.2.2']['Status'].startswith('Success')
+    assert resumed['192.0.2.2']['Resolved_From'] == 'example.test'
+    assert job.progress()['processed'] == job.progress()['total'] == 2
+
+    reloaded = we.SearchJobCheckpoint.load(checkpoint.job_id, jobs_dir=str(tmp_path))
+    assert {res['Target_IP'] for res in reloaded.read_results()} == {'example.test', '192.0.2.1', '192.0.2.2'}
+
+
+def test_resume_does_not_requery_finished_resolved_ips(tmp_path):
+    checkpoint = we.SearchJobCheckpoint.create(["example.test"], jobs_dir=str(tmp_path))
+    domain_row = we.build_domain_result("example.test", ["192.0.2.1"], None)
+    checkpoint.append_results([domain_row, {'Target_IP': '192.0.2.1', 'Status': 'Success'}])
+    size_before = os.path.getsize(checkpoint.results_path)
+
+    job = run_job(we.SearchJobCheckpoint.load(checkpoint.job_id, jobs_dir=str(tmp_path)), tmp_path, resolve_domains=True)
+    assert job.state == 'completed'
+    assert len(job.results) == 2
+    assert os.path.getsize(checkpoint.results_path) == size_before
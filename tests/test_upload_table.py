@@ -0,0 +1,146 @@
+import numpy as np
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import whois_engine as we
+
+ROWS = [
+    ('a', '192.0.2.1', 10),
+    ('b', ' 192.0.2.2 ', 20),
+    ('c', '192.0.2.1', 30),
+    ('d', None, 40),
+    ('e', '198.51.100.9', 50),
+]
+
+
+def upload_frame():
+    return pd.DataFrame(ROWS, columns=['Name', 'IP', 'Count'])
+
+
+def result(ip, isp, **fields):
+    return {'Target_IP': ip, 'ISP': isp, 'ISP_JP': f'{isp} (JP)', 'Country': 'Japan', 'Country_JP': '日本',
+            'Proxy_Type': '', 'Status': 'Success', **fields}
+
+
+RESULTS = [
+    result('192.0.2.1', 'First ISP', Proxy_Type='Hosting'),
+    result('192.0.2.2', 'Second ISP'),
+    # Proxy_Type を持たない結果は既定値 '' になる
+    {'Target_IP': '203.0.113.7', 'ISP': 'Unused ISP', 'Status': 'Error: Network/Timeout (ReadTimeout)'},
+    # 同じ Target_IP は後の結果で上書きされる
+    result('192.0.2.1', 'Updated ISP', Proxy_Type='VPN'),
+]
+
+
+def merged_by_pd_merge(df, ip_col, results):
+    # 旧実装と同じ結果になる pd.merge による参照実装
+    columns = [c for c in we.RESULT_COLUMNS
+               if c not in we.RESULT_OPTIONAL_COLUMNS or any(we.RESULT_COLUMN_SOURCES[c][0] in r for r in results)]
+    res_dict = {r['Target_IP']: r for r in results}
+    right = pd.DataFrame(
+        {col: [r.get(we.RESULT_COLUMN_SOURCES[col][0], we.RESULT_COLUMN_SOURCES[col][1]) for r in res_dict.values()]
+         for col in columns},
+    )
+    right['_key'] = list(res_dict)
+    left = df.assign(_key=df[ip_col].astype(str).str.strip())
+    merged = left.merge(right, on='_key', how='left').drop(columns='_key')
+    for col in columns:
+        merged[col] = merged[col].fillna(we.RESULT_COLUMN_SOURCES[col][1])
+    insert_idx = df.columns.get_loc(ip_col) + 1
+    order = list(df.columns[:insert_idx]) + columns + list(df.columns[insert_idx:])
+    merged.index = df.index
+    return merged[order]
+
+
+def as_object(df):
+    return df.astype(object)
+
+
+def test_keyed_join_matches_pd_merge():
+    merged = we.merge_results_into_frame(upload_frame(), 'IP', we.build_results_table(RESULTS))
+    expected = merged_by_pd_merge(upload_frame(), 'IP', RESULTS)
+
+    assert list(merged.columns) == ['Name', 'IP', 'ISP', 'ISP_JP', 'Country', 'Country_JP', 'Proxy Type', 'Status', 'Count']
+    pd.testing.assert_frame_equal(as_object(merged), as_object(expected))
+    # 重複IPはどちらの行も同じ結果、未検索・欠損IPは既定値
+    assert merged['ISP'].tolist() == ['Updated ISP', 'Second ISP', 'Updated ISP', 'N/A', 'N/A']
+    assert merged['Proxy Type'].tolist() == ['VPN', '', 'VPN', '', '']
+    assert merged['Status'].tolist()[3:] == ['N/A', 'N/A']
+
+
+def test_keyed_join_adds_ptr_only_when_a_result_has_one():
+    results = RESULTS + [result('198.51.100.9', 'Third ISP', PTR='host.example.jp')]
+    merged = we.merge_results_into_frame(upload_frame(), 'IP', we.build_results_table(results))
+
+    assert list(merged.columns)[2:9] == we.RESULT_COLUMNS
+    pd.testing.assert_frame_equal(as_object(merged), as_object(merged_by_pd_merge(upload_frame(), 'IP', results)))
+    assert merged['PTR'].tolist() == ['', '', '', '', 'host.example.jp']
+
+
+def test_keyed_join_without_results_leaves_the_frame_unchanged():
+    assert we.build_results_table([]) is None
+    df = upload_frame()
+    assert we.merge_results_into_frame(df, 'IP', None) is df
+    assert list(df.columns) == ['Name', 'IP', 'Count']
+
+
+def test_detect_ip_column():
+    df = pd.DataFrame({'Memo': ['x', None, 'y'], 'Addr': [None, ' 2001:db8::1 ', 'z'], 'IP': ['192.0.2.1'] * 3})
+    assert we.detect_ip_column(df) == 'Addr'
+    assert we.detect_ip_column(df[['Memo']]) is None
+    # 判定は欠損を除いた先頭10件だけを見る
+    late = pd.DataFrame({'Host': ['example.jp'] * 10 + ['192.0.2.1']})
+    assert we.detect_ip_column(late) is None
+
+
+def write_csv(path):
+    upload_frame().to_csv(path, index=False)
+    return path
+
+
+def write_xlsx(path):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(['Name', 'IP', None])
+    for row in ROWS:
+        ws.append(row)
+    wb.save(path)
+    return path
+
+
+@pytest.mark.parametrize('name, write', [('upload.csv', write_csv), ('upload.xlsx', write_xlsx)])
+def test_streamed_table_scans_in_chunks(tmp_path, name, write):
+    path = write(tmp_path / name)
+    with open(path, 'rb') as f:
+        table = we.StreamedUploadTable(f, name, chunk_rows=2).scan()
+
+        assert table.ip_column == 'IP'
+        assert table.row_count == len(ROWS)
+        assert table.columns[:2] == ['Name', 'IP']
+        # 欠損IPの行は飛ばし、値と行番号 (ファイル全体での通し番号) を対応させる
+        assert [v.strip() for v in table.ip_values] == ['192.0.2.1', '192.0.2.2', '192.0.2.1', '198.51.100.9']
+        assert table.ip_row_offsets.tolist() == [0, 1, 2, 4]
+
+        chunks = list(table.iter_chunks())
+        assert [len(c) for c in chunks] == [2, 2, 1]
+        assert np.concatenate([c.index.to_numpy() for c in chunks]).tolist() == list(range(len(ROWS)))
+        assert pd.concat(chunks)['Name'].tolist() == [row[0] for row in ROWS]
+
+
+def test_xlsx_header_gaps_get_placeholder_names(tmp_path):
+    path = write_xlsx(tmp_path / 'upload.xlsx')
+    table = we.StreamedUploadTable(str(path), 'upload.xlsx', chunk_rows=2).scan()
+    assert table.columns == ['Name', 'IP', 'Unnamed: 2']
+
+
+def test_merged_csv_export_matches_the_whole_frame_join(tmp_path):
+    path = write_csv(tmp_path / 'upload.csv')
+    table = we.StreamedUploadTable(str(path), 'upload.csv', chunk_rows=2).scan()
+    out_path = table.write_merged_csv(we.build_results_table(RESULTS), str(tmp_path / 'out' / 'merged.csv'))
+
+    exported = pd.read_csv(out_path, encoding='utf-8-sig', keep_default_na=False, dtype=str)
+    expected_path = tmp_path / 'expected.csv'
+    merged_by_pd_merge(pd.read_csv(path), 'IP', RESULTS).to_csv(expected_path, index=False)
+    expected = pd.read_csv(expected_path, keep_default_na=False, dtype=str)
+    pd.testing.assert_frame_equal(exported, expected)
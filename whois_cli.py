@@ -0,0 +1,157 @@
+# ==========================================
+# 🖥️ 検索大臣 - ヘッドレスバッチCLI
+# ==========================================
+# ブラウザを開かずに大量のIP/ドメインを照会し、結果をCSV/JSONLへ逐次書き出す。
+# キャッシュ・名寄せ・匿名化判定はUIと同じ whois_engine を使う。
+#
+# 使い方:
+#   python whois_cli.py targets.txt -o results.csv
+#   cat access.log.ips | python whois_cli.py --format jsonl --mode batch > results.jsonl
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from whois_engine import (
+    MODE_SETTINGS, CIDR_CACHE_DB_PATH, RATE_LIMIT_WAIT_SECONDS, concurrency_controllers, concurrency_decision_log,
+    get_tor_exit_node_store, get_cidr_cache, iter_unique_targets, iter_lookup_results,
+    get_rdap_bootstrap_registry, OFFLINE_DB_PATH, get_offline_database, dns_resolver, ptr_resolver,
+)
+
+# CLIのモード名 -> MODE_SETTINGS のキー (UIのラジオボタンと同じ順)
+# 並列数・間隔は自動調整のため、旧モード stable / fast は auto と同じ扱い
+CLI_MODES = dict(zip(["auto", "batch"], MODE_SETTINGS.keys()))
+CLI_MODES.update(stable=CLI_MODES["auto"], fast=CLI_MODES["auto"])
+
+# CSV出力列 (UIの「CSV (画面表示順)」と同じ項目 + CountryCode・逆引き・DNS解決の紐付け)
+CSV_FIELDS = ['Target_IP', 'ISP', 'ISP_JP', 'Country', 'Country_JP', 'CountryCode', 'Proxy_Type', 'Status',
+              'PTR', 'Resolved_IPs', 'Resolved_From']
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="検索大臣 ヘッドレスバッチ照会 (IP/ドメイン)")
+    parser.add_argument("inputs", nargs="*", help="ターゲット一覧ファイル (1行1件)。省略または '-' で標準入力")
+    parser.add_argument("-o", "--output", default="-", help="出力先ファイル (既定: 標準出力)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], default=None, help="出力形式 (既定: 出力ファイルの拡張子から判定、標準出力はcsv)")
+    parser.add_argument("--mode", choices=list(CLI_MODES), default="batch", help="API処理モード (既定: batch)。並列数・間隔は自動調整 (stable/fast は auto と同じ)")
+    parser.add_argument("--rdap", action="store_true", help="RDAP公式台帳を併用する (低速)")
+    parser.add_argument("--no-failover", action="store_true", help="429・タイムアウト時に他のデータソース (ipinfo/RDAP) へ切り替えない")
+    parser.add_argument("--hedge", action="store_true", help="応答が遅い場合に次のデータソースへも同時に照会する")
+    parser.add_argument("--offline-db", nargs="?", const=OFFLINE_DB_PATH, default=None, metavar="PATH",
+                        help=f"オフラインASN/国DB (ip2asn形式TSV または .mmdb) で先に照会し、未収録分のみAPIへ回す (PATH省略時: {OFFLINE_DB_PATH})")
+    parser.add_argument("--offline-only", action="store_true", help="--offline-db に未収録のIPもAPIへ照会しない (ネットワーク通信なし)")
+    parser.add_argument("--resolve-domains", action="store_true", help="ドメインをDNS解決 (A/AAAA) し、解決したIPも照会する")
+    parser.add_argument("--ptr", action="store_true", help="各IPを逆引きし、PTR列を出力する")
+    parser.add_argument("--ptr-budget", type=float, default=None, metavar="SECONDS", help="逆引きを行う時間の上限 (既定: 無制限)。超過後はキャッシュ済みの分だけを反映する")
+    parser.add_argument("--ptr-classify", action="store_true", help="PTRホスト名でホスティング判定を補う")
+    parser.add_argument("--api-key", default=os.environ.get("IPINFO_TOKEN"), help="ipinfo.io APIキー (Proモード, 環境変数 IPINFO_TOKEN でも可)")
+    parser.add_argument("--simple", action="store_true", help="簡易モード (APIなし - セキュリティリンクのみ)")
+    parser.add_argument("--cache-db", default=CIDR_CACHE_DB_PATH, help=f"CIDRキャッシュのSQLiteファイル (既定: {CIDR_CACHE_DB_PATH})")
+    parser.add_argument("--no-tor", action="store_true", help="Tor出口ノード一覧を取得しない")
+    parser.add_argument("--rate-limit-wait", type=int, default=RATE_LIMIT_WAIT_SECONDS, help="429発生時の既定待機秒数")
+    parser.add_argument("-q", "--quiet", action="store_true", help="進捗を表示しない")
+    return parser.parse_args(argv)
+
+
+def iter_input_lines(inputs):
+    if not inputs:
+        inputs = ["-"]
+    for path in inputs:
+        if path == "-":
+            yield from sys.stdin
+        else:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                yield from f
+
+
+def open_output(path):
+    if path == "-":
+        return sys.stdout
+    return open(path, "w", encoding="utf-8-sig" if path.endswith(".csv") else "utf-8", newline="")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.offline_only and not args.offline_db:
+        args.offline_db = OFFLINE_DB_PATH
+    output_format = args.format or ("jsonl" if args.output.endswith((".jsonl", ".json")) else "csv")
+
+    tor_nodes = set()
+    if not args.no_tor and not args.simple:
+        tor_nodes = get_tor_exit_node_store()
+        if tor_nodes.is_stale() and not args.offline_only:
+            tor_nodes.refresh()
+        if tor_nodes.last_error:
+            print(f"[WARN] Tor出口ノード一覧の更新に失敗しました ({tor_nodes.last_error}) - 保存済みの {len(tor_nodes)} 件を使用します", file=sys.stderr)
+
+    # RDAPは併用時・フェイルオーバー時に使うため、管轄RIR表 (IANAブートストラップ) を先に揃えておく
+    if not args.simple and not args.offline_only and (args.rdap or not args.no_failover):
+        rdap_registry = get_rdap_bootstrap_registry()
+        if rdap_registry.is_stale():
+            rdap_registry.refresh()
+        if rdap_registry.last_error:
+            print(f"[WARN] RDAPブートストラップ表の更新に失敗しました ({rdap_registry.last_error}) - {rdap_registry.status_text()}", file=sys.stderr)
+
+    offline_db = None
+    if args.offline_db and not args.simple:
+        offline_db = get_offline_database(args.offline_db)
+        if offline_db is None:
+            print(f"[ERROR] オフラインDBが見つかりません: {args.offline_db}", file=sys.stderr)
+            return 2
+        if not args.quiet:
+            print(f"[INFO] オフラインDB: {offline_db.status_text()}", file=sys.stderr)
+
+    cidr_cache = get_cidr_cache(args.cache_db)
+    targets = (line for line in iter_unique_targets(iter_input_lines(args.inputs)) if line.strip())
+
+    out = open_output(args.output)
+    writer = None
+    if output_format == "csv":
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+
+    count = 0
+    start_time = time.time()
+    try:
+        for res in iter_lookup_results(
+            targets, cidr_cache, tor_nodes, MODE_SETTINGS[CLI_MODES[args.mode]],
+            use_rdap=args.rdap, api_key=args.api_key,
+            rate_limit_wait_seconds=args.rate_limit_wait, simple_mode=args.simple,
+            failover=not args.no_failover, hedge=args.hedge and not args.no_failover,
+            offline_db=offline_db, offline_only=args.offline_only,
+            resolver=dns_resolver if args.resolve_domains else None,
+            ptr_resolver=ptr_resolver if args.ptr else None,
+            ptr_time_budget=args.ptr_budget, ptr_classify=args.ptr_classify,
+        ):
+            if writer:
+                writer.writerow({k: res.get(k, '') for k in CSV_FIELDS})
+            else:
+                out.write(json.dumps(res, ensure_ascii=False) + "\n")
+            out.flush()
+
+            count += 1
+            if not args.quiet and count % 100 == 0:
+                elapsed = time.time() - start_time
+                print(f"[INFO] {count} 件完了 ({count / elapsed:.1f} 件/秒) | CIDR Cache: {cidr_cache.stats_text()}", file=sys.stderr)
+    except KeyboardInterrupt:
+        print(f"[WARN] 中断されました ({count} 件出力済み)", file=sys.stderr)
+        return 130
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if not args.quiet:
+        print(f"[INFO] 完了: {count} 件 / {time.time() - start_time:.1f} 秒 | CIDR Cache: {cidr_cache.stats_text()}", file=sys.stderr)
+        # 並列数・間隔を調整したプロバイダだけ最終状態を表示する
+        adjusted = [(p, c) for p, c in concurrency_controllers.items() if c.increases or c.decreases]
+        for provider, controller in adjusted:
+            print(f"[INFO] 並列制御 [{provider}]: {controller.status_text()}", file=sys.stderr)
+        if adjusted:
+            print(f"[INFO] 調整履歴: {concurrency_decision_log.path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
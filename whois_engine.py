@@ -0,0 +1,3344 @@
+# ==========================================
+# 🔎 検索大臣 - ルックアップエンジン
+# ==========================================
+# Streamlitに依存しないIP/ドメイン照会ロジック一式。
+# WhoisSearch7110.py (UI) と whois_cli.py (ヘッドレスバッチ) の両方から利用し、
+# キャッシュ・レート制御・名寄せ・匿名化判定を共通化する。
+import requests
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, TimeoutError as FutureTimeoutError
+import socket
+import struct
+import ipaddress
+from urllib.parse import quote
+import re
+import os
+import json
+import sqlite3
+import threading
+import heapq
+import bisect
+import csv
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+from itertools import compress
+from operator import itemgetter
+import numpy as np
+import pandas as pd
+from openpyxl import load_workbook
+
+# --- 設定 ---
+# 🆕 並列数・リクエスト間隔は固定値ではなく、プロバイダごとの適応制御 (AdaptiveConcurrencyController) が
+# 応答時間・429・エラーから自動で決める。モードで選ぶのは照会単位 (1件ずつ / バッチ) だけ
+MODE_SETTINGS = {
+    "自動調整 (1件ずつ照会・並列数と間隔を自動最適化)": {
+        "BATCH_SIZE": 1
+    },
+    # ip-api.com の /batch エンドポイント (最大100件/1リクエスト, 毎分15リクエスト制限)
+    "バッチモード (100件/1リクエスト・間隔を自動最適化)": {
+        "BATCH_SIZE": 100
+    }
+}
+# 旧モード名 (固定の並列数・待機秒数) -> 現在のモード名。保存済みジョブの再開用
+MODE_NAME_ALIASES = {
+    "安定性重視 (2.5秒待機/単一スレッド)": "自動調整 (1件ずつ照会・並列数と間隔を自動最適化)",
+    "速度優先 (1.4秒待機/2スレッド)": "自動調整 (1件ずつ照会・並列数と間隔を自動最適化)",
+    "バッチモード (100件/1リクエスト・4.5秒待機)": "バッチモード (100件/1リクエスト・間隔を自動最適化)",
+}
+IP_API_URL = "http://ip-api.com/json/{ip}?fields=status,country,countryCode,isp,org,query,message" # orgを追加
+IP_API_BATCH_URL = "http://ip-api.com/batch?fields=status,country,countryCode,isp,org,query,message" # バッチモード用 (POST)
+IP_API_BATCH_SIZE = 100 # ip-apiのバッチ上限
+IPINFO_API_URL = "https://ipinfo.io/{ip}?token={token}" # Proモード用
+RDAP_BOOTSTRAP_URL = "https://rdap.apnic.net/ip/{ip}" # RDAP用 (IANAブートストラップで管轄RIRが分からない場合のフォールバック)
+
+RATE_LIMIT_WAIT_SECONDS = 120 
+
+# 🆕 プロバイダごとのレート上限 (リクエスト/分) - 全スレッド共有のトークンバケットで制御
+PROVIDER_RATE_LIMITS = {
+    "ip-api": 45,        # /json エンドポイント
+    "ip-api-batch": 15,  # /batch エンドポイント
+}
+RATE_LIMIT_HEADER_SAFETY_MARGIN = 1
+
+# 🆕 プロバイダごとの適応型並列数・間隔制御 (AIMD)
+# 初期値から始め、応答が安定していれば間隔を少しずつ縮めてから並列数を1ずつ増やし (加算的増加)、
+# 429・エラー・レイテンシ急増では並列数を一定倍に絞る (乗算的減少)。上限は各プロバイダのクォータに合わせる
+ADAPTIVE_CONCURRENCY_SETTINGS = {
+    # provider: (初期並列数, 最大並列数, 初期間隔秒, 最小間隔秒, 最大間隔秒, 成功1回ごとに縮める間隔秒)
+    "ip-api": (1, 4, 1.4, 0.0, 10.0, 0.1),        # 毎分45リクエスト (上限はトークンバケットが守る)
+    "ip-api-batch": (1, 2, 4.5, 0.0, 30.0, 0.5),  # 毎分15リクエスト
+    "ipinfo": (4, 16, 0.0, 0.0, 5.0, 0.05),       # 月間クォータ制のため短時間の上限は緩い
+    "rdap": (2, 4, 0.5, 0.2, 10.0, 0.1),          # RIRごとの制限が非公開のため控えめに
+}
+AIMD_RATE_LIMIT_DECREASE_FACTOR = 0.5 # 429 時の並列数の倍率
+AIMD_ERROR_DECREASE_FACTOR = 0.75 # タイムアウト・通信エラー・レイテンシ急増時の並列数の倍率
+AIMD_DELAY_BACKOFF_FACTOR = 2.0 # 429 時 (並列数1でのエラー時も) に間隔を広げる倍率
+AIMD_LATENCY_SPIKE_FACTOR = 3.0 # 平均レイテンシが基準値の何倍を超えたら混雑とみなすか
+AIMD_LATENCY_BASELINE_ALPHA = 0.02 # 基準レイテンシ (ほぼ最小値) の上昇側の追従率
+
+# 🆕 プロバイダ切替 (フェイルオーバー / ヘッジ) の設定
+PROVIDER_ERROR_COOLDOWN_THRESHOLD = 3 # 連続エラーがこの回数に達したプロバイダは一時的に使わない
+PROVIDER_ERROR_COOLDOWN_SECONDS = 30
+PROVIDER_RATE_LIMIT_COOLDOWN_SECONDS = 60 # 429に待機時間の指示がない場合 (ipinfo等)
+PROVIDER_LATENCY_EWMA_ALPHA = 0.2
+PROVIDER_HEDGE_DEFAULT_DELAY = 3.0 # レイテンシ実績がない間のヘッジ開始秒数
+PROVIDER_HEDGE_MIN_DELAY = 1.0
+PROVIDER_HEDGE_LATENCY_FACTOR = 2.0 # 平均レイテンシの何倍待ってからヘッジするか
+PROVIDER_HEDGE_MAX_WORKERS = 8
+
+# 🆕 永続キャッシュ (全セッション・再起動後も共有)
+DATA_DIR = os.environ.get("WHOIS_DATA_DIR", ".whois_cache")
+CIDR_CACHE_DB_PATH = os.path.join(DATA_DIR, "cidr_cache.sqlite3")
+CIDR_CACHE_TTL_SECONDS = 86400
+EXPORT_DIR = os.path.join(DATA_DIR, "exports")
+JOBS_DIR = os.path.join(DATA_DIR, "jobs")
+
+# 🆕 RDAPブートストラップ (IANA) と応答キャッシュ
+IANA_RDAP_BOOTSTRAP_URLS = {4: "https://data.iana.org/rdap/ipv4.json", 6: "https://data.iana.org/rdap/ipv6.json"}
+RDAP_BOOTSTRAP_DIR = os.path.join(DATA_DIR, "rdap_bootstrap")
+RDAP_BOOTSTRAP_REFRESH_SECONDS = 7 * 86400 # IANAの割り当て表はほとんど変わらないため週1回で十分
+RDAP_BOOTSTRAP_RETRY_SECONDS = 600
+RDAP_RANGE_CACHE_TTL_SECONDS = CIDR_CACHE_TTL_SECONDS
+RDAP_RANGE_CACHE_MAX_ENTRIES = 50000
+
+# 🆕 オフラインASN/国データベース (ip2asn形式のTSV、または .mmdb)
+OFFLINE_DB_PATH = os.environ.get("WHOIS_OFFLINE_DB", os.path.join(DATA_DIR, "ip2asn-combined.tsv"))
+OFFLINE_DB_LOOKUP_CHUNK = 10000 # 1回の searchsorted でまとめて引く件数
+
+# 🆕 ドメインターゲットのDNS解決 (A/AAAA)
+DNS_RESOLVE_MAX_WORKERS = 16
+DNS_RESOLVE_TIMEOUT_SECONDS = 5.0 # 1件あたりの待ち時間の上限
+RESOLVER_BUSY_POLL_SECONDS = 0.05 # リゾルバのスレッドが空くのを待つ間隔
+DNS_CACHE_TTL_SECONDS = 300 # リゾルバがTTLを返さない場合 (getaddrinfo) の保持秒数
+DNS_NEGATIVE_CACHE_TTL_SECONDS = 60 # NXDOMAIN等の保持秒数
+DNS_CACHE_MAX_ENTRIES = 100000
+
+# 🆕 逆引き (PTR) による補足
+PTR_MAX_WORKERS = 16
+PTR_TIMEOUT_SECONDS = 3.0
+PTR_CACHE_TTL_SECONDS = 3600
+PTR_NEGATIVE_CACHE_TTL_SECONDS = 600 # PTR未設定のIPは多いため、否定応答も長めに保持する
+PTR_QUEUE_PER_WORKER = 4 # 逆引き待ちで保持する結果数 (スレッド数の何倍まで)
+
+# 🆕 並列数・間隔の調整履歴 (プロセスごとに1ファイル、古いものから削除)
+CONCURRENCY_LOG_DIR = os.path.join(DATA_DIR, "concurrency_logs")
+CONCURRENCY_LOG_KEEP_SESSIONS = 20
+CONCURRENCY_LOG_RECENT_ENTRIES = 50 # 画面表示用にメモリへ保持する件数
+  
+RIR_LINKS = {
+    'RIPE': 'https://apps.db.ripe.net/db-web-ui/#/query?searchtext={ip}',
+    'ARIN': 'https://search.arin.net/rdap/?query={ip}',
+    'APNIC': 'https://wq.apnic.net/static/search.html',
+    'JPNIC': 'https://www.nic.ad.jp/ja/whois/ja-gateway.html',
+    'AFRINIC': 'https://www.afrinic.net/whois',
+    'ICANN Whois': 'https://lookup.icann.org/',
+}
+
+SECONDARY_TOOL_BASE_LINKS = {
+    'VirusTotal': 'https://www.virustotal.com/',
+    'Whois.com': 'https://www.whois.com/',
+    'Who.is': 'https://who.is/',
+    'DomainSearch.jp': 'https://www.domainsearch.jp/',
+    'Aguse': 'https://www.aguse.jp/',
+    'IP2Proxy': 'https://www.ip2proxy.com/',
+    'DNS Checker': 'https://dnschecker.org/',
+    'DNSlytics': 'https://dnslytics.com/',
+    'IP Location': 'https://iplocation.io/',
+    'CP-WHOIS': 'https://doco.cph.jp/whoisweb.php',
+    }
+
+COUNTRY_CODE_TO_RIR = {
+    'JP': 'JPNIC', 'CN': 'APNIC', 'AU': 'APNIC', 'KR': 'APNIC', 'IN': 'APNIC',
+    'ID': 'APNIC', 'MY': 'APNIC', 'NZ': 'APNIC', 'SG': 'APNIC',
+    'TH': 'APNIC', 'VN': 'APNIC', 'PH': 'APNIC', 'PK': 'APNIC', 
+    'BD': 'APNIC', 'HK': 'APNIC', 'TW': 'APNIC', 'NP': 'APNIC', 'LK': 'APNIC',
+    'MO': 'APNIC', 
+    'US': 'ARIN', 'CA': 'ARIN',
+    'ZA': 'AFRINIC', 'EG': 'AFRINIC', 'NG': 'AFRINIC',
+    'KE': 'AFRINIC', 'DZ': 'AFRINIC', 'MA': 'AFRINIC', 'GH': 'AFRINIC', 
+    'CM': 'AFRINIC', 'TN': 'AFRINIC', 'ET': 'AFRINIC', 'TZ': 'AFRINIC',
+    'DE': 'RIPE', 'FR': 'RIPE', 'GB': 'RIPE', 'RU': 'RIPE',
+    'NL': 'RIPE', 'IT': 'RIPE', 'ES': 'RIPE', 'PL': 'RIPE', 
+    'TR': 'RIPE', 'UA': 'RIPE', 'SA': 'RIPE', 'IR': 'RIPE', 
+    'CH': 'RIPE', 'SE': 'RIPE', 'NO': 'RIPE', 'DK': 'RIPE', 
+    'BE': 'RIPE', 'AT': 'RIPE', 'GR': 'RIPE', 'PT': 'RIPE',
+    'IE': 'RIPE', 'FI': 'RIPE', 'CZ': 'RIPE', 'RO': 'RIPE',
+    'HU': 'RIPE', 'IL': 'RIPE', 'KZ': 'RIPE', 'BG': 'RIPE',
+    'HR': 'RIPE', 'RS': 'RIPE', 'AE': 'RIPE', 'QA': 'RIPE',
+}
+
+COUNTRY_CODE_TO_NUMERIC_ISO = {
+    'AF': 4, 'AL': 8, 'DZ': 12, 'AS': 16, 'AD': 20, 'AO': 24, 'AI': 660, 'AQ': 10, 'AG': 28, 'AR': 32,
+    'AM': 51, 'AW': 533, 'AU': 36, 'AT': 40, 'AZ': 31, 'BS': 44, 'BH': 48, 'BD': 50, 'BB': 52, 'BY': 112,
+    'BE': 56, 'BZ': 84, 'BJ': 204, 'BM': 60, 'BT': 64, 'BO': 68, 'BA': 70, 'BW': 72, 'BV': 74, 'BR': 76,
+    'VG': 92, 'IO': 86, 'BN': 96, 'BG': 100, 'BF': 854, 'BI': 108, 'KH': 116, 'CM': 120, 'CA': 124, 'CV': 132,
+    'KY': 136, 'CF': 140, 'TD': 148, 'CL': 152, 'CN': 156, 'CX': 162, 'CC': 166, 'CO': 170, 'KM': 174, 'CG': 178,
+    'CD': 180, 'CK': 184, 'CO': 170, 'CR': 188, 'HR': 191, 'CU': 192, 'CY': 196, 'CZ': 203, 'DK': 208, 'DJ': 262, 'DM': 212,
+    'DO': 214, 'EC': 218, 'EG': 818, 'SV': 222, 'GQ': 226, 'ER': 232, 'EE': 233, 'ET': 231, 'FK': 238, 'FO': 234,
+    'FJ': 242, 'FI': 246, 'FR': 250, 'GF': 254, 'PF': 258, 'TF': 260, 'GA': 266, 'GM': 270, 'GE': 268, 'DE': 276,
+    'GH': 288, 'GI': 292, 'GR': 300, 'GL': 304, 'GD': 308, 'GP': 312, 'GU': 316, 'GT': 320, 'GN': 324, 'GW': 624,
+    'GY': 328, 'HT': 332, 'HM': 334, 'VA': 336, 'HN': 340, 'HK': 344, 'HU': 348, 'IS': 352, 'IN': 356, 'ID': 360,
+    'IR': 364, 'IQ': 368, 'IE': 372, 'IL': 376, 'IT': 380, 'CI': 384, 'JM': 388, 'JP': 392, 'JO': 400, 'KZ': 398,
+    'KE': 404, 'KI': 296, 'KP': 408, 'KR': 410, 'KW': 414, 'KG': 417, 'LA': 418, 'LV': 428, 'LB': 422, 'LS': 426,
+    'LR': 430, 'LY': 434, 'LI': 438, 'LT': 440, 'LU': 442, 'MO': 446, 'MK': 807, 'MG': 450, 'MW': 454, 'MY': 458,
+    'MV': 462, 'ML': 466, 'MT': 470, 'MH': 584, 'MQ': 474, 'MR': 478, 'MU': 480, 'YT': 175, 'MX': 484, 'FM': 583,
+    'MD': 498, 'MC': 492, 'MN': 496, 'MS': 500, 'MA': 504, 'MZ': 508, 'MM': 104, 'NA': 516, 'NR': 520, 'NP': 524,
+    'NL': 528, 'AN': 530, 'NC': 540, 'NZ': 554, 'NI': 558, 'NE': 562, 'NG': 566, 'NU': 570, 'NF': 574, 'MP': 580,
+    'NO': 578, 'OM': 512, 'PK': 586, 'PW': 585, 'PS': 275, 'PA': 591, 'PG': 598, 'PY': 600, 'PE': 604, 'PH': 608,
+    'PN': 612, 'PL': 616, 'PT': 620, 'PR': 630, 'QA': 634, 'RE': 638, 'RO': 642, 'RU': 643, 'RW': 646, 'SH': 654,
+    'KN': 659, 'LC': 662, 'PM': 666, 'VC': 670, 'WS': 882, 'SM': 674, 'ST': 678, 'SA': 682, 'SN': 686, 'RS': 688,
+    'SC': 690, 'SL': 694, 'SG': 702, 'SK': 703, 'SI': 705, 'SB': 90, 'SO': 706, 'ZA': 710, 'GS': 239, 'ES': 724,
+    'LK': 144, 'SD': 736, 'SR': 740, 'SJ': 744, 'SZ': 748, 'SE': 752, 'CH': 756, 'SY': 760, 'TW': 158, 'TJ': 762,
+    'TZ': 834, 'TH': 764, 'TL': 626, 'TG': 768, 'TK': 772, 'TO': 776, 'TT': 780, 'TN': 788, 'TR': 792, 'TM': 795,
+    'TC': 796, 'TV': 798, 'UG': 800, 'UA': 804, 'AE': 784, 'GB': 826, 'US': 840, 'UM': 581, 'UY': 858, 'UZ': 860,
+    'VU': 548, 'VE': 862, 'VN': 704, 'VI': 850, 'WF': 876, 'EH': 732, 'YE': 887, 'ZM': 894, 'ZW': 716
+}
+
+# --- 国名の日本語マッピング (主要国) ---
+# 未登録の国コードはそのまま表示する
+COUNTRY_JP_NAME = {
+    'JP': '日本', 'CN': '中国', 'KR': '韓国', 'KP': '北朝鮮', 'TW': '台湾', 'HK': '香港', 'MO': 'マカオ',
+    'MN': 'モンゴル', 'IN': 'インド', 'PK': 'パキスタン', 'BD': 'バングラデシュ', 'LK': 'スリランカ',
+    'NP': 'ネパール', 'ID': 'インドネシア', 'MY': 'マレーシア', 'SG': 'シンガポール', 'TH': 'タイ',
+    'VN': 'ベトナム', 'PH': 'フィリピン', 'KH': 'カンボジア', 'LA': 'ラオス', 'MM': 'ミャンマー',
+    'AU': 'オーストラリア', 'NZ': 'ニュージーランド',
+    'US': 'アメリカ', 'CA': 'カナダ', 'MX': 'メキシコ', 'BR': 'ブラジル', 'AR': 'アルゼンチン',
+    'CL': 'チリ', 'CO': 'コロンビア', 'PE': 'ペルー', 'VE': 'ベネズエラ',
+    'GB': 'イギリス', 'IE': 'アイルランド', 'FR': 'フランス', 'DE': 'ドイツ', 'NL': 'オランダ',
+    'BE': 'ベルギー', 'LU': 'ルクセンブルク', 'CH': 'スイス', 'AT': 'オーストリア', 'IT': 'イタリア',
+    'ES': 'スペイン', 'PT': 'ポルトガル', 'GR': 'ギリシャ', 'SE': 'スウェーデン', 'NO': 'ノルウェー',
+    'DK': 'デンマーク', 'FI': 'フィンランド', 'IS': 'アイスランド', 'PL': 'ポーランド', 'CZ': 'チェコ',
+    'SK': 'スロバキア', 'HU': 'ハンガリー', 'RO': 'ルーマニア', 'BG': 'ブルガリア', 'HR': 'クロアチア',
+    'RS': 'セルビア', 'SI': 'スロベニア', 'EE': 'エストニア', 'LV': 'ラトビア', 'LT': 'リトアニア',
+    'UA': 'ウクライナ', 'BY': 'ベラルーシ', 'MD': 'モルドバ', 'RU': 'ロシア', 'KZ': 'カザフスタン',
+    'UZ': 'ウズベキスタン', 'GE': 'ジョージア', 'AM': 'アルメニア', 'AZ': 'アゼルバイジャン',
+    'TR': 'トルコ', 'CY': 'キプロス', 'IL': 'イスラエル', 'PS': 'パレスチナ', 'JO': 'ヨルダン',
+    'LB': 'レバノン', 'SY': 'シリア', 'IQ': 'イラク', 'IR': 'イラン', 'SA': 'サウジアラビア',
+    'AE': 'アラブ首長国連邦', 'QA': 'カタール', 'KW': 'クウェート', 'BH': 'バーレーン', 'OM': 'オマーン',
+    'YE': 'イエメン', 'EG': 'エジプト', 'DZ': 'アルジェリア', 'MA': 'モロッコ', 'TN': 'チュニジア',
+    'LY': 'リビア', 'NG': 'ナイジェリア', 'GH': 'ガーナ', 'KE': 'ケニア', 'ET': 'エチオピア',
+    'TZ': 'タンザニア', 'CM': 'カメルーン', 'ZA': '南アフリカ',
+    'SC': 'セーシェル', 'PA': 'パナマ', 'BZ': 'ベリーズ', 'VG': '英領ヴァージン諸島', 'KY': 'ケイマン諸島',
+}
+
+# --- ISP名称の日本語マッピング (企業名統一版) ---
+# ここは「完全一致」で見つかるもの
+ISP_JP_NAME = {
+    # --- NTT Group ---
+    'NTT Communications Corporation': 'NTTドコモビジネス', 
+    'NTT COMMUNICATIONS CORPORATION': 'NTTドコモビジネス',
+    'NTT DOCOMO BUSINESS,Inc.': 'NTTドコモビジネス',
+    'NTT DOCOMO, INC.': 'NTTドコモ',
+    'NTT PC Communications, Inc.': 'NTTPCコミュニケーションズ',
+    
+    # --- KDDI Group ---
+    'Kddi Corporation': 'KDDI',
+    'KDDI CORPORATION': 'KDDI',
+    'DION': 'KDDI',
+    'Dion': 'KDDI',
+    'dion': 'KDDI',
+    'Chubu Telecommunications Co., Inc.': '中部テレコミュニケーション',
+    'Chubu Telecommunications Company, Inc.': '中部テレコミュニケーション',
+    'Hokkaido Telecommunication Network Co., Inc.': 'HOTnet',
+    'Energia Communications, Inc.': 'エネコム',
+    'STNet, Inc.': 'STNet',
+    'QTNet, Inc.': 'QTNet',
+    'BIGLOBE Inc.': 'ビッグローブ',
+    
+    # --- SoftBank Group ---
+    'SoftBank Corp.': 'ソフトバンク',
+    'Yahoo Japan Corporation': 'LINEヤフー',
+    'LY Corporation': 'LINEヤフー',
+    'LINE Corporation': 'LINEヤフー',
+    
+    # --- Rakuten Group ---
+    'Rakuten Group, Inc.': '楽天グループ',
+    'Rakuten Mobile, Inc.': '楽天モバイル',
+    'Rakuten Communications Corp.': '楽天コミュニケーションズ',
+    
+    # --- Sony Group ---
+    'Sony Network Communications Inc.': 'ソニーネットワークコミュニケーションズ',
+    'So-net Entertainment Corporation': 'ソニーネットワークコミュニケーションズ', 
+    'So-net Corporation': 'ソニーネットワークコミュニケーションズ',
+    
+    # --- Major ISPs / VNEs ---
+    'Internet Initiative Japan Inc.': 'IIJ',
+    'NIFTY Corporation': 'ニフティ',
+    'FreeBit Co., Ltd.': 'フリービット',
+    'TOKAI Communications Corporation': 'TOKAIコミュニケーションズ',
+    'DREAM TRAIN INTERNET INC.': 'ドリーム・トレイン・インターネット (DTI)',
+    'ASAHI Net, Inc.': '朝日ネット',
+    'Asahi Net': '朝日ネット',
+    'Optage Inc.': 'オプテージ',
+    'Jupiter Telecommunications Co., Ltd.': 'J:COM', 
+    'JCOM Co., Ltd.': 'J:COM',
+    'JCN': 'J:COM', 
+    'SAKURA Internet Inc.': 'さくらインターネット',
+    'GMO Internet, Inc.': 'GMOインターネット',
+    'INTERNET MULTIFEED CO.': 'インターネットマルチフィード',
+    'IDC Frontier Inc.': 'IDCフロンティア',
+    
+    # --- Others ---
+    'ARTERIA Networks Corporation': 'アルテリア・ネットワークス',
+    'UCOM Corporation': 'アルテリア・ネットワークス',
+    'VECTANT Ltd.': 'アルテリア・ネットワークス',
+    'KIBI Cable Television Co., Ltd.': '吉備ケーブルテレビ',
+}
+
+# --- 🆕 強力な名寄せルール (ハードコーディング辞書) ---
+# 小文字・正規化されたISP名に対して、部分一致で検索し、強制変換する
+ISP_REMAP_RULES = [
+    # J:COM系 (古いJCN表記などを全てJ:COMへ統合)
+    ('jcn', 'J:COM'),
+    ('jupiter', 'J:COM'),
+    ('cablenet', 'J:COM'),
+    ('tsuchiura cable', 'J:COM'),
+    ('kawayu', 'J:COM'), 
+    
+    # KDDI系
+    ('dion', 'KDDI'),
+    ('au one', 'KDDI (au one net)'),
+    ('kddi', 'KDDI'),
+
+    # 電力系・その他
+    ('k-opti', 'オプテージ'),
+    ('ctc', '中部テレコミュニケーション'),
+    ('commufa', '中部テレコミュニケーション'),
+    ('vectant', 'アルテリア・ネットワークス'),
+    ('ucom', 'アルテリア・ネットワークス'),
+    ('arteria', 'アルテリア・ネットワークス'),
+    ('softbank', 'ソフトバンク'),
+    ('bbtec', 'ソフトバンク'),
+    ('ocn', 'OCN'),
+    ('ntt', 'NTTグループ'), 
+    ('infosphere', 'NTTPC (InfoSphere)'),
+    ('wakwak', 'NTT-ME (WAKWAK)'),
+    ('plala', 'NTTドコモ (ぷらら)'),
+    ('so-net', 'ソニーネットワークコミュニケーションズ'),
+    ('nuro', 'ソニーネットワークコミュニケーションズ (NURO)'),
+    ('biglobe', 'ビッグローブ'),
+    ('dti', 'DTI'),
+    ('iij', 'IIJ'),
+    ('transix', 'インターネットマルチフィード (transix)'),
+    ('mfeed', 'インターネットマルチフィード'),
+    ('v6plus', 'JPNE (v6プラス)'),
+    ('jpne', 'JPNE'),
+    ('en ne', '楽天モバイル'), 
+    ('rakuten', '楽天グループ'),
+]
+
+# 正規化関数: 小文字化し、カンマ(,)とピリオド(.)を除去する
+def normalize_isp_key(text):
+    if not text:
+        return ""
+    return text.lower().replace(',', '').replace('.', '').strip()
+
+# 検索用にキーを正規化した辞書を作成
+ISP_JP_NAME_NORMALIZED = {normalize_isp_key(k): v for k, v in ISP_JP_NAME.items()}
+
+# --- 🆕 保存・統計表示の共通処理 ---
+# 一時ファイルに書いてから置き換え、読み込み側が書きかけのファイルを見ないようにする
+def write_text_atomic(path, content):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+# キャッシュの件数とヒット率の表示 (例: "12 (Hit: 30 / Miss: 10 / 75%)")
+def format_cache_stats(size, hits, misses):
+    total = hits + misses
+    hit_rate = f"{hits / total * 100:.0f}%" if total else "-"
+    return f"{size} (Hit: {hits} / Miss: {misses} / {hit_rate})"
+
+# --- 匿名化・プロキシ判定用データ ---
+TOR_EXIT_LIST_URL = "https://check.torproject.org/exit-addresses"
+TOR_EXIT_LIST_PATH = os.path.join(DATA_DIR, "tor_exit_addresses.txt")
+TOR_EXIT_LIST_REFRESH_SECONDS = 3600 # 公式リストの更新間隔 (約1時間) に合わせる
+TOR_EXIT_LIST_RETRY_SECONDS = 300 # 取得失敗後の再試行間隔
+
+def parse_tor_exit_list(text):
+    exit_ips = set()
+    for line in text.splitlines():
+        if line.startswith("ExitAddress"):
+            parts = line.split()
+            if len(parts) >= 2:
+                exit_ips.add(parts[1])
+    return exit_ips
+
+# 🆕 Tor出口ノード一覧 (ディスク保存 + バックグラウンド更新)
+# 起動時はディスク上の前回取得分を即座に使い、古ければ別スレッドで条件付きリクエスト
+# (If-None-Match / If-Modified-Since) を送って更新する。取得に失敗しても最後に成功した一覧を使い続ける。
+# `ip in store` で判定できるため、detect_proxy_vpn_tor の tor_nodes としてそのまま渡せる
+class TorExitNodeStore:
+    def __init__(self, path=TOR_EXIT_LIST_PATH, url=TOR_EXIT_LIST_URL):
+        self.path = path
+        self.meta_path = path + ".meta.json"
+        self.url = url
+        self.nodes = frozenset()
+        self.meta = {}
+        self.last_error = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self.nodes = frozenset(parse_tor_exit_list(f.read()))
+            with open(self.meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def __contains__(self, ip):
+        return ip in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def is_stale(self, max_age=TOR_EXIT_LIST_REFRESH_SECONDS):
+        now = time.time()
+        return now >= self._retry_at and now - self.meta.get('checked_at', 0) >= max_age
+
+    # 同期更新 (CLI用)。更新できたかどうかに関わらず、現在の一覧を返す
+    def refresh(self, timeout=10):
+        headers = {}
+        if self.nodes and self.meta.get('etag'):
+            headers['If-None-Match'] = self.meta['etag']
+        if self.nodes and self.meta.get('last_modified'):
+            headers['If-Modified-Since'] = self.meta['last_modified']
+        try:
+            response = session.get(self.url, headers=headers, timeout=timeout)
+            meta = dict(self.meta, checked_at=time.time())
+            if response.status_code == 304:
+                write_text_atomic(self.meta_path, json.dumps(meta))
+                self.meta = meta
+                self.last_error = None
+                return self.nodes
+
+            response.raise_for_status()
+            exit_ips = parse_tor_exit_list(response.text)
+            if not exit_ips:
+                raise ValueError("Empty exit list")
+
+            meta.update(etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'), updated_at=time.time())
+            write_text_atomic(self.path, response.text)
+            write_text_atomic(self.meta_path, json.dumps(meta))
+            self.nodes = frozenset(exit_ips)
+            self.meta = meta
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._retry_at = time.time() + TOR_EXIT_LIST_RETRY_SECONDS
+        return self.nodes
+
+    # 古ければバックグラウンドで更新する (既に更新中なら何もしない)。呼び出し側は待たない
+    def refresh_in_background(self, max_age=TOR_EXIT_LIST_REFRESH_SECONDS):
+        with self._lock:
+            if not self.is_stale(max_age) or (self._refresh_thread and self._refresh_thread.is_alive()):
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, name="tor-exit-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def status_text(self):
+        if self._refresh_thread and self._refresh_thread.is_alive() and not self.nodes:
+            return "取得中..."
+        updated_at = self.meta.get('updated_at')
+        text = f"{len(self.nodes)} 件"
+        if updated_at:
+            text += f" (取得: {time.strftime('%Y-%m-%d %H:%M', time.localtime(updated_at))})"
+        if self.last_error:
+            text += " ⚠️ 更新失敗 - 前回の一覧を使用中" if self.nodes else " ⚠️ 取得失敗"
+        return text
+
+_tor_exit_node_stores = {}
+_tor_exit_node_stores_lock = threading.Lock()
+
+def get_tor_exit_node_store(path=TOR_EXIT_LIST_PATH):
+    with _tor_exit_node_stores_lock:
+        if path not in _tor_exit_node_stores:
+            _tor_exit_node_stores[path] = TorExitNodeStore(path)
+        return _tor_exit_node_stores[path]
+
+HOSTING_VPN_KEYWORDS = [
+    "hosting", "datacenter", "vps", "cloud", "server", "vpn", "proxy", "dedi",
+    "amazon technologies", "amazon.com", "google llc", "google cloud", "microsoft corporation", "azure",
+    "oracle cloud", "alibaba", "tencent", "huawei", "digitalocean", "linode", "vultr", "ovh", "hetzner",
+    "m247", "proweb", "choopa", "leaseweb", "datacamp", "ip-volume", "flyservers", 
+    "performive", "hostroyale", "packet exchange", "xtom", "tzulo", "psychz", 
+    "franantech", "buyvm", "melbicom", "pfcloud", "epyc", "layerhost",
+    "akamai", "cloudflare", "fastly", "cdn77", "imperva", "incapsula", "cloudfront",
+    "expressvpn", "nordvpn", "proton", "mullvad", "private internet access", "windscribe",
+    "cyberghost", "torguard", "vyprvpn", "purevpn"
+]
+
+PRIVATE_RELAY_KEYWORDS = ["icloud", "private relay"]
+PRIVACY_KEYWORDS = ["vpn", "proxy", "applied privacy", "privacy foundation", "calyx institute", "foundation for applied privacy"]
+CDN_KEYWORDS = ["cloudflare", "akamai", "fastly", "cloudfront"]
+
+# 🆕 キーワード表を1本の正規表現 (先読み + 選択肢) にコンパイルする
+# finditer は各位置で「選択肢の並び順で最初に一致したキーワード」を返すので、1回の走査で
+# ・並び順 = ルール順 → 全位置での最小ルール番号が「上から順に最初にヒットしたルール」と一致
+# ・並び順 = 長い順 → 各位置の最長キーワードが得られる (短いキーワードはその前方一致として包含)
+def compile_keyword_pattern(keywords):
+    return re.compile("(?=(" + "|".join(re.escape(kw) for kw in keywords) + "))")
+
+# キーワード -> 判定カテゴリ集合 (同じ位置で一致する短いキーワードのカテゴリも引き継ぐ)
+def build_keyword_categories(category_keywords):
+    categories = {}
+    for category, keywords in category_keywords.items():
+        for kw in keywords:
+            categories.setdefault(kw, set()).add(category)
+    return {
+        kw: frozenset().union(*(cats for other, cats in categories.items() if kw.startswith(other)))
+        for kw in categories
+    }
+
+ISP_KEYWORD_CATEGORIES = build_keyword_categories({
+    "relay": PRIVATE_RELAY_KEYWORDS,
+    "privacy": PRIVACY_KEYWORDS,
+    "hosting": HOSTING_VPN_KEYWORDS,
+    "cdn": CDN_KEYWORDS,
+})
+ISP_KEYWORD_PATTERN = compile_keyword_pattern(sorted(ISP_KEYWORD_CATEGORIES, key=len, reverse=True))
+
+# ISP名ごとに1度だけ判定する (10万件の結果でも異なるISP名は数百程度)
+@lru_cache(maxsize=65536)
+def classify_isp_name(isp_name):
+    found = set()
+    for m in ISP_KEYWORD_PATTERN.finditer(isp_name.lower()):
+        found |= ISP_KEYWORD_CATEGORIES[m.group(1)]
+    if "relay" in found: return "iCloud Private Relay"
+    if "privacy" in found: return "VPN/Proxy (Named)"
+    if "hosting" in found:
+        if "cdn" in found: return "CDN/Proxy"
+        return "Hosting/DataCenter"
+    # 修正: Residential/Business -> Standard Connection
+    return "Standard Connection"
+
+def detect_proxy_vpn_tor(ip, isp_name, tor_nodes):
+    if ip in tor_nodes: return "Tor Node"
+    return classify_isp_name(isp_name)
+
+ISP_REMAP_PATTERN = compile_keyword_pattern([keyword for keyword, _ in ISP_REMAP_RULES])
+# 同じキーワードが複数あれば上位のルールを優先
+ISP_REMAP_RULE_INDEX = {keyword: i for i, (keyword, _) in reversed(list(enumerate(ISP_REMAP_RULES)))}
+
+# 🆕 強化されたISP名寄せロジック (ISP名・国コードの組ごとにメモ化)
+@lru_cache(maxsize=65536)
+def get_jp_names(english_isp, country_code):
+    if not english_isp:
+        return "N/A", COUNTRY_JP_NAME.get(country_code, country_code)
+
+    normalized_input = normalize_isp_key(english_isp)
+    jp_isp = english_isp # デフォルトは英語のまま
+
+    # 1. 完全一致 (高速)
+    if english_isp in ISP_JP_NAME:
+        jp_isp = ISP_JP_NAME[english_isp]
+    elif normalized_input in ISP_JP_NAME_NORMALIZED:
+        jp_isp = ISP_JP_NAME_NORMALIZED[normalized_input]
+    else:
+        # 2. 部分一致 (名寄せルール適用)
+        # ルールリストの上から順に評価した場合と同じく、最も上位のルールを採用
+        rule_indices = [ISP_REMAP_RULE_INDEX[m.group(1)] for m in ISP_REMAP_PATTERN.finditer(normalized_input)]
+        if rule_indices:
+            jp_isp = ISP_REMAP_RULES[min(rule_indices)][1]
+        
+        # 3. どのルールにも合致しなければ、元の英語名を返す
+
+    jp_country = COUNTRY_JP_NAME.get(country_code, country_code)
+    return jp_isp, jp_country
+
+def create_session():
+    session = requests.Session()
+    session.headers.update({"User-Agent": "WhoisBatchTool/2.1 (+PythonStreamlitApp)"})
+    return session
+
+# モジュールはプロセス内で1度だけ読み込まれるため、全スレッド・全セッションで共有される
+session = create_session()
+
+# 🆕 プロバイダ単位のトークンバケット (全スレッド・全セッションで共有)
+# 基本レートで補充しつつ、ip-api.com が返す X-Rl (残りリクエスト数) / X-Ttl (リセットまでの秒数) を
+# 受け取るたびに「残り枠をリセットまでに均等に使い切る」ペースへ補正し、残り0ならリセットまで全体を停止する
+class TokenBucketRateLimiter:
+    def __init__(self, requests_per_minute, capacity=1):
+        self.base_rate = requests_per_minute / 60.0
+        self.rate = self.base_rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.remaining = None
+        self.reset_at = None
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # トークンを1つ取得できるまで待機する
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = max(self._blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(min(wait_time, 1.0))
+
+    # 429などで一定時間すべてのワーカーを止める
+    def block_for(self, seconds):
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self.tokens = 0.0
+
+    def update_from_headers(self, headers):
+        try:
+            remaining = int(headers.get('X-Rl'))
+            ttl = int(headers.get('X-Ttl'))
+        except (TypeError, ValueError):
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.remaining = remaining
+            self.reset_at = time.time() + ttl
+            # 処理中の他リクエスト分として1枠残しておく
+            usable = remaining - RATE_LIMIT_HEADER_SAFETY_MARGIN
+            if usable <= 0:
+                self._blocked_until = max(self._blocked_until, now + ttl + 1)
+                self.tokens = 0.0
+                self.rate = self.base_rate
+            else:
+                self.tokens = min(self.tokens, usable)
+                self.rate = usable / ttl if ttl > 0 else self.base_rate
+
+    def status_text(self):
+        if self.remaining is None:
+            return f"{self.rate * 60:.1f} req/min"
+        return f"{self.rate * 60:.1f} req/min (X-Rl: {self.remaining}, Reset: {max(0, int(self.reset_at - time.time()))}s)"
+
+rate_limiters = {provider: TokenBucketRateLimiter(limit) for provider, limit in PROVIDER_RATE_LIMITS.items()}
+
+# 🆕 並列数・間隔の調整履歴 (セッションログ)
+# 調整のたびに1行のJSONを書き出し、直近分はメモリにも保持する (デバッグ情報に表示)
+class ConcurrencyDecisionLog:
+    def __init__(self, log_dir=CONCURRENCY_LOG_DIR, keep_sessions=CONCURRENCY_LOG_KEEP_SESSIONS):
+        self.log_dir = log_dir
+        self.keep_sessions = keep_sessions
+        self.path = os.path.join(log_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl")
+        self.recent = deque(maxlen=CONCURRENCY_LOG_RECENT_ENTRIES)
+        self.last_error = None
+        self._opened = False
+        self._lock = threading.Lock()
+
+    # 初回の書き込み時にディレクトリを作り、古いセッションのログを削除する
+    def _open(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        sessions = sorted(name for name in os.listdir(self.log_dir) if name.endswith(".jsonl"))
+        for name in sessions[:max(0, len(sessions) - self.keep_sessions + 1)]:
+            os.remove(os.path.join(self.log_dir, name))
+        self._opened = True
+
+    def write(self, entry):
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self.recent.append(entry)
+            try:
+                if not self._opened:
+                    self._open()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+            except OSError as e:
+                # ログが書けなくても照会は止めない
+                self.last_error = str(e)
+
+    def recent_entries(self):
+        with self._lock:
+            return list(self.recent)
+
+concurrency_decision_log = ConcurrencyDecisionLog()
+
+# 🆕 プロバイダ単位の適応型並列数・間隔制御 (AIMD, 全スレッド・全ジョブで共有)
+# acquire() は「実行中のリクエスト数 < 並列数」かつ「前回の開始から間隔が空いた」時に枠を渡し、
+# release() で結果 (success / rate_limited / error) とレイテンシを受け取って並列数・間隔を調整する。
+# 並列数は小数で持ち、成功ごとに 1/並列数 ずつ増やす (= 並列数分の成功で +1)。
+# 同じ混雑で何度も絞らないよう、前回の減少より前に開始したリクエストの失敗では減らさない
+class AdaptiveConcurrencyController:
+    def __init__(self, provider, initial_workers, max_workers, initial_delay, min_delay, max_delay, delay_step,
+                 decision_log=None):
+        self.provider = provider
+        self.max_workers = max_workers
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.delay_step = delay_step
+        self.limit = float(initial_workers)
+        self.delay = initial_delay
+        self.active = 0
+        self.latency_ewma = None
+        self.latency_baseline = None
+        self.increases = 0
+        self.decreases = 0
+        self.decision_log = decision_log
+        self._next_start = 0.0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def workers(self):
+        return min(self.max_workers, max(1, int(self.limit)))
+
+    # 枠が空き、間隔が経過するまで待機する。戻り値 (開始時刻) は release() に渡す
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if self.active < self.workers and now >= self._next_start:
+                    self.active += 1
+                    self._next_start = now + self.delay
+                    return now
+                wait_time = self._next_start - now if self.active < self.workers else 1.0
+                self._cond.wait(min(max(wait_time, 0.01), 1.0))
+
+    def release(self, started, outcome, latency=None):
+        with self._cond:
+            self.active -= 1
+            if outcome == 'success':
+                if latency is not None:
+                    self._observe_latency(latency)
+                if self.latency_ewma is not None and self.latency_ewma > self.latency_baseline * AIMD_LATENCY_SPIKE_FACTOR:
+                    self._decrease(started, AIMD_ERROR_DECREASE_FACTOR, 'latency', latency)
+                else:
+                    self._increase(latency)
+            elif outcome == 'rate_limited':
+                self._decrease(started, AIMD_RATE_LIMIT_DECREASE_FACTOR, '429', latency, backoff=True)
+            else:
+                # 並列数が既に1なら間隔を広げて退避する
+                self._decrease(started, AIMD_ERROR_DECREASE_FACTOR, 'error', latency, backoff=self.limit <= 1.0)
+            self._cond.notify_all()
+
+    def _observe_latency(self, latency):
+        self.latency_ewma = latency if self.latency_ewma is None else (
+            PROVIDER_LATENCY_EWMA_ALPHA * latency + (1 - PROVIDER_LATENCY_EWMA_ALPHA) * self.latency_ewma
+        )
+        # 基準値は最小値へは即座に下がり、上がる方向にはゆっくり追従する
+        if self.latency_baseline is None or latency < self.latency_baseline:
+            self.latency_baseline = latency
+        else:
+            self.latency_baseline += AIMD_LATENCY_BASELINE_ALPHA * (latency - self.latency_baseline)
+
+    # 加算的増加: 先に間隔を縮め、最小間隔に達してから並列数を増やす
+    def _increase(self, latency):
+        workers = self.workers
+        if self.delay > self.min_delay:
+            self.delay = max(self.min_delay, round(self.delay - self.delay_step, 3))
+            if self.delay > self.min_delay:
+                return
+        elif self.limit < self.max_workers:
+            self.limit = min(float(self.max_workers), self.limit + 1.0 / workers)
+            if self.workers == workers:
+                return
+        else:
+            return
+        self.increases += 1
+        self._log('increase', 'healthy', latency)
+
+    # 乗算的減少: 並列数を factor 倍に絞り、backoff なら間隔も広げる
+    def _decrease(self, started, factor, reason, latency, backoff=False):
+        # 前回の減少後に開始したリクエストだけを数える。並列数1で間隔も広げない場合は何もしない
+        if started < self._last_decrease or (self.limit <= 1.0 and not backoff):
+            return
+        self._last_decrease = time.monotonic()
+        if backoff:
+            self.delay = min(self.max_delay, max(self.delay, self.delay_step) * AIMD_DELAY_BACKOFF_FACTOR)
+        self.limit = max(1.0, self.limit * factor)
+        self.decreases += 1
+        self._log('decrease', reason, latency)
+
+    def _log(self, decision, reason, latency):
+        if self.decision_log is None:
+            return
+        self.decision_log.write({
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'provider': self.provider, 'decision': decision,
+            'reason': reason, 'workers': self.workers, 'delay': round(self.delay, 3),
+            'latency_ms': round(latency * 1000) if latency is not None else None,
+            'baseline_ms': round(self.latency_baseline * 1000) if self.latency_baseline is not None else None,
+        })
+
+    def status_text(self):
+        latency = f"{self.latency_ewma * 1000:.0f}ms" if self.latency_ewma is not None else "-"
+        return (f"並列 {self.workers}/{self.max_workers} (実行中 {self.active}) | 間隔 {self.delay:.2f}s | "
+                f"avg {latency} | ↑{self.increases} ↓{self.decreases}")
+
+concurrency_controllers = {
+    provider: AdaptiveConcurrencyController(provider, *settings, decision_log=concurrency_decision_log)
+    for provider, settings in ADAPTIVE_CONCURRENCY_SETTINGS.items()
+}
+
+# 旧モード名 (保存済みジョブ等) を現在の MODE_SETTINGS のキーへ読み替える
+def resolve_mode_name(name):
+    return MODE_NAME_ALIASES.get(name, name)
+
+# 照会単位に応じて、投入数を制御するプロバイダを決める (Proモードは ipinfo を1件ずつ照会する)
+def primary_provider(batch_size, api_key=None):
+    if api_key:
+        return "ipinfo"
+    return "ip-api-batch" if batch_size > 1 else "ip-api"
+
+# 🆕 最長一致 (Longest-Prefix-Match) 検索用のプレフィックス表
+# プレフィックス長ごとに {ネットワークアドレス(int): 値} のハッシュ表を持ち、
+# 登録済みの長さだけを長い順に引くことで、IPv4で最大25回・IPv6で最大数十回の辞書参照で最長一致を求める
+class CidrPrefixTable:
+    def __init__(self):
+        self._tables = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+
+    def insert(self, network, value):
+        table = self._tables[network.version].setdefault(network.prefixlen, {})
+        table[int(network.network_address)] = value
+        if network.prefixlen not in self._lengths[network.version]:
+            self._lengths[network.version] = sorted(self._tables[network.version], reverse=True)
+
+    def longest_match(self, ip_obj, is_valid=None):
+        ip_int = int(ip_obj)
+        max_len = ip_obj.max_prefixlen
+        tables = self._tables[ip_obj.version]
+        for prefixlen in self._lengths[ip_obj.version]:
+            network_int = (ip_int >> (max_len - prefixlen)) << (max_len - prefixlen)
+            value = tables[prefixlen].get(network_int)
+            if value is not None and (is_valid is None or is_valid(value)):
+                return value
+        return None
+
+    def clear(self):
+        self._tables = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+
+    def __len__(self):
+        return sum(len(t) for tables in self._tables.values() for t in tables.values())
+
+# SQLiteに問い合わせる際の候補プレフィックス長 (他プロセスが書き込んだエントリの取り込み用)
+CIDR_CACHE_DB_PREFIX_RANGES = {4: range(8, 33), 6: range(16, 65)}
+
+# 🆕 SQLite永続CIDRキャッシュ
+# WALモード + busy_timeout で複数プロセス(複数ワーカー/再起動前後)からの同時書き込みに対応し、
+# プロセス内のスレッド間はロックで直列化する。
+# キーは実際の割り当てネットワーク (RDAP範囲、なければ /24 ・ /48) で、検索は最長一致で行う
+class PersistentCidrCache:
+    def __init__(self, db_path, ttl_seconds=CIDR_CACHE_TTL_SECONDS):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._prefix_table = CidrPrefixTable()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS cidr_cache ("
+                "cidr TEXT PRIMARY KEY, isp TEXT, country TEXT, country_code TEXT, timestamp REAL)"
+            )
+            self._conn.commit()
+            rows = self._conn.execute(
+                "SELECT cidr, isp, country, country_code, timestamp FROM cidr_cache WHERE timestamp > ?",
+                (time.time() - self.ttl_seconds,)
+            ).fetchall()
+            self._load_rows(rows)
+
+    def _load_rows(self, rows):
+        for cidr, isp, country, country_code, timestamp in rows:
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                continue
+            self._prefix_table.insert(network, {
+                'Network': str(network), 'ISP': isp, 'Country': country,
+                'CountryCode': country_code, 'Timestamp': timestamp
+            })
+
+    def _is_fresh(self, entry):
+        return time.time() - entry['Timestamp'] < self.ttl_seconds
+
+    def lookup(self, ip):
+        try:
+            ip_obj = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+
+        with self._lock:
+            entry = self._prefix_table.longest_match(ip_obj, self._is_fresh)
+            if entry is None:
+                # メモリ上に無ければ、他プロセスが書き込んだ分をSQLiteから取り込む
+                candidates = [
+                    str(ipaddress.ip_network(f"{ip_obj}/{prefixlen}", strict=False))
+                    for prefixlen in CIDR_CACHE_DB_PREFIX_RANGES[ip_obj.version]
+                ]
+                rows = self._conn.execute(
+                    f"SELECT cidr, isp, country, country_code, timestamp FROM cidr_cache "
+                    f"WHERE timestamp > ? AND cidr IN ({','.join('?' * len(candidates))})",
+                    [time.time() - self.ttl_seconds] + candidates
+                ).fetchall()
+                if rows:
+                    self._load_rows(rows)
+                    entry = self._prefix_table.longest_match(ip_obj, self._is_fresh)
+
+            if entry:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    # dict.update と同じ形 ({cidr: {ISP, Country, CountryCode, Timestamp}}) を受け付ける
+    def update(self, entries):
+        rows = [
+            (cidr, e['ISP'], e['Country'], e['CountryCode'], e['Timestamp'])
+            for cidr, e in entries.items()
+        ]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO cidr_cache VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+            self._load_rows(rows)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cidr_cache")
+            self._conn.commit()
+            self._prefix_table.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM cidr_cache WHERE timestamp > ?",
+                (time.time() - self.ttl_seconds,)
+            ).fetchone()[0]
+
+    # デバッグ表示用 (新しい順に limit 件)
+    def snapshot(self, limit=100):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT cidr, isp, country, country_code, timestamp FROM cidr_cache ORDER BY timestamp DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return {r[0]: {'ISP': r[1], 'Country': r[2], 'CountryCode': r[3], 'Timestamp': r[4]} for r in rows}
+
+    def stats_text(self):
+        return format_cache_stats(len(self), self.hits, self.misses)
+
+_cidr_caches = {}
+_cidr_caches_lock = threading.Lock()
+
+# DBファイルごとに1インスタンスを共有する
+def get_cidr_cache(db_path=CIDR_CACHE_DB_PATH):
+    with _cidr_caches_lock:
+        if db_path not in _cidr_caches:
+            _cidr_caches[db_path] = PersistentCidrCache(db_path)
+        return _cidr_caches[db_path]
+
+# --- ヘルパー関数群 ---
+# 🆕 OCR誤読補正の変換表 (str.translate で1パス変換)。A/a/B はIPv6 (':'を含む) では16進数字なので変換しない
+OCR_TRANSLATE_TABLE = str.maketrans({'Ⅱ': '11', 'I': '1', 'l': '1', '|': '1', 'O': '0', 'o': '0', 'S': '5', 's': '5'})
+OCR_TRANSLATE_TABLE_NO_COLON = str.maketrans({'Ⅱ': '11', 'I': '1', 'l': '1', '|': '1', 'O': '0', 'o': '0', 'S': '5', 's': '5', 'A': '4', 'a': '4', 'B': '8'})
+
+def clean_ocr_error_chars(target):
+    if ':' in target:
+        return target.translate(OCR_TRANSLATE_TABLE)
+    return target.translate(OCR_TRANSLATE_TABLE_NO_COLON)
+
+def is_valid_ip(target):
+    try:
+        ipaddress.ip_address(target)
+        return True
+    except ValueError:
+        return False
+
+def is_ipv4(target):
+    try:
+        ipaddress.IPv4Address(target)
+        return True
+    except ValueError:
+        return False
+
+def ip_to_int(ip):
+    try:
+        if is_ipv4(ip):
+            return struct.unpack("!I", socket.inet_aton(ip))[0]
+        return 0
+    except OSError:
+        return 0
+
+# 🆕 IPv4文字列の一括 uint32 変換 (集約モード用)
+# ipaddress.IPv4Address と同じく先頭ゼロ・全角数字は不正とする。
+# 候補の文字列を「文字位置 x 要素」のバイト行列にし、文字位置ごとに全要素をまとめてオクテット値へ積み上げる (要素ごとのPython処理なし)
+IPV4_MIN_TEXT_LENGTH = 7
+IPV4_MAX_TEXT_LENGTH = 15
+
+def ipv4_strings_to_uint32(ip_series):
+    # (uint32配列, IPv4として有効かのbool配列) を返す。無効な要素の値は 0
+    texts = [text if isinstance(text, str) else str(text) for text in ip_series]
+    lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+    is_v4 = (lengths >= IPV4_MIN_TEXT_LENGTH) & (lengths <= IPV4_MAX_TEXT_LENGTH)
+    ip_ints = np.zeros(len(texts), dtype=np.uint32)
+    if not is_v4.any():
+        return ip_ints, is_v4
+
+    candidates = np.flatnonzero(is_v4)
+    # 通常はほぼ全件が候補のため、そのときは抜き出しを省く
+    candidate_texts = texts if len(candidates) == len(texts) else [texts[i] for i in candidates]
+    try:
+        raw = np.array(candidate_texts, dtype=f'S{IPV4_MAX_TEXT_LENGTH}')
+    except UnicodeEncodeError:
+        # 非ASCII文字 (全角数字など) を含む要素はIPv4ではないため、不正な1文字に置き換える
+        raw = np.array([text if text.isascii() else '?' for text in candidate_texts], dtype=f'S{IPV4_MAX_TEXT_LENGTH}')
+    # 同じ文字位置の全要素が連続したメモリに並ぶよう転置し、末尾に終端 (0) の行を足す
+    codes = np.zeros((IPV4_MAX_TEXT_LENGTH + 1, len(candidates)), dtype=np.uint8)
+    codes[:IPV4_MAX_TEXT_LENGTH] = raw.view(np.uint8).reshape(len(candidates), IPV4_MAX_TEXT_LENGTH).T
+    text_lengths = lengths[candidates]
+
+    positions = np.arange(IPV4_MAX_TEXT_LENGTH + 1)[:, None]
+    digits = codes - np.uint8(48)
+    is_digit = digits < 10
+    is_dot = codes == 46
+    closes = is_dot | (positions == text_lengths)
+    field_start = np.ones(codes.shape, dtype=bool)
+    field_start[1:] = closes[:-1]
+    # 数字とドットだけで (NULを含まない)、ドットがちょうど3個、空のフィールド・4桁以上のフィールド・先頭ゼロ (「01」等。「0」単独は可) がないこと
+    valid = (is_digit | is_dot).sum(axis=0) == text_lengths
+    valid &= is_dot.sum(axis=0) == 3
+    valid &= ~(field_start & closes).any(axis=0)
+    valid &= ~(is_digit[:-3] & is_digit[1:-2] & is_digit[2:-1] & is_digit[3:]).any(axis=0)
+    valid &= ~(field_start[:-1] & (codes[:-1] == 48) & is_digit[1:]).any(axis=0)
+
+    # 文字位置ごとに全要素まとめて「区切り (ドット・末尾) なら255以下を確かめて8bit詰めてから0に戻す」「数字なら10倍して足す」を行う。
+    # 有効な文字列では数字以外の文字はすべて区切りのため、数字でない位置の10倍は0に対してかかるだけ
+    addends = digits * is_digit
+    values = np.zeros(len(candidates), dtype=np.uint32)
+    octets = np.zeros(len(candidates), dtype=np.uint16)
+    for pos in range(IPV4_MAX_TEXT_LENGTH + 1):
+        close = closes[pos]
+        valid &= ~(close & (octets > 255))
+        values <<= close * np.uint32(8)
+        values |= octets * close
+        octets *= ~close
+        octets *= 10
+        octets += addends[pos]
+
+    is_v4[candidates] = valid
+    ip_ints[candidates[valid]] = values[valid]
+    return ip_ints, is_v4
+
+def uint32_to_ipv4_string(ip_int):
+    return socket.inet_ntoa(struct.pack("!I", int(ip_int)))
+
+def int_to_ip_string(ip_int, version):
+    if version == 4:
+        return uint32_to_ipv4_string(ip_int)
+    return str(ipaddress.IPv6Address(int(ip_int)))
+
+# --- 🆕 最小CIDR要約 (集約モード / FWルール出力用) ---
+# アドレスは整数 (IPv4: 32bit, IPv6: 128bit) で扱い、連続範囲 -> 最小個数のCIDR に分解する
+IP_VERSION_BITS = {4: 32, 6: 128}
+
+def range_to_cidrs(start, end, version):
+    # [start, end] をちょうど覆う最小個数の (ネットワーク整数, プレフィックス長) を返す
+    max_prefixlen = IP_VERSION_BITS[version]
+    cidrs = []
+    while start <= end:
+        # start の境界に揃う最大ブロック (下位ビット) と残り範囲に収まる最大ブロックの小さい方
+        block_size = (start & -start) if start else 1 << max_prefixlen
+        block_size = min(block_size, 1 << ((end - start + 1).bit_length() - 1))
+        cidrs.append((start, max_prefixlen - block_size.bit_length() + 1))
+        start += block_size
+    return cidrs
+
+def find_contiguous_ranges(ip_ints, version):
+    # 整数アドレス群 (重複・未ソート可) を連続範囲 [(start, end), ...] にまとめる
+    if version == 4:
+        # IPv4: NumPyで一括処理 (差分が1でない位置で区切る)
+        unique_ints = np.unique(np.asarray(ip_ints, dtype=np.uint32)).astype(np.int64)
+        if unique_ints.size == 0:
+            return [], 0
+        breaks = np.flatnonzero(np.diff(unique_ints) != 1)
+        starts = unique_ints[np.concatenate(([0], breaks + 1))]
+        ends = unique_ints[np.concatenate((breaks, [unique_ints.size - 1]))]
+        return list(zip(starts.tolist(), ends.tolist())), int(unique_ints.size)
+
+    # IPv6: 128bitはNumPyに収まらないためPythonの整数でソートして走査する
+    unique_ints = sorted(set(ip_ints))
+    ranges = []
+    for ip_int in unique_ints:
+        if ranges and ip_int == ranges[-1][1] + 1:
+            ranges[-1][1] = ip_int
+        else:
+            ranges.append([ip_int, ip_int])
+    return [tuple(r) for r in ranges], len(unique_ints)
+
+class LazyText:
+    """
+    str() されるまで文字列の生成を遅らせる (生成結果は保持する)。
+    集約結果のCIDR一覧のように件数が多い文字列を、画面に表示する行・書き出す時点でだけ整形するために使う。
+    """
+    __slots__ = ('_build', '_text')
+
+    def __init__(self, build):
+        self._build = build
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self._build()
+            self._build = None
+        return self._text
+
+    def __repr__(self):
+        return f"LazyText({str(self)!r})"
+
+def format_cidr_lines(starts, ends, version):
+    # 連続範囲 (start/end の整数列) を最小CIDR集合の文字列 (改行区切り) にする
+    return "\n".join(
+        f"{int_to_ip_string(network, version)}/{prefixlen}"
+        for start, end in zip(starts, ends)
+        for network, prefixlen in range_to_cidrs(start, end, version)
+    )
+
+def format_range_lines(starts, ends, version):
+    return "\n".join(
+        int_to_ip_string(start, version) if start == end
+        else f"{int_to_ip_string(start, version)}-{int_to_ip_string(end, version)}"
+        for start, end in zip(starts, ends)
+    )
+
+def summarize_ip_ranges(starts, ends, unique_count, version):
+    """
+    連続範囲 (昇順の start/end) の要約。CIDR集合と範囲の文字列は LazyText で、str() した時点で整形する。
+    Density は「実在アドレス数 / min〜max の範囲幅」で、1.0 なら範囲内に抜けがない。
+    """
+    span = (int(ends[-1]) - int(starts[0]) + 1) if len(starts) else 0
+    return {
+        'cidr_text': LazyText(lambda: format_cidr_lines(list(map(int, starts)), list(map(int, ends)), version)),
+        'range_text': LazyText(lambda: format_range_lines(list(map(int, starts)), list(map(int, ends)), version)),
+        'unique_count': unique_count,
+        'density': (unique_count / span) if span else 0.0,
+    }
+
+def summarize_ip_ints(ip_ints, version):
+    # アドレス群を最小CIDR集合と連続範囲に要約する (summarize_ip_ranges を参照)
+    ranges, unique_count = find_contiguous_ranges(ip_ints, version)
+    return summarize_ip_ranges([start for start, _ in ranges], [end for _, end in ranges], unique_count, version)
+
+def summarize_ipv4_groups(group_ids, ip_ints):
+    """
+    IPv4アドレス群を group_ids (0始まりの連番) ごとに一括で要約する。
+    (グループ番号, アドレス) を1本のuint64キーにして重複除去・ソートし、連続範囲の区切り・min/max・件数をすべてNumPyで求める。
+    戻り値: グループ番号順の (min, max, 要約dict) のリスト
+    """
+    keys = (np.asarray(group_ids, dtype=np.uint64) << np.uint64(32)) | np.asarray(ip_ints, dtype=np.uint64)
+    keys.sort()
+    keys = keys[np.append(True, np.diff(keys) != 0)] if keys.size else keys
+    key_groups = (keys >> np.uint64(32)).astype(np.int64)
+    key_ints = (keys & np.uint64(0xFFFFFFFF)).astype(np.int64)
+
+    # アドレスが1つ飛んだ位置、またはグループが変わる位置で連続範囲を区切る
+    is_range_start = np.ones(keys.size, dtype=bool)
+    is_range_start[1:] = (np.diff(key_ints) != 1) | (np.diff(key_groups) != 0)
+    range_first = np.flatnonzero(is_range_start)
+    range_last = np.append(range_first[1:] - 1, keys.size - 1)
+    range_starts = key_ints[range_first]
+    range_ends = key_ints[range_last]
+
+    group_count = int(key_groups[-1]) + 1 if keys.size else 0
+    group_numbers = np.arange(group_count + 1)
+    key_bounds = np.searchsorted(key_groups, group_numbers)
+    range_bounds = np.searchsorted(key_groups[range_first], group_numbers)
+
+    summaries = []
+    for group in range(group_count):
+        first_key, end_key = key_bounds[group], key_bounds[group + 1]
+        first_range, end_range = range_bounds[group], range_bounds[group + 1]
+        summaries.append((
+            int(key_ints[first_key]),
+            int(key_ints[end_key - 1]),
+            summarize_ip_ranges(range_starts[first_range:end_range], range_ends[first_range:end_range], int(end_key - first_key), 4),
+        ))
+    return summaries
+
+def get_cidr_block(ip, netmask_range=(8, 24)):
+    try:
+        ip_obj = ipaddress.ip_address(ip)
+        if ip_obj.version == 4:
+            netmask = netmask_range[1] 
+            network = ipaddress.ip_network(f'{ip}/{netmask}', strict=False)
+            return str(network)
+        elif ip_obj.version == 6:
+            netmask = 48
+            network = ipaddress.ip_network(f'{ip}/{netmask}', strict=False)
+            return str(network)
+        return None
+    except ValueError:
+        return None
+
+def get_authoritative_rir_link(ip, country_code):
+    rir_name = COUNTRY_CODE_TO_RIR.get(country_code)
+    if rir_name and rir_name in RIR_LINKS:
+        encoded_ip = quote(ip, safe='')
+        if rir_name in ['RIPE', 'ARIN']:
+            link_url = RIR_LINKS[rir_name].format(ip=encoded_ip)
+            return f"[{rir_name}]({link_url})"
+        elif rir_name in ['JPNIC', 'APNIC', 'LACNIC', 'AFRINIC']:
+            link_url = RIR_LINKS[rir_name]  
+            return f"[{rir_name} (手動検索)]({link_url})"
+    return f"[Whois (汎用検索 - APNIC窓口)]({RIR_LINKS.get('APNIC', 'https://wq.apnic.net/static/search.html')})"
+
+def get_copy_target(ip_display):
+    if not ip_display: return ""
+    return str(ip_display).split(' - ')[0].split(' ')[0]
+
+# 🆕 リンク一覧はターゲット種別 (IPv4 / IPv6 / ドメイン) ごとに1度だけ組み立て、ターゲット部分だけを差し込む
+SECONDARY_LINK_PLACEHOLDER = "\x00"
+
+def create_secondary_links(target):
+    is_ip = is_valid_ip(target)
+    is_ipv6 = is_ip and ':' in target
+    # IPv4は数字とドットだけなので quote しても変わらない
+    encoded_target = target if is_ip and not is_ipv6 else quote(target, safe='')
+    return build_secondary_links_template(is_ip, is_ipv6).replace(SECONDARY_LINK_PLACEHOLDER, encoded_target)
+
+@lru_cache(maxsize=None)
+def build_secondary_links_template(is_ip, is_ipv6):
+    encoded_target = SECONDARY_LINK_PLACEHOLDER
+
+    who_is_url = f'https://who.is/whois-ip/ip-address/{encoded_target}' if is_ip else f'https://who.is/whois/{encoded_target}'
+    dns_checker_url = ''
+    dns_checker_key = ''
+
+    if is_ip:
+        dns_checker_path = 'ipv6-whois-lookup.php' if is_ipv6 else 'ip-whois-lookup.php'
+        dns_checker_url = f'https://dnschecker.org/{dns_checker_path}?query={encoded_target}'
+        dns_checker_key = 'DNS Checker (手動 - IPv6)' if is_ipv6 else 'DNS Checker'
+    else:
+        dns_checker_url = f'https://dnschecker.org/whois-lookup.php?query={encoded_target}'
+        dns_checker_key = 'DNS Checker (ドメイン)'
+
+    all_links = {
+        'VirusTotal': f'https://www.virustotal.com/gui/search/{encoded_target}',
+        'Aguse': f'https://www.aguse.jp/?url={encoded_target}',
+        'Whois.com': f'https://www.whois.com/whois/{encoded_target}',
+        'DomainSearch.jp': f'https://www.domainsearch.jp/whois/?q={encoded_target}',
+        'Who.is': who_is_url,
+        'IP2Proxy': f'https://www.ip2proxy.com/{encoded_target}',
+        'DNSlytics (手動)': 'https://dnslytics.com/whois-lookup/',
+        'IP Location': f'https://iplocation.io/ip/{encoded_target}',
+        'CP-WHOIS (手動)': 'https://doco.cph.jp/whoisweb.php',
+    }
+
+    if dns_checker_url:
+        all_links[dns_checker_key] = dns_checker_url
+
+    if is_ipv6:
+        links = {
+            'VirusTotal': all_links['VirusTotal'],
+            'DomainSearch.jp': all_links['DomainSearch.jp'],
+            dns_checker_key: all_links[dns_checker_key],
+            'IP2Proxy': all_links['IP2Proxy'],
+            'DNSlytics (手動)': all_links['DNSlytics (手動)'],
+            'IP Location': all_links['IP Location'],
+            'CP-WHOIS (手動)': all_links['CP-WHOIS (手動)'],
+        }
+    else:
+        links = all_links
+
+    link_html = ""
+    for name, url in links.items():
+        link_html += f"[{name}]({url}) | "
+    return link_html.rstrip(' | ')
+
+# 🆕 IANAのRDAPブートストラップ表 (ディスク保存 + バックグラウンド更新)
+# IPレンジ -> 管轄RIRのRDAPベースURL を最長一致で引き、APNIC経由のリダイレクトを省いて直接照会する。
+# 表が未取得・該当なしの場合は呼び出し側で RDAP_BOOTSTRAP_URL (APNIC) にフォールバックする
+class RdapBootstrapRegistry:
+    def __init__(self, data_dir=RDAP_BOOTSTRAP_DIR, urls=IANA_RDAP_BOOTSTRAP_URLS):
+        self.data_dir = data_dir
+        self.urls = urls
+        self.meta_path = os.path.join(data_dir, "meta.json")
+        self.meta = {}
+        self.last_error = None
+        self._table = CidrPrefixTable()
+        self._service_count = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_thread = None
+        self._load()
+
+    def _path(self, version):
+        return os.path.join(self.data_dir, f"ipv{version}.json")
+
+    @staticmethod
+    def _build_table(documents):
+        table = CidrPrefixTable()
+        service_count = 0
+        for document in documents:
+            for prefixes, base_urls in document.get('services', []):
+                # https のURLを優先する
+                base_url = next((u for u in base_urls if u.startswith("https://")), base_urls[0] if base_urls else None)
+                if not base_url:
+                    continue
+                base_url = base_url if base_url.endswith("/") else base_url + "/"
+                for prefix in prefixes:
+                    try:
+                        table.insert(ipaddress.ip_network(prefix, strict=False), base_url)
+                    except ValueError:
+                        continue
+                service_count += 1
+        return table, service_count
+
+    def _load(self):
+        documents = []
+        for version in self.urls:
+            try:
+                with open(self._path(version), encoding="utf-8") as f:
+                    documents.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        try:
+            with open(self.meta_path, encoding="utf-8") as f:
+                self.meta = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self._table, self._service_count = self._build_table(documents)
+
+    def base_url_for(self, ip_obj):
+        return self._table.longest_match(ip_obj)
+
+    def is_stale(self, max_age=RDAP_BOOTSTRAP_REFRESH_SECONDS):
+        now = time.time()
+        return now >= self._retry_at and now - self.meta.get('checked_at', 0) >= max_age
+
+    # IPv4・IPv6の両方を取得できた場合だけ置き換える (片方だけ新しい表にはしない)
+    def refresh(self, timeout=10):
+        try:
+            documents = {}
+            for version, url in self.urls.items():
+                response = session.get(url, timeout=timeout)
+                response.raise_for_status()
+                documents[version] = response.json()
+            table, service_count = self._build_table(documents.values())
+            if not service_count:
+                raise ValueError("Empty bootstrap registry")
+
+            for version, document in documents.items():
+                write_text_atomic(self._path(version), json.dumps(document))
+            meta = {'checked_at': time.time(), 'publication': {v: d.get('publication') for v, d in documents.items()}}
+            write_text_atomic(self.meta_path, json.dumps(meta))
+            self._table, self._service_count = table, service_count
+            self.meta = meta
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._retry_at = time.time() + RDAP_BOOTSTRAP_RETRY_SECONDS
+
+    def refresh_in_background(self, max_age=RDAP_BOOTSTRAP_REFRESH_SECONDS):
+        with self._lock:
+            if not self.is_stale(max_age) or (self._refresh_thread and self._refresh_thread.is_alive()):
+                return
+            self._refresh_thread = threading.Thread(target=self.refresh, name="rdap-bootstrap-refresh", daemon=True)
+            self._refresh_thread.start()
+
+    def status_text(self):
+        if not self._service_count:
+            return "未取得 (APNIC経由で照会中)" + (f" ⚠️ {self.last_error}" if self.last_error else "")
+        checked_at = self.meta.get('checked_at')
+        text = f"{self._service_count} サービス"
+        if checked_at:
+            text += f" (取得: {time.strftime('%Y-%m-%d %H:%M', time.localtime(checked_at))})"
+        if self.last_error:
+            text += " ⚠️ 更新失敗 - 前回の表を使用中"
+        return text
+
+_rdap_bootstrap_registries = {}
+_rdap_bootstrap_registries_lock = threading.Lock()
+
+def get_rdap_bootstrap_registry(data_dir=RDAP_BOOTSTRAP_DIR):
+    with _rdap_bootstrap_registries_lock:
+        if data_dir not in _rdap_bootstrap_registries:
+            _rdap_bootstrap_registries[data_dir] = RdapBootstrapRegistry(data_dir)
+        return _rdap_bootstrap_registries[data_dir]
+
+# 🆕 RDAP応答のレンジキャッシュ
+# 応答の startAddress〜endAddress をキーに保存し、同じ割り当て内の後続IPはRDAPを呼ばずに答える。
+# レンジはCIDRに分解して CidrPrefixTable に登録するため、入れ子の割り当てでも最も狭いレンジが当たる
+class RdapRangeCache:
+    # parse_rdap_summary / parse_rdap_network が参照するフィールドだけを保持する
+    KEPT_FIELDS = ('name', 'country', 'startAddress', 'endAddress', 'cidr0_cidrs')
+
+    def __init__(self, ttl_seconds=RDAP_RANGE_CACHE_TTL_SECONDS, max_entries=RDAP_RANGE_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+        self._table = CidrPrefixTable()
+        self._lock = threading.Lock()
+
+    def _is_fresh(self, entry):
+        return time.time() - entry['Timestamp'] < self.ttl_seconds
+
+    def _index(self, key, entry):
+        version, start, end = key
+        for network_int, prefixlen in range_to_cidrs(start, end, version):
+            self._table.insert(ipaddress.ip_network((int_to_ip_string(network_int, version), prefixlen)), entry)
+
+    def lookup(self, ip):
+        try:
+            ip_obj = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        with self._lock:
+            entry = self._table.longest_match(ip_obj, self._is_fresh)
+            if entry:
+                self.hits += 1
+                return entry['Data']
+            self.misses += 1
+            return None
+
+    def store(self, data):
+        try:
+            start = ipaddress.ip_address(data['startAddress'])
+            end = ipaddress.ip_address(data['endAddress'])
+        except (KeyError, TypeError, ValueError):
+            return
+        if start.version != end.version or int(start) > int(end):
+            return
+
+        key = (start.version, int(start), int(end))
+        entry = {'Data': {k: data[k] for k in self.KEPT_FIELDS if k in data}, 'Timestamp': time.time()}
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = entry
+            if len(self._entries) > self.max_entries:
+                # 古い半分を捨てて索引を作り直す (CidrPrefixTable は個別削除を持たないため)
+                self._entries = dict(list(self._entries.items())[len(self._entries) // 2:])
+                self._table.clear()
+                for k, e in self._entries.items():
+                    self._index(k, e)
+            else:
+                self._index(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._table.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats_text(self):
+        return format_cache_stats(f"{len(self)} ranges", self.hits, self.misses)
+
+rdap_range_cache = RdapRangeCache()
+
+# 🆕 1回の照会について、リクエストを実際に送信した時点と、送信から応答までのネットワーク時間を記録する。
+# 並列数・レート制限の待ち時間や、応答後のRDAP補完の時間はレイテンシに含めない
+class RequestTiming:
+    def __init__(self):
+        self.sent = threading.Event()
+        self.sent_at = None
+        self.latency = None
+
+    def mark_sent(self):
+        self.sent_at = time.monotonic()
+        self.sent.set()
+
+    def mark_received(self):
+        self.latency = time.monotonic() - self.sent_at
+        return self.latency
+
+def get_rdap_url(ip):
+    registry = get_rdap_bootstrap_registry()
+    registry.refresh_in_background()
+    try:
+        base_url = registry.base_url_for(ipaddress.ip_address(ip))
+    except ValueError:
+        base_url = None
+    if base_url is None:
+        return RDAP_BOOTSTRAP_URL.format(ip=ip)
+    return f"{base_url}ip/{ip}"
+
+# 🆕 RDAPデータ取得関数 (公式台帳への照会)
+# 戻り値: (要約, レスポンス)。レンジキャッシュに当たった場合はレスポンスが None、
+# 429 の場合は要約が None。それ以外の失敗は例外を送出する
+def query_rdap(ip, timeout=5, timing=None):
+    cached = rdap_range_cache.lookup(ip)
+    if cached is not None:
+        return parse_rdap_summary(cached, ip), None
+
+    # 管轄RIRへ直接照会する。移転済みのレンジでは別RIRへリダイレクトされるため allow_redirects=True
+    url = get_rdap_url(ip)
+    timing = timing or RequestTiming()
+    controller = concurrency_controllers["rdap"]
+    started = controller.acquire()
+    outcome = 'error'
+    try:
+        timing.mark_sent()
+        response = session.get(url, timeout=timeout, allow_redirects=True)
+        timing.mark_received()
+        if response.status_code == 429:
+            outcome = 'rate_limited'
+        elif response.ok:
+            outcome = 'success'
+    finally:
+        controller.release(started, outcome, timing.latency)
+    if response.status_code == 429:
+        return None, response
+    response.raise_for_status()
+    data = response.json()
+    rdap_range_cache.store(data)
+    return parse_rdap_summary(data, ip), response
+
+# 戻り値: {'name': ネットワーク名, 'network': IPを含む実際の割り当てCIDR (不明ならNone), 'country': 国コード} または None
+def fetch_rdap_data(ip):
+    try:
+        summary, _ = query_rdap(ip)
+        return summary
+    except:
+        return None
+
+def parse_rdap_summary(data, ip):
+    # RDAPのレスポンス形式から組織名を探す (nameやremarks)
+    # 詳細な記述がある場合もあるのでremarksも見るが、まずはnameを採用
+    return {
+        'name': data.get('name', ''),
+        'network': parse_rdap_network(data, ip),
+        'country': data.get('country'),
+    }
+
+# 🆕 RDAPレスポンスから、対象IPを含む割り当てネットワーク(CIDR)を取り出す
+# cidr0拡張 (cidr0_cidrs) を優先し、なければ startAddress/endAddress の範囲をCIDRに分解する
+def parse_rdap_network(data, ip):
+    try:
+        ip_obj = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+
+    networks = []
+    for cidr in data.get('cidr0_cidrs') or []:
+        prefix = cidr.get('v4prefix') or cidr.get('v6prefix')
+        if prefix is None or cidr.get('length') is None:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(f"{prefix}/{cidr['length']}", strict=False))
+        except ValueError:
+            continue
+
+    if not networks and data.get('startAddress') and data.get('endAddress'):
+        try:
+            start = ipaddress.ip_address(data['startAddress'])
+            end = ipaddress.ip_address(data['endAddress'])
+            networks = list(ipaddress.summarize_address_range(start, end))
+        except (ValueError, TypeError):
+            networks = []
+
+    containing = [n for n in networks if n.version == ip_obj.version and ip_obj in n]
+    if not containing:
+        return None
+    # 範囲が複数CIDRに分かれる場合は、IPを含む最も狭いものを採用
+    return str(max(containing, key=lambda n: n.prefixlen))
+
+# 🆕 Proモード用 API取得関数 (ipinfo.io) - 改良版
+def get_ip_details_pro(ip, token, tor_nodes, timing=None):
+    result = {
+        'Target_IP': ip, 'ISP': 'N/A', 'ISP_JP': 'N/A', 'Country': 'N/A', 'Country_JP': 'N/A', 
+        'CountryCode': 'N/A', 'RIR_Link': 'N/A', 'Secondary_Security_Links': 'N/A', 'Status': 'N/A'
+    }
+    timing = timing or RequestTiming()
+    controller = concurrency_controllers["ipinfo"]
+    try:
+        url = IPINFO_API_URL.format(ip=ip, token=token)
+        started = controller.acquire()
+        outcome = 'error'
+        try:
+            timing.mark_sent()
+            response = session.get(url, timeout=10)
+            timing.mark_received()
+            if response.status_code == 429:
+                outcome = 'rate_limited'
+            elif response.ok:
+                outcome = 'success'
+        finally:
+            controller.release(started, outcome, timing.latency)
+        
+        if response.status_code == 429:
+             result['Status'] = 'Error: Rate Limit (Pro)'
+             return result
+
+        response.raise_for_status()
+        data = response.json()
+        
+        # --- 基本情報の取得 ---
+        org_raw = data.get('org', '')
+        isp_name = re.sub(r'^AS\d+\s+', '', org_raw) if org_raw else 'N/A'
+        
+        result['ISP'] = isp_name
+        result['CountryCode'] = data.get('country', 'N/A')
+        result['Country'] = result['CountryCode']
+        result['RIR_Link'] = get_authoritative_rir_link(ip, result['CountryCode'])
+        result['Status'] = 'Success (Pro API)'
+        
+        # 名寄せ処理
+        jp_isp, jp_country = get_jp_names(result['ISP'], result['CountryCode'])
+        result['ISP_JP'] = jp_isp
+        result['Country_JP'] = jp_country
+
+        # --- 🛡️ 判定ロジックの分岐 (ipinfoのprivacy情報を活用) ---
+        privacy_data = data.get('privacy', {})
+        
+        if privacy_data:
+            # --- パターンA: ipinfoの公式判定を採用 ---
+            detected_types = []
+            if privacy_data.get('vpn', False):
+                detected_types.append("VPN")
+            if privacy_data.get('proxy', False):
+                detected_types.append("Proxy")
+            if privacy_data.get('tor', False):
+                detected_types.append("Tor Node")
+            if privacy_data.get('hosting', False):
+                detected_types.append("Hosting")
+            if privacy_data.get('relay', False): # iCloud Private Relayなど
+                detected_types.append("Relay")
+            
+            if detected_types:
+                # 複数の性質を持つ場合もあるので結合 (例: "VPN, Hosting")
+                result['Proxy_Type'] = ", ".join(detected_types)
+            else:
+                result['Proxy_Type'] = "" # 何も検知されなければ一般回線扱い
+                
+        else:
+            # --- パターンB: privacyデータがない場合 (無料プラン等) ---
+            # 従来通り、ツール独自のISP名判定ロジックを使用
+            proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
+            is_anonymous = (proxy_type != "Standard Connection")
+            result['Proxy_Type'] = f"{proxy_type}" if is_anonymous else ""
+        
+    except Exception as e:
+        result['Status'] = f'Error: Pro API ({type(e).__name__})'
+    
+    result['Secondary_Security_Links'] = create_secondary_links(ip)
+    return result
+
+# --- API通信関数 (Main) ---
+# 429時の待機秒数: X-Ttl (リセットまでの秒数) があればそれを優先する
+def get_rate_limit_wait(response, rate_limit_wait_seconds):
+    try:
+        return max(1, int(response.headers.get('X-Ttl')) + 1)
+    except (TypeError, ValueError):
+        return rate_limit_wait_seconds
+
+def new_ip_result(ip):
+    return {
+        'Target_IP': ip, 'ISP': 'N/A', 'ISP_JP': 'N/A', 'Country': 'N/A', 'Country_JP': 'N/A', 
+        'CountryCode': 'N/A', 'RIR_Link': 'N/A', 'Secondary_Security_Links': 'N/A', 'Status': 'N/A'
+    }
+
+# CIDRキャッシュにヒットすれば結果を返す (ヒットしなければ None)
+def get_cached_ip_details(ip, cidr_cache, tor_nodes):
+    # 最長一致でIPを含むネットワークを検索 (TTL切れのエントリは対象外)
+    cached_data = cidr_cache.lookup(ip)
+    if not cached_data:
+        return None
+
+    result = new_ip_result(ip)
+    result['ISP'] = cached_data['ISP']
+    result['Country'] = cached_data['Country']
+    result['CountryCode'] = cached_data['CountryCode']
+    result['Status'] = "Success (Cache)" 
+    jp_isp, jp_country = get_jp_names(result['ISP'], result['CountryCode'])
+    proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
+    is_anonymous = (proxy_type != "Standard Connection")
+    result['ISP_JP'] = jp_isp
+    result['Proxy_Type'] = f"{proxy_type}" if is_anonymous else ""
+    result['Country_JP'] = jp_country
+    return result
+
+# ip-api.com のレスポンス1件分 (単発/バッチ共通) から結果とCIDRキャッシュエントリを組み立てる
+def build_ip_api_result(ip, data, tor_nodes, use_rdap):
+    result = new_ip_result(ip)
+    new_cache_entry = None
+    cidr_block = get_cidr_block(ip)
+
+    if data.get('status') == 'success':
+        country_code = data.get('countryCode', 'N/A') 
+
+        # ISP名またはOrg名を採用
+        raw_isp = data.get('isp', 'N/A')
+        raw_org = data.get('org', '')
+        
+        # Org情報がある場合は、ISP情報と併記または優先度判定
+        combined_name = raw_isp
+        if raw_org and raw_org != raw_isp:
+            combined_name = f"{raw_isp} / {raw_org}"
+        
+        result['ISP'] = combined_name
+        result['Country'] = data.get('country', 'N/A')
+        result['CountryCode'] = data.get('countryCode', 'N/A')
+        result['RIR_Link'] = get_authoritative_rir_link(ip, country_code)
+        status_type = "IPv6 API" if not is_ipv4(ip) else "IPv4 API"
+        
+        # --- 🆕 RDAP併用ロジック ---
+        rdap_name = ""
+        if use_rdap:
+            rdap_result = fetch_rdap_data(ip)
+            if rdap_result:
+                rdap_name = rdap_result['name']
+                if rdap_name:
+                    result['ISP'] = f"{result['ISP']} [RDAP: {rdap_name}]"
+                # 🆕 RDAPで実際の割り当て範囲が分かれば、/24 ・ /48 の代わりにその範囲でキャッシュする
+                if rdap_result['network']:
+                    rdap_network = ipaddress.ip_network(rdap_result['network'])
+                    if rdap_network.prefixlen in CIDR_CACHE_DB_PREFIX_RANGES[rdap_network.version]:
+                        cidr_block = rdap_result['network']
+
+        result['Status'] = f'Success ({status_type})'
+        
+        # 名寄せ処理
+        jp_isp, jp_country = get_jp_names(result['ISP'], country_code)
+        
+        proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
+        is_anonymous = (proxy_type != "Standard Connection")
+        result['ISP_JP'] = jp_isp
+        result['Proxy_Type'] = f"{proxy_type}" if is_anonymous else ""
+        result['Country_JP'] = jp_country
+        
+        if cidr_block:
+            new_cache_entry = {
+                cidr_block: {
+                'ISP': result['ISP'], # RDAP情報込みでキャッシュする
+                'Country': result['Country'],
+                'CountryCode': result['CountryCode'],
+                'Timestamp': time.time()
+                }
+            }
+        
+    elif data.get('status') == 'fail':
+        result['Status'] = f"API Fail: {data.get('message', 'Unknown Fail')}"
+        result['RIR_Link'] = get_authoritative_rir_link(ip, 'N/A')
+        
+    else:
+        result['Status'] = f"API Error: Unknown Response"
+        result['RIR_Link'] = get_authoritative_rir_link(ip, 'N/A')
+
+    result['Secondary_Security_Links'] = create_secondary_links(ip)
+    return result, new_cache_entry
+
+def get_ip_details_from_api(ip, cidr_cache, rate_limit_wait_seconds, tor_nodes, use_rdap, api_key=None):
+    
+    # 1. Proモード (APIキーあり) の場合
+    if api_key:
+        return get_ip_details_ipinfo(ip, api_key, tor_nodes, use_rdap)
+
+    # 2. 通常モード (ip-api.com)
+    return get_ip_details_ip_api(ip, cidr_cache, rate_limit_wait_seconds, tor_nodes, use_rdap)
+
+# timing を渡すと ipinfo へのリクエストの送信時点とネットワーク時間を記録する (RDAP補完の時間は含まない)
+def get_ip_details_ipinfo(ip, api_key, tor_nodes, use_rdap, timing=None):
+    result = get_ip_details_pro(ip, api_key, tor_nodes, timing)
+    
+    # RDAPオプションが有効なら、Proモードでも追記する
+    if use_rdap:
+        rdap_result = fetch_rdap_data(ip)
+        if rdap_result and rdap_result['name']:
+            result['ISP'] = f"{result['ISP']} [RDAP: {rdap_result['name']}]"
+    
+    return result, None
+
+# timing を渡すと、並列数・レート制限の待ちを除いたリクエストの送信時点とネットワーク時間を記録する
+def get_ip_details_ip_api(ip, cidr_cache, rate_limit_wait_seconds, tor_nodes, use_rdap, timing=None):
+    cached_result = get_cached_ip_details(ip, cidr_cache, tor_nodes)
+    if cached_result:
+        return cached_result, None
+
+    result = new_ip_result(ip)
+    timing = timing or RequestTiming()
+    limiter = rate_limiters["ip-api"]
+    controller = concurrency_controllers["ip-api"]
+    try:
+        started = controller.acquire()
+        outcome = 'error'
+        try:
+            limiter.acquire()
+            url = IP_API_URL.format(ip=ip)
+            timing.mark_sent()
+            response = session.get(url, timeout=45)
+            timing.mark_received()
+            limiter.update_from_headers(response.headers)
+            if response.status_code == 429:
+                outcome = 'rate_limited'
+            elif response.ok:
+                outcome = 'success'
+        finally:
+            controller.release(started, outcome, timing.latency)
+        
+        if response.status_code == 429:
+            wait_seconds = get_rate_limit_wait(response, rate_limit_wait_seconds)
+            limiter.block_for(wait_seconds)
+            defer_until = time.time() + wait_seconds
+            result['Status'] = 'Error: Rate Limit (429)'
+            result['Defer_Until'] = defer_until
+            result['Secondary_Security_Links'] = create_secondary_links(ip)
+            return result, None 
+        
+        response.raise_for_status()
+        return build_ip_api_result(ip, response.json(), tor_nodes, use_rdap)
+            
+    except requests.exceptions.RequestException as e:
+        result['Status'] = f'Error: Network/Timeout ({type(e).__name__})'
+        
+    result['Secondary_Security_Links'] = create_secondary_links(ip)
+    return result, None
+
+# 🆕 RDAP単独での照会 (フェイルオーバー先)。ネットワーク名をISP名として扱う
+def get_ip_details_rdap(ip, tor_nodes, rate_limit_wait_seconds, timing=None):
+    result = new_ip_result(ip)
+    try:
+        summary, response = query_rdap(ip, timeout=10, timing=timing)
+        if summary is None:
+            result['Status'] = 'Error: Rate Limit (RDAP)'
+            result['Defer_Until'] = time.time() + get_rate_limit_wait(response, rate_limit_wait_seconds)
+            result['Secondary_Security_Links'] = create_secondary_links(ip)
+            return result, None
+
+        country_code = summary['country'] or 'N/A'
+        result['ISP'] = summary['name'] or 'N/A'
+        result['Country'] = country_code
+        result['CountryCode'] = country_code
+        result['RIR_Link'] = get_authoritative_rir_link(ip, country_code)
+        result['Status'] = 'Success (RDAP)'
+
+        jp_isp, jp_country = get_jp_names(result['ISP'], country_code)
+        proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
+        result['ISP_JP'] = jp_isp
+        result['Proxy_Type'] = proxy_type if proxy_type != "Standard Connection" else ""
+        result['Country_JP'] = jp_country
+    except (requests.exceptions.RequestException, ValueError) as e:
+        result['Status'] = f'Error: Network/Timeout ({type(e).__name__})'
+
+    result['Secondary_Security_Links'] = create_secondary_links(ip)
+    return result, None
+
+# 🆕 オフラインASN/国データベース
+# ip2asn形式のTSV (range_start, range_end, AS_number, country_code, AS_description / .gz可) または
+# MaxMind形式の .mmdb (maxminddb パッケージが必要) を読み込み、レンジの開始・終了アドレスをソート済み配列で持つ。
+# IPv4は uint32 のNumPy配列を searchsorted で一括検索し、128bitのIPv6はPythonの整数リストを bisect で引く。
+# ネットワーク通信は一切行わず、未収録のIPだけをオンラインAPIへ回す
+class OfflineIpDatabase:
+    COLUMNS = ['start', 'end', 'asn', 'country', 'org']
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime = os.path.getmtime(path)
+        frame = self._read_mmdb(path) if path.endswith(".mmdb") else self._read_tsv(path)
+        # AS番号0は ip2asn の「Not routed」(未割り当て) なので収録しない
+        frame = frame[frame['asn'] != 0].reset_index(drop=True)
+        self._asn = frame['asn'].to_numpy()
+        self._country = frame['country'].to_numpy(dtype=object)
+        self._org = frame['org'].to_numpy(dtype=object)
+
+        starts, is_v4 = ipv4_strings_to_uint32(frame['start'])
+        ends, end_is_v4 = ipv4_strings_to_uint32(frame['end'])
+        is_v4 = is_v4 & end_is_v4
+        order = np.argsort(starts[is_v4], kind='stable')
+        self._v4_rows = np.flatnonzero(is_v4)[order]
+        self._v4_starts = starts[self._v4_rows]
+        self._v4_ends = ends[self._v4_rows]
+
+        v6_ranges = []
+        for row in np.flatnonzero(~is_v4):
+            try:
+                start = ipaddress.ip_address(frame.at[row, 'start'])
+                end = ipaddress.ip_address(frame.at[row, 'end'])
+            except ValueError:
+                continue
+            if start.version == 6 and end.version == 6:
+                v6_ranges.append((int(start), int(end), int(row)))
+        v6_ranges.sort()
+        self._v6_starts = [r[0] for r in v6_ranges]
+        self._v6_ends = [r[1] for r in v6_ranges]
+        self._v6_rows = [r[2] for r in v6_ranges]
+
+    @classmethod
+    def _read_tsv(cls, path):
+        frame = pd.read_csv(
+            path, sep='\t', header=None, names=cls.COLUMNS, usecols=range(len(cls.COLUMNS)),
+            dtype=str, quoting=csv.QUOTE_NONE, keep_default_na=False, compression='infer'
+        )
+        frame['asn'] = pd.to_numeric(frame['asn'], errors='coerce').fillna(0).astype(np.int64)
+        return frame
+
+    @classmethod
+    def _read_mmdb(cls, path):
+        import maxminddb # .mmdb を使う場合のみ必要
+        rows = []
+        with maxminddb.open_database(path) as reader:
+            for network, record in reader:
+                record = record or {}
+                country = (record.get('country') or record.get('registered_country') or {}).get('iso_code', '')
+                rows.append((
+                    str(network.network_address), str(network.broadcast_address),
+                    record.get('autonomous_system_number') or 0, country,
+                    record.get('autonomous_system_organization', ''),
+                ))
+        return pd.DataFrame(rows, columns=cls.COLUMNS)
+
+    def __len__(self):
+        return len(self._v4_rows) + len(self._v6_rows)
+
+    # 各IPを含むレンジの行番号 (収録されていなければ -1) を返す
+    def lookup_rows(self, ips):
+        ips = list(ips)
+        rows = np.full(len(ips), -1, dtype=np.int64)
+        ip_ints, is_v4 = ipv4_strings_to_uint32(ips)
+        if is_v4.any() and len(self._v4_starts):
+            v4_positions = np.flatnonzero(is_v4)
+            v4_ints = ip_ints[is_v4]
+            idx = np.searchsorted(self._v4_starts, v4_ints, side='right') - 1
+            clipped = np.clip(idx, 0, None)
+            hit = (idx >= 0) & (v4_ints <= self._v4_ends[clipped])
+            rows[v4_positions[hit]] = self._v4_rows[clipped[hit]]
+
+        if self._v6_starts:
+            for i in np.flatnonzero(~is_v4):
+                try:
+                    ip_obj = ipaddress.ip_address(ips[i])
+                except ValueError:
+                    continue
+                if ip_obj.version != 6:
+                    continue
+                ip_int = int(ip_obj)
+                idx = bisect.bisect_right(self._v6_starts, ip_int) - 1
+                if idx >= 0 and ip_int <= self._v6_ends[idx]:
+                    rows[i] = self._v6_rows[idx]
+        return rows
+
+    # get_ip_details_from_api と同じ形の結果を組み立てる
+    def build_result(self, ip, row, tor_nodes):
+        result = new_ip_result(ip)
+        country_code = self._country[row] or 'N/A'
+        result['ISP'] = self._org[row] or f"AS{self._asn[row]}"
+        result['Country'] = country_code
+        result['CountryCode'] = country_code
+        result['RIR_Link'] = get_authoritative_rir_link(ip, country_code)
+        result['Status'] = 'Success (Local DB)'
+
+        jp_isp, jp_country = get_jp_names(result['ISP'], country_code)
+        proxy_type = detect_proxy_vpn_tor(ip, result['ISP'], tor_nodes)
+        result['ISP_JP'] = jp_isp
+        result['Proxy_Type'] = proxy_type if proxy_type != "Standard Connection" else ""
+        result['Country_JP'] = jp_country
+        result['Secondary_Security_Links'] = create_secondary_links(ip)
+        return result
+
+    def status_text(self):
+        return f"{len(self)} ranges (IPv4: {len(self._v4_rows)} / IPv6: {len(self._v6_rows)}, {os.path.basename(self.path)})"
+
+_offline_databases = {}
+_offline_databases_lock = threading.Lock()
+
+# ファイルごとに1インスタンスを共有し、ファイルが差し替えられていれば読み直す。ファイルが無ければ None
+def get_offline_database(path=OFFLINE_DB_PATH):
+    if not path or not os.path.exists(path):
+        return None
+    with _offline_databases_lock:
+        database = _offline_databases.get(path)
+        if database is None or database.mtime != os.path.getmtime(path):
+            database = _offline_databases[path] = OfflineIpDatabase(path)
+        return database
+
+# 🆕 ターゲット列をオフラインDBで先に解決する
+# 収録済みのIPは結果dictに置き換え、未収録のIP・ドメインは文字列のまま (オンライン照会へ) 流す。
+# offline_only の場合、未収録のIPもオンラインへは回さず「未収録」として返す
+def iter_offline_resolved(targets, offline_db, tor_nodes, offline_only=False):
+    target_iter = iter(targets)
+    while True:
+        chunk = []
+        for target in target_iter:
+            chunk.append(target)
+            if len(chunk) >= OFFLINE_DB_LOOKUP_CHUNK:
+                break
+        if not chunk:
+            return
+        rows = offline_db.lookup_rows(chunk).tolist()
+        for target, row in zip(chunk, rows):
+            if row >= 0:
+                yield offline_db.build_result(target, row, tor_nodes)
+            elif offline_only and is_valid_ip(target):
+                result = new_ip_result(target)
+                result['Status'] = 'Not Found (Local DB)'
+                result['RIR_Link'] = get_authoritative_rir_link(target, 'N/A')
+                result['Secondary_Security_Links'] = create_secondary_links(target)
+                yield result
+            else:
+                yield target
+
+# 🆕 他のプロバイダで再試行すべき失敗 (429・タイムアウト等) か
+RETRYABLE_STATUS_PREFIXES = ('Error: Rate Limit', 'Error: Network/Timeout', 'Error: Pro API')
+
+def is_retryable_result(result):
+    return bool(result.get('Defer_Until')) or result.get('Status', '').startswith(RETRYABLE_STATUS_PREFIXES)
+
+# 🆕 プロバイダごとのレイテンシ・成否の記録 (全スレッド・全ジョブで共有)
+# 429では指示された時刻まで、連続エラーでは一定時間そのプロバイダを候補から外す
+class ProviderStats:
+    def __init__(self):
+        self.latency_ewma = None
+        self.successes = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.hedges = 0
+        self.consecutive_errors = 0
+        self.cooldown_until = 0.0
+        self._lock = threading.Lock()
+
+    def is_available(self):
+        return time.time() >= self.cooldown_until
+
+    def record(self, result, latency):
+        with self._lock:
+            if result.get('Status', '').startswith('Success'):
+                self.successes += 1
+                self.consecutive_errors = 0
+                # レイテンシはリクエストを送信した場合だけ (RDAPのレンジキャッシュ等は除く)
+                if latency is not None:
+                    self.latency_ewma = latency if self.latency_ewma is None else (
+                        PROVIDER_LATENCY_EWMA_ALPHA * latency + (1 - PROVIDER_LATENCY_EWMA_ALPHA) * self.latency_ewma
+                    )
+            elif result.get('Status', '').startswith('Error: Rate Limit'):
+                self.rate_limited += 1
+                cooldown_until = result.get('Defer_Until') or time.time() + PROVIDER_RATE_LIMIT_COOLDOWN_SECONDS
+                self.cooldown_until = max(self.cooldown_until, cooldown_until)
+            elif is_retryable_result(result):
+                self.errors += 1
+                self.consecutive_errors += 1
+                if self.consecutive_errors >= PROVIDER_ERROR_COOLDOWN_THRESHOLD:
+                    self.cooldown_until = max(self.cooldown_until, time.time() + PROVIDER_ERROR_COOLDOWN_SECONDS)
+                    self.consecutive_errors = 0
+
+    def record_hedge(self):
+        with self._lock:
+            self.hedges += 1
+
+    def hedge_delay(self):
+        if self.latency_ewma is None:
+            return PROVIDER_HEDGE_DEFAULT_DELAY
+        return max(PROVIDER_HEDGE_MIN_DELAY, self.latency_ewma * PROVIDER_HEDGE_LATENCY_FACTOR)
+
+    def status_text(self):
+        latency = f"{self.latency_ewma * 1000:.0f}ms" if self.latency_ewma is not None else "-"
+        text = f"avg {latency} | OK: {self.successes} / 429: {self.rate_limited} / Err: {self.errors} / Hedge: {self.hedges}"
+        if not self.is_available():
+            text += f" (停止中: 残り{int(self.cooldown_until - time.time())}s)"
+        return text
+
+provider_stats = {provider: ProviderStats() for provider in ("ipinfo", "ip-api", "rdap")}
+
+# 🆕 プロバイダルーター
+# 設定済みのデータソースを優先順に試し、429・タイムアウトなら次のソースへ切り替える (結果dictの形式は共通)。
+# hedge=True の場合、優先ソースへの送信後、平均レイテンシの数倍経っても応答しなければ次のソースへも同時に問い合わせ、
+# 先に成功した方を採用する。全ソースが停止中・失敗した時だけ、最初の失敗結果 (429なら Defer_Until 付き) を返す
+class ProviderRouter:
+    def __init__(self, cidr_cache, tor_nodes, rate_limit_wait_seconds, use_rdap=False, api_key=None, hedge=False):
+        self.cidr_cache = cidr_cache
+        self.tor_nodes = tor_nodes
+        self.rate_limit_wait_seconds = rate_limit_wait_seconds
+        self.use_rdap = use_rdap
+        self.api_key = api_key
+        self.providers = ["ipinfo", "ip-api", "rdap"] if api_key else ["ip-api", "rdap"]
+        self._executor = ThreadPoolExecutor(max_workers=PROVIDER_HEDGE_MAX_WORKERS, thread_name_prefix="provider-hedge") if hedge else None
+
+    # レイテンシ実績には、各照会関数が計測した送信〜応答のネットワーク時間だけを記録する
+    def _call(self, provider, ip, timing=None):
+        timing = timing or RequestTiming()
+        try:
+            if provider == "ipinfo":
+                res = get_ip_details_ipinfo(ip, self.api_key, self.tor_nodes, self.use_rdap, timing=timing)
+            elif provider == "ip-api":
+                res = get_ip_details_ip_api(ip, self.cidr_cache, self.rate_limit_wait_seconds, self.tor_nodes, self.use_rdap, timing=timing)
+            else:
+                res = get_ip_details_rdap(ip, self.tor_nodes, self.rate_limit_wait_seconds, timing=timing)
+        finally:
+            # 送信せずに終わった場合 (キャッシュヒット・送信前の失敗) もヘッジ側の待機を解く
+            timing.sent.set()
+        # キャッシュヒットはレイテンシ実績に含めない
+        if res[0].get('Status') != 'Success (Cache)':
+            provider_stats[provider].record(res[0], timing.latency)
+        return res
+
+    def _call_hedged(self, ip, primary, secondary):
+        timing = RequestTiming()
+        first = self._executor.submit(self._call, primary, ip, timing)
+        # ヘッジの計時は優先ソースへのリクエストを実際に送信してから始める
+        # (並列数・レート制限で手元で待っている間に、次のソースの枠を消費しない)
+        timing.sent.wait()
+        try:
+            return first.result(timeout=provider_stats[primary].hedge_delay()), (primary,)
+        except FutureTimeoutError:
+            pass
+
+        provider_stats[primary].record_hedge()
+        pending = {first, self._executor.submit(self._call, secondary, ip)}
+        first_failure = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                res = f.result()
+                if not is_retryable_result(res[0]):
+                    return res, (primary, secondary)
+                first_failure = first_failure or res
+        return first_failure, (primary, secondary)
+
+    def lookup(self, ip, skip=()):
+        candidates = [p for p in self.providers if p not in skip]
+        available = [p for p in candidates if provider_stats[p].is_available()]
+        tried = set()
+        first_failure = None
+        for i, provider in enumerate(available):
+            if provider in tried:
+                continue
+            secondary = next((p for p in available[i + 1:] if p not in tried), None)
+            if self._executor is not None and secondary:
+                res, used = self._call_hedged(ip, provider, secondary)
+            else:
+                res, used = self._call(provider, ip), (provider,)
+            tried.update(used)
+            if not is_retryable_result(res[0]):
+                return res
+            first_failure = first_failure or res
+
+        if first_failure is not None:
+            return first_failure
+
+        # 全プロバイダが停止中: 最も早く再開するプロバイダの時刻まで隔離する
+        result = new_ip_result(ip)
+        result['Status'] = 'Error: Rate Limit (All Providers)'
+        result['Defer_Until'] = min((provider_stats[p].cooldown_until for p in candidates), default=time.time() + self.rate_limit_wait_seconds)
+        result['Secondary_Security_Links'] = create_secondary_links(ip)
+        return result, None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+# 🆕 バッチモード: 未キャッシュIPを最大100件まとめて ip-api.com/batch へPOSTする
+# 戻り値は (result, new_cache_entry) のリスト (入力IPと同じ順序)
+def get_ip_details_batch(ips, cidr_cache, rate_limit_wait_seconds, tor_nodes, use_rdap, api_key=None):
+    
+    # Proモード (ipinfo.io) のバッチAPIは有料プラン限定のため、1件ずつ照会する
+    if api_key:
+        return [get_ip_details_from_api(ip, cidr_cache, rate_limit_wait_seconds, tor_nodes, use_rdap, api_key) for ip in ips]
+
+    results_by_ip = {}
+    uncached_ips = []
+    for ip in ips:
+        cached_result = get_cached_ip_details(ip, cidr_cache, tor_nodes)
+        if cached_result:
+            results_by_ip[ip] = (cached_result, None)
+        elif ip not in uncached_ips:
+            uncached_ips.append(ip)
+
+    for start in range(0, len(uncached_ips), IP_API_BATCH_SIZE):
+        chunk = uncached_ips[start:start + IP_API_BATCH_SIZE]
+        data_list, failures = post_ip_api_batch(chunk, rate_limit_wait_seconds)
+        if failures is not None:
+            results_by_ip.update(zip(chunk, failures))
+            continue
+        # レスポンスはリクエストと同じ順序で返る
+        for ip, data in zip(chunk, data_list):
+            results_by_ip[ip] = build_ip_api_result(ip, data, tor_nodes, use_rdap)
+
+    return [results_by_ip[ip] for ip in ips]
+
+# 🆕 IPのリスト (最大 IP_API_BATCH_SIZE 件・キャッシュ確認済み) を1回だけ ip-api.com/batch へPOSTする。
+# 戻り値は (レスポンスdictのリスト, None)、失敗時は (None, (result, None) のリスト)。どちらも chunk と同じ順序
+def post_ip_api_batch(chunk, rate_limit_wait_seconds):
+    def failed(status, defer_until=None):
+        failures = []
+        for ip in chunk:
+            result = new_ip_result(ip)
+            result['Status'] = status
+            if defer_until is not None:
+                result['Defer_Until'] = defer_until
+            result['Secondary_Security_Links'] = create_secondary_links(ip)
+            failures.append((result, None))
+        return None, failures
+
+    limiter = rate_limiters["ip-api-batch"]
+    controller = concurrency_controllers["ip-api-batch"]
+    try:
+        started = controller.acquire()
+        outcome, latency = 'error', None
+        try:
+            limiter.acquire()
+            sent = time.monotonic()
+            response = session.post(IP_API_BATCH_URL, json=chunk, timeout=45)
+            latency = time.monotonic() - sent
+            limiter.update_from_headers(response.headers)
+            if response.status_code == 429:
+                outcome = 'rate_limited'
+            elif response.ok:
+                outcome = 'success'
+        finally:
+            controller.release(started, outcome, latency)
+
+        if response.status_code == 429:
+            # バッチ単位で隔離 (全件を待機キューへ)
+            wait_seconds = get_rate_limit_wait(response, rate_limit_wait_seconds)
+            limiter.block_for(wait_seconds)
+            return failed('Error: Rate Limit (429)', time.time() + wait_seconds)
+
+        response.raise_for_status()
+        data_list = response.json()
+        if not isinstance(data_list, list) or len(data_list) != len(chunk):
+            raise ValueError("Unexpected batch response")
+        return data_list, None
+
+    except (requests.exceptions.RequestException, ValueError) as e:
+        return failed(f'Error: Network/Timeout ({type(e).__name__})')
+
+def get_domain_details(domain):
+    icann_link = f"[ICANN Whois (手動検索)]({RIR_LINKS['ICANN Whois']})"
+    return {
+        'Target_IP': domain, 'ISP': 'Domain/Host', 'Country': 'N/A', 'CountryCode': 'N/A',
+        'RIR_Link': icann_link,
+        'Secondary_Security_Links': create_secondary_links(domain),
+        'Status': 'Success (Domain)'
+    }
+
+# 🆕 ドメインのDNS解決 (A/AAAA)
+# リゾルバは domain -> (アドレスのリスト, TTL秒 or None) の関数で、既定はOSの getaddrinfo。
+# テスト時はスタブ関数 (またはローカルのスタブDNSを向いたリゾルバ) を渡せる
+def system_resolver(domain):
+    addresses = []
+    for family, _, _, _, sockaddr in socket.getaddrinfo(domain, None, type=socket.SOCK_STREAM):
+        if family not in (socket.AF_INET, socket.AF_INET6):
+            continue
+        address = sockaddr[0].split('%', 1)[0] # IPv6のスコープIDは除く
+        if address not in addresses:
+            addresses.append(address)
+    # getaddrinfo はTTLを返さないため、保持期間は DNS_CACHE_TTL_SECONDS に従う
+    return addresses, None
+
+# 一時的な失敗 (EAI_AGAIN) は否定キャッシュしない
+DNS_TEMPORARY_ERRNOS = {getattr(socket, 'EAI_AGAIN', None)} - {None}
+DNS_NOT_FOUND_ERRNOS = {getattr(socket, name) for name in ('EAI_NONAME', 'EAI_NODATA') if hasattr(socket, name)}
+
+# 🆕 並列DNSリゾルバ (スレッドプール + TTLキャッシュ)
+# submit() は Future を返し、結果は (アドレスのリスト, エラー文字列 or None)。
+# 応答のTTL (不明なら DNS_CACHE_TTL_SECONDS) の間は同じドメインを再解決せず、失敗も短時間キャッシュする。
+# getaddrinfo 等は途中で打ち切れないため、呼び出し側がタイムアウトで見切った解決も完了まではスレッドを占有する。
+# そのため投入は has_capacity() が真の間だけ行い、待ち行列に積んだまま時間切れになる解決を作らない
+class DnsResolver:
+    def __init__(self, resolver=system_resolver, max_workers=DNS_RESOLVE_MAX_WORKERS, timeout=DNS_RESOLVE_TIMEOUT_SECONDS,
+                 ttl_seconds=DNS_CACHE_TTL_SECONDS, negative_ttl_seconds=DNS_NEGATIVE_CACHE_TTL_SECONDS,
+                 max_entries=DNS_CACHE_MAX_ENTRIES):
+        self.resolver = resolver
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict() # domain -> (addresses, error, expires_at)
+        self._outstanding = 0 # 投入済みで未完了の解決数 (タイムアウト扱い済みで実行中のものを含む)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dns-resolve")
+
+    # キャッシュのみを引く (期限切れ・未登録なら None)
+    def cached(self, domain):
+        with self._lock:
+            entry = self._cache.get(domain)
+            if entry is not None and entry[2] > time.time():
+                self._cache.move_to_end(domain)
+                self.hits += 1
+                return entry[0], entry[1]
+            self.misses += 1
+            return None
+
+    def _store(self, domain, addresses, error, ttl):
+        with self._lock:
+            self._cache[domain] = (addresses, error, time.time() + ttl)
+            self._cache.move_to_end(domain)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def resolve(self, domain):
+        cached = self.cached(domain)
+        if cached is not None:
+            return cached
+        try:
+            addresses, ttl = self.resolver(domain)
+        except socket.gaierror as e:
+            error = 'NXDOMAIN' if e.errno in DNS_NOT_FOUND_ERRNOS else f'{type(e).__name__} ({e.errno})'
+            if e.errno not in DNS_TEMPORARY_ERRNOS:
+                self._store(domain, [], error, self.negative_ttl_seconds)
+            return [], error
+        except (OSError, UnicodeError) as e:
+            return [], type(e).__name__
+
+        addresses = self._accept(addresses)
+        if not addresses:
+            self._store(domain, [], self.EMPTY_ERROR, self.negative_ttl_seconds)
+            return [], self.EMPTY_ERROR
+        self._store(domain, addresses, None, self.ttl_seconds if ttl is None else max(0, ttl))
+        return addresses, None
+
+    EMPTY_ERROR = 'No A/AAAA'
+
+    def _accept(self, answers):
+        return [a for a in answers if is_valid_ip(a)]
+
+    def submit(self, domain):
+        with self._lock:
+            self._outstanding += 1
+        future = self._executor.submit(self.resolve, domain)
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self._outstanding -= 1
+
+    # スレッドに空きがあるか (見切った後も実行中の解決は、終わるまで枠を使っているものとして数える)
+    def has_capacity(self):
+        with self._lock:
+            return self._outstanding < self.max_workers
+
+    @property
+    def outstanding(self):
+        with self._lock:
+            return self._outstanding
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats_text(self):
+        return format_cache_stats(len(self._cache), self.hits, self.misses)
+
+# 全スレッド・全セッションで共有する (キャッシュもプロセス内で共有)
+dns_resolver = DnsResolver()
+
+# 🆕 逆引き (PTR)。IP -> (ホスト名のリスト, TTL秒 or None)。PTRが無ければ空リスト
+def system_ptr_resolver(ip):
+    try:
+        hostname, aliases, _ = socket.gethostbyaddr(ip)
+    except socket.herror as e:
+        if e.errno == 2: # TRY_AGAIN (一時的な失敗) はキャッシュしない
+            raise
+        return [], None
+    return [hostname] + [a for a in aliases if a != hostname], None
+
+# 🆕 並列PTRリゾルバ: DnsResolver と同じスレッドプール + TTLキャッシュ (否定応答を含む) を使う
+class PtrResolver(DnsResolver):
+    EMPTY_ERROR = 'No PTR'
+
+    def __init__(self, resolver=system_ptr_resolver, max_workers=PTR_MAX_WORKERS, timeout=PTR_TIMEOUT_SECONDS,
+                 ttl_seconds=PTR_CACHE_TTL_SECONDS, negative_ttl_seconds=PTR_NEGATIVE_CACHE_TTL_SECONDS,
+                 max_entries=DNS_CACHE_MAX_ENTRIES):
+        super().__init__(resolver, max_workers, timeout, ttl_seconds, negative_ttl_seconds, max_entries)
+
+    def _accept(self, answers):
+        return [a.rstrip('.') for a in answers if a]
+
+ptr_resolver = PtrResolver()
+
+# 🆕 PTRホスト名からのホスティング判定 (ISP名では一般回線に見えるVPS・クラウド等の補足)
+# キーワードはホスト名の語 (ドット・ハイフン・数字で区切った英字の並び) 単位で一致させる。
+# 部分文字列で一致させると colo -> colorado, server -> observer, compute -> computer 等の一般回線を誤判定する
+PTR_HOSTING_KEYWORDS = [
+    "vps", "server", "hosting", "hosted", "dedicated", "colo", "datacenter", "cloud", "compute",
+    "amazonaws.com", "googleusercontent.com", "linode", "vultr", "hetzner", "your-server.de",
+    "ovh", "contabo", "digitalocean", "leaseweb", "choopa", "m247",
+    "sakura.ne.jp", "xserver", "conoha", "kagoya",
+]
+PTR_HOSTING_PATTERN = re.compile(
+    "(?<![a-z])(?:" + "|".join(re.escape(kw) for kw in PTR_HOSTING_KEYWORDS) + ")(?![a-z])"
+)
+
+@lru_cache(maxsize=65536)
+def classify_ptr_hostname(hostname):
+    if hostname and PTR_HOSTING_PATTERN.search(hostname.lower()):
+        return "Hosting/DataCenter (PTR)"
+    return "Standard Connection"
+
+# 逆引き結果を結果行に反映する。classify なら、ISP名では一般回線と判定された行だけをPTRで再判定する
+def apply_ptr_result(res, hostnames, error, classify=False):
+    if hostnames:
+        res['PTR'] = hostnames[0]
+    else:
+        res['PTR'] = '' if error in (None, PtrResolver.EMPTY_ERROR) else f'N/A ({error})'
+    if classify and hostnames and not res.get('Proxy_Type'):
+        ptr_type = classify_ptr_hostname(hostnames[0])
+        if ptr_type != "Standard Connection":
+            res['Proxy_Type'] = ptr_type
+    return res
+
+# DNS解決の結果をドメイン行に反映する (解決できなければエラー行にする)
+def build_domain_result(domain, addresses, error):
+    result = get_domain_details(domain)
+    result['Resolved_IPs'] = ', '.join(addresses)
+    if error:
+        result['Status'] = f'Error: DNS ({error})'
+    return result
+
+def get_simple_mode_details(target):
+    if is_valid_ip(target):
+        rir_link_content = f"[Whois (汎用検索 - APNIC窓口)]({RIR_LINKS['APNIC']})"
+    else:
+        rir_link_content = f"[ICANN Whois (手動検索)]({RIR_LINKS['ICANN Whois']})"
+        
+    return {
+        'Target_IP': target, 
+        'ISP': 'N/A (簡易モード)', 
+        'Country': 'N/A (簡易モード)',
+        'CountryCode': 'N/A',
+        'RIR_Link': rir_link_content,
+        'Secondary_Security_Links': create_secondary_links(target),
+        'Status': 'Success (簡易モード)' 
+    }
+
+# --- ヘルパー関数群 ---
+
+def group_results_by_isp(results):
+    final_grouped_results = []
+    non_aggregated_results = []
+    # 成功/それ以外の振り分けは1回の走査で済ませる
+    is_success = [res['Status'].startswith('Success') for res in results]
+    successful_results = list(compress(results, is_success))
+
+    if successful_results:
+        # 🆕 IPv4をuint32配列へ一括変換し、(ISP, CountryCode, IPバージョン) ごとにpandasでまとめる
+        isp_names = np.array([res['ISP'] for res in successful_results], dtype=object)
+        country_names = np.array([res['Country'] for res in successful_results], dtype=object)
+        country_codes = np.array([res.get('CountryCode', 'N/A') for res in successful_results], dtype=object)
+        ip_ints, is_v4 = ipv4_strings_to_uint32([res['Target_IP'] for res in successful_results])
+
+        # 🆕 IPv6は128bit整数としてPython側で保持する
+        ipv6_ints = {}
+        for row in np.flatnonzero(~is_v4):
+            target = successful_results[row]['Target_IP']
+            if ':' in target:
+                try:
+                    ipv6_ints[row] = int(ipaddress.IPv6Address(target))
+                except ValueError:
+                    pass
+        is_v6 = np.zeros(len(successful_results), dtype=bool)
+        is_v6[list(ipv6_ints)] = True
+
+        is_groupable = (is_v4 | is_v6) & (isp_names != 'N/A') & (isp_names != 'N/A (簡易モード)') & (country_names != 'N/A')
+        is_int_failed = is_groupable & is_v4 & (ip_ints == 0)
+        is_groupable &= ~is_int_failed
+
+        for row in np.flatnonzero(~is_groupable):
+            res = successful_results[row]
+            if is_int_failed[row]:
+                res['Status'] = 'Error: IPv4 Int Conversion Failed'
+            non_aggregated_results.append(res)
+
+        if is_groupable.any():
+            grouped_df = pd.DataFrame({
+                'ISP': isp_names[is_groupable],
+                'CountryCode': country_codes[is_groupable],
+                'Version': np.where(is_v4[is_groupable], 4, 6),
+                'Row': np.flatnonzero(is_groupable),
+            })
+            # sort=False: グループは初出順 (従来のdict挿入順と同じ)
+            group_rows = grouped_df.groupby(['ISP', 'CountryCode', 'Version'], sort=False, dropna=False)['Row']
+            # 🆕 IPv4のグループは連続範囲・件数を全グループまとめてNumPyで求める (CIDR文字列は表示・書き出し時に整形)
+            is_v4_row = grouped_df['Version'].to_numpy() == 4
+            v4_summaries = {}
+            if is_v4_row.any():
+                # groupby の通し番号のうちIPv4のものを 0 始まりの連番に詰め直して渡す
+                v4_numbers, v4_group_ids = np.unique(group_rows.ngroup().to_numpy()[is_v4_row], return_inverse=True)
+                v4_rows = grouped_df['Row'].to_numpy()[is_v4_row]
+                v4_summaries = dict(zip(v4_numbers.tolist(), summarize_ipv4_groups(v4_group_ids, ip_ints[v4_rows])))
+
+            for group_number, ((_, _, version), rows) in enumerate(group_rows):
+                rows = rows.to_numpy()
+                data = successful_results[rows[0]]
+                count = len(rows)
+                if version == 4:
+                    min_int, max_int, summary = v4_summaries[group_number]
+                    min_ip = uint32_to_ipv4_string(min_int)
+                    max_ip = uint32_to_ipv4_string(max_int)
+                else:
+                    group_ints = [ipv6_ints[row] for row in rows]
+                    min_ip = int_to_ip_string(min(group_ints), 6)
+                    max_ip = int_to_ip_string(max(group_ints), 6)
+                    summary = summarize_ip_ints(group_ints, version)
+
+                target_ip_display = min_ip if count == 1 else f"{min_ip} - {max_ip} (x{count} IPs)"
+                status_display = data['Status'] if count == 1 else f"Aggregated ({count} IPs)"
+
+                final_grouped_results.append({
+                    'Target_IP': target_ip_display, 
+                    'Country': data['Country'], 
+                    'Country_JP': data.get('Country_JP', 'N/A'), 
+                    'CountryCode': data.get('CountryCode', 'N/A'),
+                    'ISP': data['ISP'],
+                    'ISP_JP': data.get('ISP_JP', 'N/A'), 
+                    'RIR_Link': data['RIR_Link'], 
+                    'Secondary_Security_Links': data['Secondary_Security_Links'],
+                    'Status': status_display,
+                    # 🆕 FWルールにそのまま貼れる最小CIDR集合 / 連続範囲 / 範囲内の充填率
+                    'CIDR_Summary': summary['cidr_text'],
+                    'Range_Summary': summary['range_text'],
+                    'Density': round(summary['density'], 4),
+                })
+
+    non_aggregated_results.extend(compress(results, [not success for success in is_success]))
+    final_grouped_results.extend(non_aggregated_results)
+
+    return final_grouped_results
+
+# --- 🆕 差分集計 (リアルタイム集計用) ---
+class IncrementalResultAggregator:
+    """
+    検索結果を到着順に1件ずつ取り込み、ISP/国/国コード/ターゲット頻度のカウンタを差分更新する。
+    sync() は前回以降に追加された結果だけを処理するため、集計コストは結果件数に比例して増えない。
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self, raw_results=None, target_frequency=None):
+        self.isp_counts = Counter()
+        self.country_counts = Counter()
+        self.country_code_counts = Counter()
+        self.frequency_counts = {}
+        self.target_frequency = target_frequency if target_frequency is not None else {}
+        self._source = raw_results
+        self._consumed = 0
+        self.version = 0
+
+    def add(self, res):
+        target = res.get('Target_IP')
+        if target in self.target_frequency and target not in self.frequency_counts:
+            self.frequency_counts[target] = self.target_frequency[target]
+
+        # ISP/国の集計対象は成功したIPv4のみ (従来の集計条件と同じ)
+        if res.get('Status', '').startswith('Success') and is_ipv4(target):
+            frequency = self.target_frequency.get(target, 1)
+            isp_name = res.get('ISP_JP', res.get('ISP', 'N/A'))
+            country_name = res.get('Country_JP', res.get('Country', 'N/A'))
+            cc = res.get('CountryCode', 'N/A')
+
+            if isp_name and isp_name not in ['N/A', 'N/A (簡易モード)']:
+                self.isp_counts[isp_name] += frequency
+            if country_name and country_name != 'N/A':
+                self.country_counts[country_name] += frequency
+            if cc and cc != 'N/A':
+                self.country_code_counts[cc] += frequency
+        self.version += 1
+
+    def sync(self, raw_results, target_frequency=None):
+        # 結果リストや頻度表が差し替えられた (新規検索・簡易モードの一括代入) 場合のみ作り直す
+        if target_frequency is None:
+            target_frequency = self.target_frequency
+        if raw_results is not self._source or target_frequency is not self.target_frequency or len(raw_results) < self._consumed:
+            self.reset(raw_results, target_frequency)
+        for i in range(self._consumed, len(raw_results)):
+            self.add(raw_results[i])
+        self._consumed = len(raw_results)
+        return self
+
+    def _counter(self, kind):
+        return {
+            'isp': self.isp_counts,
+            'country': self.country_counts,
+            'country_code': self.country_code_counts,
+            'frequency': self.frequency_counts,
+        }[kind]
+
+    def top(self, kind, n=10):
+        return heapq.nlargest(n, self._counter(kind).items(), key=itemgetter(1))
+
+    def table(self, kind):
+        return sorted(self._counter(kind).items(), key=itemgetter(1), reverse=True)
+
+# --- 🆕 アップロード表ファイル (CSV/Excel) のストリーミング読み込み ---
+# 巨大ファイルでも全体をDataFrameにせず、一定行数ずつ読んでIP列と行番号だけを保持する
+UPLOAD_CHUNK_ROWS = 50000
+UPLOAD_PREVIEW_ROWS = 100
+RESULT_COLUMNS = ['ISP', 'ISP_JP', 'Country', 'Country_JP', 'Proxy Type', 'PTR', 'Status']
+# 逆引きを行った場合だけ追加する列
+RESULT_OPTIONAL_COLUMNS = {'PTR'}
+# 結合列名 -> (結果dictのキー, 未検索/欠損時の既定値)
+RESULT_COLUMN_SOURCES = {
+    'ISP': ('ISP', 'N/A'),
+    'ISP_JP': ('ISP_JP', 'N/A'),
+    'Country': ('Country', 'N/A'),
+    'Country_JP': ('Country_JP', 'N/A'),
+    'Proxy Type': ('Proxy_Type', ''),
+    'PTR': ('PTR', ''),
+    'Status': ('Status', 'N/A'),
+}
+
+# 先頭10件 (欠損除く) に有効なIPを含む最初の列をIP列とみなす
+def detect_ip_column(df):
+    for col in df.columns:
+        sample = df[col].dropna().head(10).astype(str)
+        if any(is_valid_ip(val.strip()) for val in sample):
+            return col
+    return None
+
+class StreamedUploadTable:
+    """
+    CSV/XLSX を UPLOAD_CHUNK_ROWS 行ずつ読み込むアップロード表。
+    scan() 後はIP列の値とその行番号だけをメモリに持ち、元の全列が必要な時 (結合エクスポート) は
+    iter_chunks() でファイルを先頭から読み直す。source は seek 可能なファイルオブジェクトまたはパス。
+    """
+    def __init__(self, source, name, chunk_rows=UPLOAD_CHUNK_ROWS):
+        self.source = source
+        self.name = name
+        self.chunk_rows = chunk_rows
+        self.columns = []
+        self.ip_column = None
+        self.row_count = 0
+        self.ip_values = []
+        self.ip_row_offsets = np.empty(0, dtype=np.int64)
+        self.preview = None
+
+    def _rewind(self):
+        if hasattr(self.source, 'seek'):
+            self.source.seek(0)
+
+    def _iter_raw_chunks(self):
+        self._rewind()
+        lower_name = self.name.lower()
+        if lower_name.endswith('.csv'):
+            yield from pd.read_csv(self.source, chunksize=self.chunk_rows)
+        elif lower_name.endswith('.xls'):
+            # 旧形式 (.xls) は openpyxl の read-only モードで読めないため一括読み込み
+            yield pd.read_excel(self.source)
+        else:
+            workbook = load_workbook(self.source, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    return
+                columns = [c if c is not None else f"Unnamed: {i}" for i, c in enumerate(header)]
+                width = len(columns)
+                chunk = []
+                for row in rows:
+                    chunk.append(row[:width] + (None,) * (width - len(row)))
+                    if len(chunk) >= self.chunk_rows:
+                        yield pd.DataFrame(chunk, columns=columns)
+                        chunk = []
+                if chunk:
+                    yield pd.DataFrame(chunk, columns=columns)
+            finally:
+                workbook.close()
+
+    def iter_chunks(self):
+        # 行番号 (index) はファイル全体での通し番号にそろえる
+        offset = 0
+        for chunk in self._iter_raw_chunks():
+            chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+            offset += len(chunk)
+            yield chunk
+
+    def scan(self):
+        # IP列は最初のチャンクから判定する (判定できなければ以降は読まない)
+        ip_values, row_offsets = [], []
+        self.row_count = 0
+        for chunk in self.iter_chunks():
+            if self.preview is None:
+                self.columns = list(chunk.columns)
+                self.preview = chunk.head(UPLOAD_PREVIEW_ROWS)
+                self.ip_column = detect_ip_column(chunk)
+                if self.ip_column is None:
+                    break
+            ip_series = chunk[self.ip_column].dropna()
+            ip_values.extend(ip_series.astype(str).tolist())
+            row_offsets.append(ip_series.index.to_numpy(dtype=np.int64))
+            self.row_count += len(chunk)
+        self.ip_values = ip_values
+        if row_offsets:
+            self.ip_row_offsets = np.concatenate(row_offsets)
+        return self
+
+    def iter_merged_chunks(self, results_table):
+        for chunk in self.iter_chunks():
+            yield merge_results_into_frame(chunk, self.ip_column, results_table)
+
+    def write_merged_csv(self, results_table, path):
+        # 結合済みデータをチャンク単位でCSVへ書き出す (メモリ使用量はチャンク1つ分)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8-sig", newline="") as f:
+            for i, chunk in enumerate(self.iter_merged_chunks(results_table)):
+                chunk.to_csv(f, index=False, header=(i == 0))
+        os.replace(tmp_path, path)
+        return path
+
+# 🆕 検索結果を Target_IP をキーにした結合用テーブル (カテゴリ型) にする
+# 最終行は未検索IP用の既定値行。結果が空なら None (結合列を追加しない)
+def build_results_table(results):
+    if not results:
+        return None
+    res_dict = {r['Target_IP']: r for r in results}
+    columns = {
+        col: pd.Categorical([r.get(key, default) for r in res_dict.values()] + [default])
+        for col, (key, default) in RESULT_COLUMN_SOURCES.items()
+        if col not in RESULT_OPTIONAL_COLUMNS or any(key in r for r in res_dict.values())
+    }
+    return pd.DataFrame(columns, index=pd.Index(list(res_dict) + [None], dtype=object))
+
+# 結合用テーブルを元データのIP列の右側にキー結合する (行ループなし)
+def merge_results_into_frame(df, ip_col, results_table):
+    if results_table is None:
+        return df
+    keys = df[ip_col].astype(str).str.strip()
+    positions = results_table.index.get_indexer(keys)
+    positions[positions < 0] = len(results_table) - 1
+    merged = results_table.iloc[positions]
+
+    insert_idx = df.columns.get_loc(ip_col) + 1
+    for col in reversed([c for c in RESULT_COLUMNS if c in results_table.columns]):
+        df.insert(insert_idx, col, merged[col].array)
+    return df
+
+# --- 入力正規化 ---
+OCR_ERROR_CHARS = frozenset('Iil|OoSsAaBⅡ')
+INVALID_IP_CHARS = frozenset('ghijklmnopqrstuvwxyz')
+
+# 入力1行を検索ターゲットへ正規化する (OCR誤読補正・ドメイン判定)
+# cleaned_t には呼び出し側で計算済みの clean_ocr_error_chars(t) を渡せる (二重変換の回避)
+def normalize_target(t, cleaned_t=None):
+    if cleaned_t is None:
+        cleaned_t = clean_ocr_error_chars(t)
+    is_ocr_error_likely = not OCR_ERROR_CHARS.isdisjoint(t)
+    if is_ocr_error_likely and is_valid_ip(cleaned_t):
+        return cleaned_t
+
+    has_hyphen = '-' in t
+    has_strictly_domain_char = not INVALID_IP_CHARS.isdisjoint(t.lower())
+    is_likely_domain_or_host = has_hyphen or has_strictly_domain_char
+
+    if is_valid_ip(t):
+        return t
+    elif is_likely_domain_or_host:
+        return t
+    else:
+        return cleaned_t
+
+# 🆕 入力行をまとめて正規化し、(targets, target_freq_map, cleaned_list) を返す
+# 同じ行は1回だけ補正・判定するため、重複の多いログでも行数に対して線形時間で終わる
+def ingest_targets(lines):
+    lines = lines if isinstance(lines, list) else list(lines)
+    line_counts = Counter(lines)  # 入力順を保持した重複除去 + 出現回数
+
+    cleaned_by_line = {}
+    targets_seen = {}
+    target_freq_map = Counter()
+    for line, count in line_counts.items():
+        cleaned = clean_ocr_error_chars(line)
+        cleaned_by_line[line] = cleaned
+        target_freq_map[cleaned] += count
+        targets_seen.setdefault(normalize_target(line, cleaned), None)
+
+    cleaned_list = [cleaned_by_line[line] for line in lines]
+    return list(targets_seen), dict(target_freq_map), cleaned_list
+
+# 行のイテレータから重複なしのターゲットを逐次返す (巨大ファイル/stdinのストリーム処理用)
+def iter_unique_targets(lines):
+    seen = set()
+    for line in lines:
+        target = normalize_target(line.rstrip('\r\n'))
+        if target not in seen:
+            seen.add(target)
+            yield target
+
+# --- 🆕 検索ジョブのチェックポイント (中断・再起動後の再開用) ---
+# ジョブごとに JOBS_DIR/<job_id>/ を作り、次のファイルに進捗を保存する
+#   job.json      : メタデータ (状態・設定・隔離中IPと再試行時刻)。一時ファイル経由で置き換える
+#   targets.txt   : 検索ターゲット (重複なし・入力順)。作成時に1度だけ書く
+#   inputs.txt    : 補正後の全入力行 (出現回数・全入力データ順の出力用)。作成時に1度だけ書く
+#   results.jsonl : 完了した結果の追記ログ。書きかけの最終行は読み込み時に無視する
+JOB_ID_PATTERN = re.compile(r'^[0-9A-Za-z_-]{1,64}$')
+
+class SearchJobCheckpoint:
+    def __init__(self, job_id, jobs_dir=JOBS_DIR):
+        if not JOB_ID_PATTERN.match(job_id or ''):
+            raise ValueError(f"Invalid job ID: {job_id!r}")
+        self.job_id = job_id
+        self.job_dir = os.path.join(jobs_dir, job_id)
+        self.meta_path = os.path.join(self.job_dir, "job.json")
+        self.targets_path = os.path.join(self.job_dir, "targets.txt")
+        self.inputs_path = os.path.join(self.job_dir, "inputs.txt")
+        self.results_path = os.path.join(self.job_dir, "results.jsonl")
+        self.meta = {}
+        self._tail_checked = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, targets, input_list=None, settings=None, jobs_dir=JOBS_DIR):
+        job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.urandom(3).hex()}"
+        job = cls(job_id, jobs_dir)
+        os.makedirs(job.job_dir, exist_ok=True)
+        job._write_lines(job.targets_path, targets)
+        job._write_lines(job.inputs_path, input_list if input_list is not None else targets)
+        open(job.results_path, "a", encoding="utf-8").close()
+        now = time.time()
+        job.meta = {
+            'job_id': job_id, 'status': 'running', 'created_at': now, 'updated_at': now,
+            'target_count': len(targets), 'finished_count': 0,
+            'settings': settings or {}, 'deferred': {},
+        }
+        job._write_meta()
+        return job
+
+    @classmethod
+    def load(cls, job_id, jobs_dir=JOBS_DIR):
+        job = cls(job_id, jobs_dir)
+        try:
+            with open(job.meta_path, encoding="utf-8") as f:
+                job.meta = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Job not found: {job_id}") from None
+        return job
+
+    def _write_lines(self, path, lines):
+        with open(path, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(f"{line}\n")
+
+    def _read_lines(self, path):
+        with open(path, encoding="utf-8") as f:
+            return [line.rstrip("\n") for line in f]
+
+    def _write_meta(self):
+        write_text_atomic(self.meta_path, json.dumps(self.meta, ensure_ascii=False))
+
+    @property
+    def status(self):
+        return self.meta.get('status')
+
+    @property
+    def settings(self):
+        return self.meta.get('settings', {})
+
+    def read_targets(self):
+        return self._read_lines(self.targets_path)
+
+    def read_input_list(self):
+        return self._read_lines(self.inputs_path)
+
+    # 完了済み結果を読み込む (同じターゲットが複数回あれば最後の行を採用)
+    def read_results(self):
+        results = {}
+        try:
+            with open(self.results_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        res = json.loads(line)
+                    except ValueError:
+                        continue # 書き込み中に中断された行
+                    results[res['Target_IP']] = res
+        except FileNotFoundError:
+            pass
+        return list(results.values())
+
+    def read_deferred(self):
+        return {ip: float(defer_until) for ip, defer_until in self.meta.get('deferred', {}).items()}
+
+    def append_results(self, results):
+        if not results:
+            return
+        lines = "".join(json.dumps(res, ensure_ascii=False, default=str) + "\n" for res in results)
+        with self._lock:
+            # 前回のプロセスが行の途中で止まっていた場合は改行してから追記する
+            if not self._tail_checked:
+                self._tail_checked = True
+                with open(self.results_path, "ab+") as f:
+                    if f.seek(0, os.SEEK_END) > 0:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            f.write(b"\n")
+            with open(self.results_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def update(self, deferred_ips=None, finished_count=None, status=None):
+        with self._lock:
+            if deferred_ips is not None:
+                self.meta['deferred'] = dict(deferred_ips)
+            if finished_count is not None:
+                self.meta['finished_count'] = finished_count
+            if status is not None:
+                self.meta['status'] = status
+            self.meta['updated_at'] = time.time()
+            self._write_meta()
+
+    def summary_text(self):
+        updated = time.strftime('%Y-%m-%d %H:%M', time.localtime(self.meta.get('updated_at', 0)))
+        return f"{self.job_id} ({self.meta.get('finished_count', 0)}/{self.meta.get('target_count', 0)} 件, {self.status}, {updated})"
+
+# 新しい順にジョブを返す (壊れたメタデータは無視する)
+def list_search_jobs(jobs_dir=JOBS_DIR, statuses=None, limit=20):
+    jobs = []
+    try:
+        job_ids = os.listdir(jobs_dir)
+    except FileNotFoundError:
+        return jobs
+    for job_id in job_ids:
+        try:
+            job = SearchJobCheckpoint.load(job_id, jobs_dir)
+        except (OSError, ValueError):
+            continue
+        if statuses is None or job.status in statuses:
+            jobs.append(job)
+    jobs.sort(key=lambda job: job.meta.get('updated_at', 0), reverse=True)
+    return jobs[:limit]
+
+# --- ストリーミング照会パイプライン (CLI等のヘッドレス実行用) ---
+# targets を順に読み込みながら照会し、完了した結果dictを逐次 yield する。
+# 429で隔離されたIPは Defer_Until まで待ってから再投入するため、呼び出し側は再試行を意識しなくてよい。
+# deferred_ips ({ip: 再試行時刻}) を渡すと、その辞書を隔離キューとして使う (再開時の引き継ぎ・進捗表示用)。
+# cancel_event がセットされると、実行中のリクエストの完了を待って終了する。
+# failover=True なら ProviderRouter 経由で照会し、429・タイムアウト時は他のデータソースへ切り替える
+# (バッチモードで429・タイムアウトになったIPも、ip-api 以外のソースで1件ずつ再照会してから隔離する)。
+def iter_lookup_results(targets, cidr_cache, tor_nodes, mode_settings, use_rdap=False, api_key=None,
+                        rate_limit_wait_seconds=RATE_LIMIT_WAIT_SECONDS, simple_mode=False,
+                        deferred_ips=None, cancel_event=None, on_deferred=None, failover=False, hedge=False,
+                        offline_db=None, offline_only=False, resolver=None, known_ips=None, on_resolved=None,
+                        resolved_domains=None, ptr_resolver=None, ptr_time_budget=None, ptr_classify=False):
+    # Proモード (ipinfo) はバッチAPIを使わず、ipinfo 用の並列数で1件ずつ照会する
+    batch_size = 1 if api_key else mode_settings.get("BATCH_SIZE", 1)
+    # 🆕 同時に投入する照会数は、主に使うプロバイダの適応制御の現在の並列数に合わせる (スレッドは最大並列数分)
+    controller = concurrency_controllers[primary_provider(batch_size, api_key)]
+    max_workers = controller.max_workers
+    # 先読みは実行中ワーカー分 + 1巡分に留め、入力全体をメモリに載せない
+    max_pending = batch_size * max_workers * 2
+
+    # オフラインDBがあれば先に引き、オンラインAPIへは未収録分だけを回す
+    if offline_db is not None and not simple_mode:
+        targets = iter_offline_resolved(targets, offline_db, tor_nodes, offline_only)
+    target_iter = iter(targets)
+    exhausted = False
+    pending_ips = []
+    reroute_ips = []
+    deferred_ips = deferred_ips if deferred_ips is not None else {}
+    router = ProviderRouter(cidr_cache, tor_nodes, rate_limit_wait_seconds, use_rdap, api_key, hedge) if failover else None
+    # 🆕 ドメイン -> IP の展開: resolver (DnsResolver) を渡すとドメインを解決し、得られたIPも照会する。
+    # 同じIPを二重に照会しないよう、照会済み・照会予定のIPを queued_ips で管理する (known_ips は再開前の完了分)。
+    # resolved_domains ({ドメイン: [IP, ...]}) は再開前に解決済みのドメインで、解決し直さずにそのIPを照会キューへ戻す
+    resolve_domains = resolver is not None and not simple_mode
+    dns_in_flight = {} # future -> (domain, 解決開始時刻)
+    queued_ips = set(known_ips or ()).union(deferred_ips) if resolve_domains else None
+    # 解決の投入はリゾルバのスレッドに空きがある間だけ行い、待ち行列での待機をタイムアウトに数えない
+    # (タイムアウトで見切った解決も終わるまでは空きに数えない: DnsResolver.has_capacity)
+    resolved_from = {} # 解決で追加したIP -> [ドメイン, ...]
+
+    # 🆕 バッチモードでは照会待ちに入れる前にCIDRキャッシュを引き、ヒットしたIPの結果はその場で返す。
+    # 照会待ちには未キャッシュのIPだけが並ぶため、1回のPOSTに未キャッシュIPを最大 batch_size 件載せられる
+    def queue_ips(ips):
+        if batch_size == 1:
+            pending_ips.extend(ips)
+            return []
+        hits = []
+        for ip in ips:
+            cached_result = get_cached_ip_details(ip, cidr_cache, tor_nodes)
+            if cached_result:
+                hits.append(cached_result)
+            else:
+                pending_ips.append(ip)
+        return hits
+
+    def queue_resolved_ips(domain, addresses):
+        new_ips = []
+        for address in addresses:
+            resolved_from.setdefault(address, []).append(domain)
+            if address not in queued_ips:
+                queued_ips.add(address)
+                new_ips.append(address)
+        if new_ips and on_resolved is not None:
+            on_resolved(len(new_ips))
+        if offline_db is None:
+            return queue_ips(new_ips)
+        # オフラインDBがあれば解決したIPも先に引く
+        hits = []
+        unresolved = []
+        for item in iter_offline_resolved(new_ips, offline_db, tor_nodes, offline_only):
+            if isinstance(item, dict):
+                hits.append(item)
+            else:
+                unresolved.append(item)
+        return hits + queue_ips(unresolved)
+
+    def with_linkage(res):
+        domains = resolved_from.pop(res['Target_IP'], None) if resolved_from else None
+        if domains:
+            res['Resolved_From'] = ', '.join(domains)
+        return res
+
+    # 🆕 逆引き (PTR): ptr_resolver (PtrResolver) を渡すと、IPの結果を逆引きしてから返す (PTR列)。
+    # 逆引きは開始から ptr_time_budget 秒 (Noneなら無制限) の間だけ行い、超過後はキャッシュにある分だけを反映する
+    enrich_ptr = ptr_resolver is not None and not simple_mode
+    ptr_queue = deque()
+    ptr_in_flight = {} # future -> (結果, 逆引き開始時刻)
+    ptr_deadline = time.monotonic() + ptr_time_budget if enrich_ptr and ptr_time_budget else None
+    ptr_queue_limit = ptr_resolver.max_workers * PTR_QUEUE_PER_WORKER if enrich_ptr else 1
+
+    def finish(res):
+        res = with_linkage(res)
+        if not enrich_ptr or not is_valid_ip(res['Target_IP']):
+            return [res]
+        ptr_queue.append(res)
+        return []
+
+    # 完了・タイムアウトした逆引きを反映して返し、空いた枠に次を投入する。
+    # 予算切れ (または中止時の force) なら待たずに全件を返す
+    def drain_ptr(force=False):
+        ready = []
+        budget_left = not force and (ptr_deadline is None or time.monotonic() < ptr_deadline)
+        reason = 'Cancelled' if force else 'Budget'
+        for f, (res, started) in list(ptr_in_flight.items()):
+            if f.done():
+                del ptr_in_flight[f]
+                ready.append(apply_ptr_result(res, *f.result(), classify=ptr_classify))
+            elif not budget_left or time.monotonic() - started > ptr_resolver.timeout:
+                del ptr_in_flight[f]
+                ready.append(apply_ptr_result(res, [], 'Timeout' if budget_left else reason, classify=ptr_classify))
+        while ptr_queue and (not budget_left or ptr_resolver.has_capacity()):
+            res = ptr_queue.popleft()
+            if budget_left:
+                ptr_in_flight[ptr_resolver.submit(res['Target_IP'])] = (res, time.monotonic())
+            else:
+                hostnames, error = ptr_resolver.cached(res['Target_IP']) or ([], reason)
+                ready.append(apply_ptr_result(res, hostnames, error, classify=ptr_classify))
+        return ready
+
+    try:
+        if resolve_domains and resolved_domains:
+            for domain, addresses in resolved_domains.items():
+                for res in queue_resolved_ips(domain, addresses):
+                    yield from finish(res)
+
+        # 🆕 バッチ応答のRDAP補完は、バッチの枠を塞がないよう別のプールで1件ずつ行う
+        with ThreadPoolExecutor(max_workers=max_workers) as executor, \
+                ThreadPoolExecutor(max_workers=concurrency_controllers["rdap"].max_workers) as rdap_executor:
+            in_flight = {} # future -> 'single' またはバッチで送ったIPのリスト
+            rdap_in_flight = set()
+
+            # 完了したバッチPOSTを (result, new_cache_entry) のリストにする (RDAP補完分は rdap_in_flight へ)
+            def batch_results(unit, data_list, failures):
+                if failures is not None:
+                    return failures
+                if not use_rdap:
+                    return [build_ip_api_result(ip, data, tor_nodes, False) for ip, data in zip(unit, data_list)]
+                for ip, data in zip(unit, data_list):
+                    rdap_in_flight.add(rdap_executor.submit(build_ip_api_result, ip, data, tor_nodes, True))
+                return []
+
+            while True:
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                now = time.time()
+                due_ips = [ip for ip, defer_until in deferred_ips.items() if defer_until <= now]
+                for ip in due_ips:
+                    del deferred_ips[ip]
+                for res in queue_ips(due_ips):
+                    yield from finish(res)
+
+                while (not exhausted and len(pending_ips) < max_pending and len(ptr_queue) < ptr_queue_limit
+                       and (not resolve_domains or resolver.has_capacity())):
+                    target = next(target_iter, None)
+                    if target is None:
+                        exhausted = True
+                    elif isinstance(target, dict):
+                        if resolve_domains:
+                            queued_ips.add(target['Target_IP'])
+                        yield from finish(target)
+                    elif simple_mode:
+                        yield get_simple_mode_details(target)
+                    elif is_valid_ip(target):
+                        if resolve_domains:
+                            if target in queued_ips:
+                                continue
+                            queued_ips.add(target)
+                        for res in queue_ips([target]):
+                            yield from finish(res)
+                    elif resolve_domains:
+                        dns_in_flight[resolver.submit(target)] = (target, time.monotonic())
+                    else:
+                        yield get_domain_details(target)
+
+                # DNS解決の完了分・タイムアウト分を処理する (解決したIPは照会キューへ)
+                for f, (domain, started) in list(dns_in_flight.items()):
+                    if f.done():
+                        del dns_in_flight[f]
+                        addresses, error = f.result()
+                        yield build_domain_result(domain, addresses, error)
+                        for res in queue_resolved_ips(domain, addresses):
+                            yield from finish(res)
+                    elif time.monotonic() - started > resolver.timeout:
+                        del dns_in_flight[f]
+                        yield build_domain_result(domain, [], 'Timeout')
+
+                if enrich_ptr:
+                    yield from drain_ptr()
+
+                # バッチで隔離されたIPの切替照会を優先する
+                worker_slots = controller.workers
+                while reroute_ips and len(in_flight) < worker_slots:
+                    in_flight[executor.submit(router.lookup, reroute_ips.pop(0), ("ip-api",))] = 'single'
+
+                while pending_ips and len(in_flight) < worker_slots:
+                    unit = pending_ips[:batch_size]
+                    del pending_ips[:batch_size]
+                    if batch_size > 1:
+                        in_flight[executor.submit(post_ip_api_batch, unit, rate_limit_wait_seconds)] = unit
+                    elif router is not None:
+                        in_flight[executor.submit(router.lookup, unit[0])] = 'single'
+                    else:
+                        future = executor.submit(get_ip_details_from_api, unit[0], cidr_cache, rate_limit_wait_seconds,
+                                                 tor_nodes, use_rdap, api_key)
+                        in_flight[future] = 'single'
+
+                if not in_flight and not rdap_in_flight:
+                    if reroute_ips:
+                        continue
+                    if dns_in_flight or ptr_in_flight:
+                        wait([*dns_in_flight, *ptr_in_flight], timeout=0.2, return_when=FIRST_COMPLETED)
+                        continue
+                    # 逆引き・DNS解決のスレッドがタイムアウトで見切った処理で埋まっている間は、空くまで少し待つ
+                    if ptr_queue:
+                        time.sleep(RESOLVER_BUSY_POLL_SECONDS)
+                        continue
+                    if deferred_ips:
+                        time.sleep(min(5, max(0.1, min(deferred_ips.values()) - time.time())))
+                        continue
+                    if exhausted and not pending_ips:
+                        break
+                    time.sleep(RESOLVER_BUSY_POLL_SECONDS)
+                    continue
+
+                done, _ = wait([*in_flight, *rdap_in_flight, *dns_in_flight, *ptr_in_flight], timeout=0.5,
+                               return_when=FIRST_COMPLETED)
+                newly_deferred = False
+                for f in done:
+                    if f in rdap_in_flight:
+                        rdap_in_flight.discard(f)
+                        is_batch, res_tuples = False, [f.result()]
+                    elif f in in_flight:
+                        unit = in_flight.pop(f)
+                        is_batch = unit != 'single'
+                        res_tuples = batch_results(unit, *f.result()) if is_batch else [f.result()]
+                    else:
+                        continue
+                    for res, new_cache_entry in res_tuples:
+                        if new_cache_entry:
+                            cidr_cache.update(new_cache_entry)
+                        if is_batch and router is not None and is_retryable_result(res):
+                            reroute_ips.append(res['Target_IP'])
+                        elif res.get('Defer_Until') and not res.get('Status', '').startswith('Success'):
+                            deferred_ips[res['Target_IP']] = res['Defer_Until']
+                            newly_deferred = True
+                        else:
+                            yield from finish(res)
+                if newly_deferred and on_deferred is not None:
+                    on_deferred(deferred_ips)
+
+            # 中止時: 照会済みで逆引き待ちの結果も捨てずに返す
+            if enrich_ptr:
+                yield from drain_ptr(force=True)
+    finally:
+        if router is not None:
+            router.close()
+
+# --- 🆕 バックグラウンド検索ジョブ ---
+# 照会キュー・429時の再試行・キャッシュ書き込みを専用スレッドで実行し、UIは進捗を読むだけにする。
+# ジョブはプロセス内の search_job_manager が保持するため、ブラウザの再読み込みや別タブからも同じジョブに接続でき、
+# 複数のジョブを同時に実行できる (レート制御はプロバイダ単位の rate_limiters・concurrency_controllers を全ジョブで共有)。
+JOB_CHECKPOINT_BATCH = 100 # 追記ログへまとめて書き出す件数
+JOB_CHECKPOINT_INTERVAL_SECONDS = 1.0 # 件数に満たなくても書き出す間隔
+SEARCH_JOB_KEEP_FINISHED = 10 # メモリ上に保持する終了済みジョブ数
+
+class BackgroundSearchJob:
+    def __init__(self, checkpoint, cidr_cache, tor_nodes, mode_settings, use_rdap=False, api_key=None,
+                 simple_mode=False, rate_limit_wait_seconds=RATE_LIMIT_WAIT_SECONDS, failover=False, hedge=False,
+                 offline_db=None, offline_only=False, resolve_domains=False,
+                 ptr_enrich=False, ptr_time_budget=None, ptr_classify=False):
+        self.checkpoint = checkpoint
+        self.job_id = checkpoint.job_id
+        self.cidr_cache = cidr_cache
+        self.tor_nodes = tor_nodes
+        self.mode_settings = mode_settings
+        self.use_rdap = use_rdap
+        self.api_key = api_key
+        self.simple_mode = simple_mode
+        self.rate_limit_wait_seconds = rate_limit_wait_seconds
+        self.failover = failover
+        self.hedge = hedge
+        self.offline_db = offline_db
+        self.offline_only = offline_only
+        self.resolve_domains = resolve_domains
+        self.ptr_enrich = ptr_enrich
+        self.ptr_time_budget = ptr_time_budget
+        self.ptr_classify = ptr_classify
+
+        # 再開時はチェックポイントの完了分・隔離分を引き継ぐ
+        self.targets = checkpoint.read_targets()
+        self.results = checkpoint.read_results()
+        self.finished = {res['Target_IP'] for res in self.results}
+        self.deferred_ips = {ip: t for ip, t in checkpoint.read_deferred().items() if ip not in self.finished}
+        self.ip_target_count = sum(1 for t in self.targets if is_valid_ip(t))
+        if resolve_domains:
+            # DNS解決で追加され、再開前に完了したIPも総数に含める
+            target_set = set(self.targets)
+            self.ip_target_count += sum(1 for t in self.finished if t not in target_set and is_valid_ip(t))
+            self.ip_target_count += sum(1 for t in self.deferred_ips if t not in target_set and is_valid_ip(t))
+        self.finished_ip_count = sum(1 for t in self.finished if is_valid_ip(t))
+        self._resumed_ip_count = self.finished_ip_count
+        # 🆕 ドメイン行は解決直後に完了扱いで保存されるため、そのIPの照会が終わる前に中断されていれば再開時にキューへ戻す
+        # (解決したIPはドメイン行の Resolved_IPs として追記ログに残っている)
+        self.resolved_domains = {}
+        if resolve_domains:
+            for res in self.results:
+                addresses = [ip for ip in res.get('Resolved_IPs', '').split(', ') if ip and ip not in self.finished]
+                if addresses:
+                    self.resolved_domains[res['Target_IP']] = addresses
+
+        self.state = 'pending'
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.state = 'running'
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name=f"search-job-{self.job_id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def deferred_snapshot(self):
+        return dict(self.deferred_ips)
+
+    def _count_resolved(self, new_ip_count):
+        self.ip_target_count += new_ip_count
+
+    def _checkpoint_deferred(self, deferred_ips):
+        self.checkpoint.update(deferred_ips=dict(deferred_ips), finished_count=len(self.finished))
+
+    def _run(self):
+        self.checkpoint.update(status='running')
+        pending = (t for t in self.targets if t not in self.finished and t not in self.deferred_ips)
+        buffer = []
+        last_flush = time.monotonic()
+        state = 'completed'
+        try:
+            for res in iter_lookup_results(
+                pending, self.cidr_cache, self.tor_nodes, self.mode_settings,
+                use_rdap=self.use_rdap, api_key=self.api_key,
+                rate_limit_wait_seconds=self.rate_limit_wait_seconds, simple_mode=self.simple_mode,
+                deferred_ips=self.deferred_ips, cancel_event=self._cancel_event, on_deferred=self._checkpoint_deferred,
+                failover=self.failover, hedge=self.hedge,
+                offline_db=self.offline_db, offline_only=self.offline_only,
+                resolver=dns_resolver if self.resolve_domains else None, known_ips=self.finished,
+                on_resolved=self._count_resolved, resolved_domains=self.resolved_domains,
+                ptr_resolver=ptr_resolver if self.ptr_enrich else None,
+                ptr_time_budget=self.ptr_time_budget, ptr_classify=self.ptr_classify,
+            ):
+                self.results.append(res)
+                self.finished.add(res['Target_IP'])
+                if is_valid_ip(res['Target_IP']):
+                    self.finished_ip_count += 1
+                buffer.append(res)
+                if len(buffer) >= JOB_CHECKPOINT_BATCH or time.monotonic() - last_flush >= JOB_CHECKPOINT_INTERVAL_SECONDS:
+                    self.checkpoint.append_results(buffer)
+                    self._checkpoint_deferred(self.deferred_ips)
+                    buffer = []
+                    last_flush = time.monotonic()
+            if self._cancel_event.is_set():
+                state = 'cancelled'
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            state = 'failed'
+        finally:
+            self.checkpoint.append_results(buffer)
+            self.checkpoint.update(deferred_ips=dict(self.deferred_ips), finished_count=len(self.finished), status=state)
+            self.finished_at = time.time()
+            self.state = state
+
+    # 進捗 (IPターゲットのみ)。ETAは今回の実行で処理した件数から計算する
+    def progress(self):
+        elapsed = (self.finished_at or time.time()) - (self.started_at or time.time())
+        processed_now = self.finished_ip_count - self._resumed_ip_count
+        remaining = max(0, self.ip_target_count - self.finished_ip_count)
+        rate = processed_now / elapsed if elapsed > 0 else 0.0
+        return {
+            'processed': self.finished_ip_count,
+            'total': self.ip_target_count,
+            'deferred': len(self.deferred_ips),
+            'next_retry_at': min(self.deferred_ips.values(), default=None),
+            'rate': rate,
+            'eta_seconds': (remaining / rate) if rate > 0 else None,
+        }
+
+class SearchJobManager:
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    # 同じジョブが実行中ならそれを返す (二重実行しない)
+    def submit(self, checkpoint, *args, **kwargs):
+        with self._lock:
+            job = self._jobs.get(checkpoint.job_id)
+            if job is not None and job.is_running():
+                return job
+            job = BackgroundSearchJob(checkpoint, *args, **kwargs)
+            self._jobs[job.job_id] = job
+            self._prune()
+        return job.start()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.is_running()]
+
+    def _prune(self):
+        finished = sorted((job for job in self._jobs.values() if job.finished_at), key=lambda job: job.finished_at)
+        for job in finished[:max(0, len(finished) - SEARCH_JOB_KEEP_FINISHED)]:
+            del self._jobs[job.job_id]
+
+# モジュールはプロセス内で1度だけ読み込まれるため、全セッションで共有される
+search_job_manager = SearchJobManager()